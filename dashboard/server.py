@@ -1,15 +1,64 @@
 #!/usr/bin/env python3
 
 import http.server
-import socketserver
 import json
-import subprocess
 import os
+import subprocess
 import sys
+import time
+from datetime import datetime
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
+
+from status_collector import StatusCollector, diff_services
+from status_history import StatusHistory, default_path, parse_time
+from megalopolis import kubewatch, metrics, responses  # importable once status_collector has set sys.path
+
+STREAM_CLIENTS = metrics.Gauge(
+    "megalopolis_status_stream_clients",
+    "Open /api/status/stream connections"
+)
+
+# Seconds between heartbeat events on an idle status stream
+STREAM_HEARTBEAT_INTERVAL = 15
+
+_collector = None
+_history = None
+
+# /api/status bodies by collection; index.html and other files from the dashboard directory
+status_cache = responses.RepresentationCache("status", max_entries=4)
+static_files = responses.StaticFiles()
+
+
+def get_status_collector():
+    """Return the shared status collector, starting it on first use"""
+    global _collector
+    if _collector is None:
+        _collector = StatusCollector(Path(__file__).parent.parent, kube=kubewatch.from_environment(),
+                                     history=get_status_history())
+        _collector.start()
+    return _collector
+
 
-class MegalopolisStatusHandler(http.server.SimpleHTTPRequestHandler):
+def get_status_history():
+    """Return the shared status history, opening its database on first use
+
+    If the database can't be opened, history is kept in memory only.
+    """
+    global _history
+    if _history is None:
+        path = default_path()
+        try:
+            _history = StatusHistory(path)
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Status history kept in memory only, "
+                  f"can't open {path}: {e}")
+            _history = StatusHistory(None)
+    return _history
+
+
+class MegalopolisStatusHandler(responses.ResponseMixin, metrics.InstrumentedHandlerMixin,
+                               http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         # Set the directory to serve files from
         self.dashboard_dir = Path(__file__).parent
@@ -19,84 +68,161 @@ class MegalopolisStatusHandler(http.server.SimpleHTTPRequestHandler):
         parsed_path = urlparse(self.path)
         
         if parsed_path.path == '/api/status':
+            self.route = '/api/status'
             self.handle_status_api()
+        elif parsed_path.path == '/api/status/stream':
+            self.route = '/api/status/stream'
+            self.handle_status_stream()
+        elif parsed_path.path == '/api/status/history':
+            self.route = '/api/status/history'
+            self.handle_status_history(parse_qs(parsed_path.query))
+        elif parsed_path.path == '/metrics':
+            self.route = '/metrics'
+            self.send_metrics()
         elif parsed_path.path == '/' or parsed_path.path == '/index.html':
+            self.route = '/'
             self.handle_dashboard()
         else:
-            # Serve static files
-            super().do_GET()
+            # Serve static files, from memory where they are plain files
+            self.route = 'static'
+            path = self.translate_path(self.path)
+            static = static_files.get(path) if os.path.isfile(path) else None
+            if static is not None:
+                self.send_representation(200, static)
+            else:
+                super().do_GET()
     
     def handle_status_api(self):
-        """Handle API request for status data"""
+        """Handle API request for status data from the latest collected snapshot
+
+        The body is serialized once per collection (and again if it turns
+        stale), so its age_seconds is the age when it was first served.
+        """
         try:
-            # Run the status script from project root directory
-            script_path = self.dashboard_dir / 'status-api.sh'
-            project_root = self.dashboard_dir.parent
-            result = subprocess.run([str(script_path)], 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=30,
-                                  cwd=str(project_root))
-            
-            if result.returncode == 0:
-                # Parse and validate JSON
-                try:
-                    status_data = json.loads(result.stdout)
-                    self.send_json_response(status_data)
-                except json.JSONDecodeError as e:
-                    self.send_error_response(f"Invalid JSON from status script: {e}")
+            collector = get_status_collector()
+            collection = collector.collections
+            status_data = collector.snapshot(timeout=30)
+            if status_data is None:
+                self.send_error_response("Status check timed out")
             else:
-                error_msg = f"Status script failed (code {result.returncode}): stdout={result.stdout}, stderr={result.stderr}"
-                print(f"DEBUG: {error_msg}")  # Add debug logging
-                self.send_error_response(error_msg)
-                
-        except subprocess.TimeoutExpired:
-            self.send_error_response("Status check timed out")
+                self.send_json_response(status_cache.get(
+                    (collection, status_data["stale"]),
+                    lambda: responses.Representation.json(status_data)
+                ))
         except Exception as e:
             self.send_error_response(f"Unexpected error: {e}")
     
-    def handle_dashboard(self):
-        """Serve the main dashboard HTML"""
+    def handle_status_history(self, query):
+        """Handle history queries: uptime, time in state, changes and boot durations over a range
+
+        ?since= and ?until= take ISO 8601 times or durations ago (default
+        24h to now); ?service= narrows to one service and adds its most
+        recent `limit` changes.
+        """
+        now = time.time()
         try:
-            index_path = self.dashboard_dir / 'index.html'
-            with open(index_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            since = parse_time(query.get('since', ['24h'])[0], now)
+            until = parse_time(query['until'][0], now) if 'until' in query else now
+            limit = int(query.get('limit', ['100'])[0])
+        except ValueError as e:
+            self.send_error_response(str(e), 400)
+            return
+        if since >= until or limit < 1:
+            self.send_error_response("since must be before until and limit at least 1", 400)
+            return
+        service = query.get('service', [None])[0]
+        history = get_status_history()
+        if service is not None and service not in history.services():
+            self.send_error_response(f"No history for service {service}", 404)
+            return
+        try:
+            self.send_json_response(history.query(since, until, service=service, limit=limit, now=now))
         except Exception as e:
-            self.send_error_response(f"Failed to serve dashboard: {e}")
+            self.send_error_response(f"History query failed: {e}")
     
-    def send_json_response(self, data):
-        """Send JSON response with proper headers"""
-        json_data = json.dumps(data, indent=2)
+    def handle_status_stream(self):
+        """Push status changes to the client as Server-Sent Events
+
+        The first event is a full `snapshot`; after that only services whose
+        state changed are sent as `update` events. Idle streams get a
+        `heartbeat` event so the page can show when status was last checked.
+        """
+        collector = get_status_collector()
         
         self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
+        self.send_header('X-Accel-Buffering', 'no')
+        # No Content-Length: the stream ends when the connection does
+        self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json_data.encode('utf-8'))
+        self.close_connection = True
+        
+        STREAM_CLIENTS.inc()
+        try:
+            self.wfile.write(b"retry: 5000\n\n")
+            version, last = collector.wait_for_change(None, timeout=30)
+            if last is not None:
+                self.send_event('snapshot', last)
+            
+            while True:
+                new_version, current = collector.wait_for_change(version, timeout=STREAM_HEARTBEAT_INTERVAL)
+                if current is None:
+                    heartbeat = collector.heartbeat()
+                    if heartbeat is None:
+                        self.wfile.write(b": waiting for first status collection\n\n")
+                        self.wfile.flush()
+                    else:
+                        self.send_event('heartbeat', heartbeat)
+                    continue
+                
+                if last is None:
+                    self.send_event('snapshot', current)
+                else:
+                    self.send_event('update', {
+                        "timestamp": current["timestamp"],
+                        "services": diff_services(last["services"], current["services"]),
+                        "summary": current["summary"],
+                    })
+                version, last = new_version, current
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away
+            pass
+        finally:
+            STREAM_CLIENTS.dec()
+    
+    def send_event(self, event, data):
+        """Write a single Server-Sent Event"""
+        payload = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        self.wfile.write(payload.encode('utf-8'))
+        self.wfile.flush()
     
-    def send_error_response(self, message):
+    def handle_dashboard(self):
+        """Serve the main dashboard HTML from memory; browsers revalidate it with its ETag"""
+        index = static_files.get(str(self.dashboard_dir / 'index.html'))
+        if index is None:
+            self.send_error_response("Failed to serve dashboard: index.html could not be read")
+        else:
+            self.send_representation(200, index)
+    
+    def send_json_response(self, data):
+        """Send JSON response with proper headers
+
+        `data` may also be an already serialized responses.Representation.
+        """
+        if not isinstance(data, responses.Representation):
+            data = responses.Representation.json(data)
+        self.send_representation(200, data, headers={'Access-Control-Allow-Origin': '*'})
+    
+    def send_error_response(self, message, status=500):
         """Send error response as JSON"""
         error_data = {
             "error": message,
             "timestamp": subprocess.check_output(['date', '-u', '+%Y-%m-%dT%H:%M:%SZ']).decode().strip()
         }
         
-        self.send_response(500)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(error_data).encode('utf-8'))
+        self.send_json_body(status, error_data, headers={'Access-Control-Allow-Origin': '*'})
     
     def log_message(self, format, *args):
         """Custom log format"""
@@ -114,20 +240,18 @@ def main():
             print(f"Invalid port number: {sys.argv[1]}")
             sys.exit(1)
     
-    # Verify status script exists
-    script_path = Path(__file__).parent / 'status-api.sh'
-    if not script_path.exists():
-        print(f"Error: Status script not found at {script_path}")
-        sys.exit(1)
-    
-    # Make sure script is executable
-    os.chmod(script_path, 0o755)
+    # Start collecting status before the first page load
+    get_status_collector()
     
     try:
-        with socketserver.TCPServer(("", port), MegalopolisStatusHandler) as httpd:
+        # Threaded so long-lived status streams don't block other requests
+        with responses.KeepAliveHTTPServer(("", port), MegalopolisStatusHandler) as httpd:
             print(f"🏙️  Megalopolis Status Dashboard")
             print(f"📊 Server running on http://localhost:{port}")
             print(f"🔄 API endpoint: http://localhost:{port}/api/status")
+            print(f"📡 Live stream: http://localhost:{port}/api/status/stream")
+            print(f"🕑 History: http://localhost:{port}/api/status/history")
+            print(f"📈 Metrics: http://localhost:{port}/metrics")
             print(f"⏹️  Press Ctrl+C to stop")
             print()
             
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Background status collector for the Megalopolis dashboard.
+
+Runs the same checks as status-api.sh, but concurrently and with a
+timeout per probe. Collection happens once per interval on a background
+thread; /api/status is served from the most recent snapshot.
+
+Namespace and pod checks read the in-memory model of a KubeWatcher
+(megalopolis/kubewatch.py) when one is attached and synced, and fall back
+to running kubectl otherwise. With a StatusHistory attached, every
+snapshot is also recorded there for /api/status/history.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Shared modules live in the megalopolis package at the project root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from megalopolis import metrics
+from megalopolis.inventory import parse_tart_list
+from megalopolis.readiness import ReadinessProber
+
+# Seconds between collection rounds
+DEFAULT_INTERVAL = float(os.environ.get("DASHBOARD_STATUS_INTERVAL", "10"))
+
+# Seconds each individual probe may take before it counts as failed
+DEFAULT_PROBE_TIMEOUT = float(os.environ.get("DASHBOARD_PROBE_TIMEOUT", "5"))
+
+# (service key, namespace) pairs whose health is the number of Running pods
+POD_NAMESPACES = [
+    ("argocd", "argocd"),
+    ("orchard", "orchard-system"),
+]
+
+# (service key, namespace) pairs where only the namespace is expected so far
+SUPPORT_NAMESPACES = [
+    ("certmanager", "cert-manager"),
+    ("ingress", "ingress-nginx"),
+    ("externalsecrets", "external-secrets"),
+    ("monitoring", "monitoring"),
+    ("keycloak", "keycloak"),
+]
+
+TRACKED_VMS = ["macos-dev", "macos-ci"]
+
+# Detailed VM state (as reported by vm-readiness-monitor.sh) -> (status, details)
+VM_STATES = {
+    "ready": ("healthy", "Ready"),
+    "ssh-pending": ("warning", "SSH pending"),
+    "booting": ("warning", "Booting"),
+    "running": ("warning", "Running (status unknown)"),
+    "stopped": ("warning", "Stopped"),
+    "not_found": ("unhealthy", "Not found"),
+}
+
+# Fields that describe a service's state; timing fields change every round
+STATE_FIELDS = ("status", "details")
+
+CommandResult = namedtuple("CommandResult", ["returncode", "stdout", "duration", "timed_out"])
+
+COLLECTION_DURATION = metrics.Histogram(
+    "megalopolis_status_collection_duration_seconds",
+    "Wall time of one full status collection round"
+)
+COLLECTION_ERRORS = metrics.Counter(
+    "megalopolis_status_collection_errors_total",
+    "Status collection rounds that raised an exception"
+)
+PROBE_DURATION = metrics.Histogram(
+    "megalopolis_status_probe_duration_seconds",
+    "Latency of individual dashboard service probes",
+    ["service"]
+)
+
+
+def utc_timestamp():
+    """Current UTC time in the format status-api.sh uses"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def run_command(args, timeout, cwd=None):
+    """Run a probe command; never raises, returncode is None on failure to run"""
+    started = time.monotonic()
+    try:
+        result = metrics.timed_run(args, capture_output=True, text=True, timeout=timeout, cwd=cwd)
+        return CommandResult(result.returncode, result.stdout, time.monotonic() - started, False)
+    except subprocess.TimeoutExpired:
+        return CommandResult(None, "", time.monotonic() - started, True)
+    except OSError:
+        return CommandResult(None, "", time.monotonic() - started, False)
+
+
+def parse_vm_states(tart_output):
+    """Map VM name -> state from `tart list` output"""
+    return {record.name: record.state for record in parse_tart_list(tart_output)}
+
+
+def diff_services(old_services, new_services):
+    """Return the entries of new_services whose state differs from old_services"""
+    changed = {}
+    for key, entry in new_services.items():
+        previous = old_services.get(key)
+        if previous is None or any(previous.get(f) != entry.get(f) for f in STATE_FIELDS):
+            changed[key] = entry
+    return changed
+
+
+class StatusCollector:
+    """Collects dashboard status concurrently on a fixed interval"""
+
+    def __init__(self, project_root, interval=DEFAULT_INTERVAL, probe_timeout=DEFAULT_PROBE_TIMEOUT, kube=None,
+                 history=None):
+        self.project_root = Path(project_root)
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.kube = kube
+        self.history = history
+
+        # Tool paths, matching status-api.sh
+        self.kubectl = str(self.project_root / "kubectl")
+        self.tart = str(self.project_root / "tart-binary")
+        self.kind = str(self.project_root / "kind-binary")
+
+        self.prober = ReadinessProber(self.tart, connect_timeout=min(3, probe_timeout), ip_timeout=probe_timeout)
+
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="status-probe")
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._collected_at = None  # time.monotonic() of the current snapshot
+        self._version = 0  # bumped whenever a service changes state
+        self.collections = 0  # completed collections, for caching responses per collection
+        self._thread = None
+
+        metrics.Gauge(
+            "megalopolis_status_snapshot_age_seconds",
+            "Age of the status snapshot served by /api/status",
+            func=self._snapshot_age
+        )
+
+    def _snapshot_age(self):
+        with self._cond:
+            if self._collected_at is None:
+                return None
+            return time.monotonic() - self._collected_at
+
+    def start(self):
+        """Start collecting in the background"""
+        if self._thread is None:
+            if self.kube is not None:
+                self.kube.start()
+            self._thread = threading.Thread(target=self._collect_loop, name="status-collector", daemon=True)
+            self._thread.start()
+
+    def _collect_loop(self):
+        while True:
+            try:
+                snapshot = self.collect()
+                with self._cond:
+                    if self._snapshot is None or diff_services(self._snapshot["services"], snapshot["services"]):
+                        self._version += 1
+                    self._snapshot = snapshot
+                    self._collected_at = time.monotonic()
+                    self.collections += 1
+                    self._cond.notify_all()
+                if self.history is not None:
+                    self.history.record(snapshot)
+            except Exception as e:
+                COLLECTION_ERRORS.inc()
+                print(f"[{utc_timestamp()}] Status collection failed: {e}")
+            time.sleep(self.interval)
+
+    def snapshot(self, timeout=None):
+        """Return the latest status document, waiting up to `timeout` for the first one"""
+        return self.wait_for_change(None, timeout)[1]
+
+    def wait_for_change(self, version, timeout=None):
+        """Wait until the state differs from `version` (None: any snapshot)
+
+        Returns (version, snapshot), or (version, None) if nothing changed
+        within `timeout` seconds.
+        """
+        with self._cond:
+            if version is None:
+                ready = self._cond.wait_for(lambda: self._snapshot is not None, timeout)
+            else:
+                ready = self._cond.wait_for(lambda: self._version != version, timeout)
+            if not ready:
+                return version, None
+            age = time.monotonic() - self._collected_at
+            snapshot = dict(self._snapshot)
+            version = self._version
+
+        snapshot["age_seconds"] = round(age, 3)
+        snapshot["stale"] = age > 2 * self.interval
+        return version, snapshot
+
+    def heartbeat(self):
+        """Timestamp and age of the latest collection, for stream keepalives"""
+        with self._cond:
+            if self._snapshot is None:
+                return None
+            age = time.monotonic() - self._collected_at
+            return {
+                "timestamp": self._snapshot["timestamp"],
+                "age_seconds": round(age, 3),
+                "stale": age > 2 * self.interval,
+            }
+
+    def _run(self, args):
+        return run_command(args, self.probe_timeout, cwd=str(self.project_root))
+
+    def collect(self):
+        """Run every probe once and return a status document"""
+        started = time.monotonic()
+        watched = self.kube.namespaces() if self.kube is not None and self.kube.synced else None
+        commands = {
+            "docker": ["docker", "info"],
+            "kind": [self.kind, "get", "clusters"],
+            "kubectl": [self.kubectl, "version"],
+            "tart": [self.tart, "list"],
+            "network": ["docker", "network", "ls"],
+        }
+        if watched is None:
+            commands["namespaces"] = [self.kubectl, "get", "namespaces", "-o", "name"]
+            for _, namespace in POD_NAMESPACES:
+                commands[f"pods/{namespace}"] = [self.kubectl, "get", "pods", "-n", namespace, "--no-headers"]
+
+        futures = {name: self._executor.submit(self._run, args) for name, args in commands.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+        # VM readiness needs the `tart list` output, so it runs as a second wave
+        tart_result = results["tart"]
+        vm_states = parse_vm_states(tart_result.stdout) if tart_result.returncode == 0 else {}
+        readiness_future = self._executor.submit(
+            self.prober.check, {vm_name: vm_states.get(vm_name) for vm_name in TRACKED_VMS}
+        )
+
+        checked_at = utc_timestamp()
+        services = {}
+
+        def add(key, status, details, result_or_duration, timed_out=False):
+            if isinstance(result_or_duration, CommandResult):
+                duration = result_or_duration.duration
+                timed_out = result_or_duration.timed_out
+            else:
+                duration = result_or_duration
+            services[key] = {
+                "status": status,
+                "details": details,
+                "latency_ms": round(duration * 1000, 1),
+                "timed_out": timed_out,
+                "checked_at": checked_at,
+            }
+
+        def succeeded(result):
+            return result.returncode == 0
+
+        # Infrastructure
+        add("docker", "healthy" if succeeded(results["docker"]) else "unhealthy",
+            "Container runtime", results["docker"])
+        kind_ok = succeeded(results["kind"]) and "homelab" in results["kind"].stdout
+        add("kind", "healthy" if kind_ok else "unhealthy", "Kubernetes cluster", results["kind"])
+        add("kubectl", "healthy" if succeeded(results["kubectl"]) else "unhealthy",
+            "Kubernetes client", results["kubectl"])
+        add("tart", "healthy" if succeeded(tart_result) else "unhealthy", "VM management", tart_result)
+
+        # Kubernetes services, from the watch model when there is one
+        if watched is not None:
+            namespace_result = CommandResult(0, "", 0.0, False)
+            namespaces = set(watched)
+        else:
+            namespace_result = results["namespaces"]
+            namespaces = set()
+            if succeeded(namespace_result):
+                namespaces = {line.split("/", 1)[-1] for line in namespace_result.stdout.split()}
+
+        for key, namespace in POD_NAMESPACES:
+            if watched is not None:
+                duration, timed_out = 0.0, False
+            else:
+                pods_result = results[f"pods/{namespace}"]
+                duration = namespace_result.duration + pods_result.duration
+                timed_out = namespace_result.timed_out or pods_result.timed_out
+            if namespace in namespaces:
+                if watched is not None:
+                    running = watched[namespace]["running"]
+                else:
+                    running = sum(1 for line in pods_result.stdout.splitlines() if "Running" in line)
+                add(key, "healthy" if running > 0 else "unhealthy", f"{running} pods running",
+                    duration, timed_out)
+            else:
+                add(key, "unhealthy", "Namespace not found", duration, timed_out)
+
+        # Support services (namespace-only checks)
+        for key, namespace in SUPPORT_NAMESPACES:
+            # Namespace exists but no pods expected yet
+            add(key, "warning" if namespace in namespaces else "unhealthy", "Namespace ready",
+                namespace_result)
+
+        # Network
+        network_ok = succeeded(results["network"]) and "kind" in results["network"].stdout
+        add("network", "healthy" if network_ok else "unhealthy", "Docker networking", results["network"])
+
+        # Virtual machines
+        for vm_name, readiness in readiness_future.result().items():
+            status, details = VM_STATES.get(readiness.state, ("unhealthy", "Unknown"))
+            add(vm_name, status, details, tart_result.duration + readiness.latency, tart_result.timed_out)
+
+        running_vms = sum(1 for state in vm_states.values() if state == "running")
+        if running_vms > 0:
+            total_status = "healthy"
+        elif vm_states:
+            total_status = "warning"
+        else:
+            total_status = "unhealthy"
+        add("total-vms", total_status, f"{running_vms} running / {len(vm_states)} total", tart_result)
+
+        for key, service in services.items():
+            PROBE_DURATION.observe(service["latency_ms"] / 1000, service=key)
+        COLLECTION_DURATION.observe(time.monotonic() - started)
+
+        summary = {"healthy": 0, "warning": 0, "unhealthy": 0}
+        for service in services.values():
+            if service["status"] in summary:
+                summary[service["status"]] += 1
+
+        return {
+            "timestamp": checked_at,
+            "services": services,
+            "summary": summary,
+            "collection": {
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+                "interval_seconds": self.interval,
+                "probe_timeout_seconds": self.probe_timeout,
+                "kubernetes_source": "watch" if watched is not None else "kubectl",
+            },
+        }
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Status history for the dashboard.
+
+StatusCollector keeps only the latest snapshot. StatusHistory records every
+change of a service's status or details. Recent changes go into a
+fixed-size ring buffer per service, and all of them go into a SQLite file
+(DASHBOARD_HISTORY_DB). Changes older than DASHBOARD_HISTORY_RAW_DAYS are
+downsampled into hourly time-in-state buckets, which are kept for
+DASHBOARD_HISTORY_DAYS.
+
+Queries (uptime, time in each state, changes, boot duration percentiles)
+stream over the ring buffer when it covers the requested range, and over
+the database otherwise. They never load the whole history.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+from megalopolis import metrics
+
+# Changes kept in memory per service
+DEFAULT_RING_SIZE = int(os.environ.get("DASHBOARD_HISTORY_RING", "1000"))
+
+# Changes older than this are rolled up into hourly buckets
+DEFAULT_RAW_DAYS = float(os.environ.get("DASHBOARD_HISTORY_RAW_DAYS", "7"))
+
+# Hourly buckets and boot durations older than this are deleted
+DEFAULT_KEEP_DAYS = float(os.environ.get("DASHBOARD_HISTORY_DAYS", "90"))
+
+# VM details (status_collector.VM_STATES) that start, finish and cancel a boot
+BOOT_STARTED = ("Booting", "SSH pending", "Running (status unknown)")
+BOOT_FINISHED = "Ready"
+BOOT_CANCELLED = ("Stopped", "Not found")
+
+# Recorded for every service over the time the dashboard was not running
+UNKNOWN = ("unknown", "No data")
+
+HOUR = 3600
+COMPACT_INTERVAL = HOUR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transitions (
+    service TEXT NOT NULL, at REAL NOT NULL, status TEXT NOT NULL, details TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_service_at ON transitions (service, at);
+CREATE TABLE IF NOT EXISTS rollups (
+    service TEXT NOT NULL, hour REAL NOT NULL, status TEXT NOT NULL, details TEXT NOT NULL,
+    seconds REAL NOT NULL, transitions INTEGER NOT NULL,
+    PRIMARY KEY (service, hour, status, details)
+);
+CREATE TABLE IF NOT EXISTS boots (service TEXT NOT NULL, at REAL NOT NULL, seconds REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS boots_service_at ON boots (service, at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+HISTORY_TRANSITIONS = metrics.Counter(
+    "megalopolis_status_history_transitions_total",
+    "Service status changes recorded in the status history"
+)
+
+
+def default_path():
+    """DASHBOARD_HISTORY_DB, default ~/.megalopolis/status-history.db; None when set to 'off'"""
+    value = os.environ.get("DASHBOARD_HISTORY_DB", "~/.megalopolis/status-history.db")
+    if value.lower() in ("", "off", "none", "0"):
+        return None
+    return Path(os.path.expanduser(value))
+
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_time(value, now):
+    """Epoch seconds from an ISO 8601 time or a duration ago such as '90s', '30m', '24h', '7d'"""
+    units = {"s": 1, "m": 60, "h": HOUR, "d": 86400}
+    if value[-1:] in units:
+        try:
+            return now - float(value[:-1]) * units[value[-1]]
+        except ValueError:
+            pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"invalid time {value!r}: use ISO 8601 or a duration like 24h") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _hours(start, end):
+    """(hour start, seconds) for each hour bucket that [start, end) overlaps"""
+    hour = math.floor(start / HOUR) * HOUR
+    while hour < end:
+        yield hour, min(end, hour + HOUR) - max(start, hour)
+        hour += HOUR
+
+
+class _Totals:
+    """Time in each (status, details) and number of changes over a range"""
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.transitions = 0
+
+    def add_span(self, state, start, end):
+        if state is not None and end > start:
+            self.seconds[state] += end - start
+
+    def to_dict(self):
+        by_status = Counter()
+        by_details = Counter()
+        for (status, details), seconds in self.seconds.items():
+            by_status[status] += seconds
+            by_details[details] += seconds
+        unknown = by_status.pop(UNKNOWN[0], 0)
+        by_details.pop(UNKNOWN[1], None)
+        observed = sum(by_status.values())
+        return {
+            "uptime_pct": round(100 * by_status["healthy"] / observed, 2) if observed else None,
+            "observed_seconds": round(observed, 1),
+            "unknown_seconds": round(unknown, 1),
+            "time_in_status": {k: round(v, 1) for k, v in by_status.most_common()},
+            "time_in_state": {k: round(v, 1) for k, v in by_details.most_common()},
+            "transitions": self.transitions,
+        }
+
+
+class StatusHistory:
+    """Per-service ring buffers of status changes, backed by SQLite"""
+
+    def __init__(self, path=None, ring_size=DEFAULT_RING_SIZE, raw_days=DEFAULT_RAW_DAYS,
+                 keep_days=DEFAULT_KEEP_DAYS):
+        self.path = Path(path) if path else None
+        self.ring_size = ring_size
+        self.raw_seconds = raw_days * 86400
+        self.keep_seconds = keep_days * 86400
+        self._lock = threading.Lock()
+        self._rings = {}
+        self._current = {}
+        self._boot_started = {}
+        self._rolled_up_until = 0.0
+        self._compacted_at = 0.0
+        self._db = None
+        if self.path is not None:
+            self._open()
+
+    # Storage
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        self._rolled_up_until = meta.get("rolled_up_until", 0.0)
+        last_seen = meta.get("last_seen")
+
+        latest = self._db.execute(
+            "SELECT service, status, details, MAX(at) FROM transitions GROUP BY service"
+        ).fetchall()
+        with self._db:
+            for service, status, details, at in latest:
+                # Whatever happened while the dashboard was down is unknown
+                if last_seen is not None and at <= last_seen and (status, details) != UNKNOWN:
+                    self._db.execute("INSERT INTO transitions VALUES (?, ?, ?, ?)", (service, last_seen, *UNKNOWN))
+        for (service,) in self._db.execute("SELECT DISTINCT service FROM transitions").fetchall():
+            rows = self._db.execute(
+                "SELECT at, status, details FROM transitions WHERE service = ? ORDER BY at DESC, rowid DESC LIMIT ?",
+                (service, self.ring_size)
+            ).fetchall()
+            self._rings[service] = deque(reversed(rows), maxlen=self.ring_size)
+            self._current[service] = rows[0][1:]
+
+    def _reader(self):
+        """A read-only connection for one query; WAL lets it run alongside the writer"""
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    # Recording
+
+    def record(self, snapshot, now=None):
+        """Record the services in a StatusCollector snapshot whose status or details changed"""
+        now = time.time() if now is None else now
+        changes = []
+        boots = []
+        with self._lock:
+            for service, entry in snapshot["services"].items():
+                state = (entry["status"], entry["details"])
+                previous = self._current.get(service)
+                if previous == state:
+                    continue
+                self._current[service] = state
+                ring = self._rings.setdefault(service, deque(maxlen=self.ring_size))
+                ring.append((now, *state))
+                changes.append((service, now, *state))
+                boot = self._track_boot(service, previous, state[1], now)
+                if boot is not None:
+                    boots.append((service, now, boot))
+
+            if self._db is not None:
+                with self._db:
+                    self._db.executemany("INSERT INTO transitions VALUES (?, ?, ?, ?)", changes)
+                    self._db.executemany("INSERT INTO boots VALUES (?, ?, ?)", boots)
+                    self._db.execute("INSERT OR REPLACE INTO meta VALUES ('last_seen', ?)", (now,))
+                if now - self._compacted_at >= COMPACT_INTERVAL:
+                    self._compact_locked(now)
+        HISTORY_TRANSITIONS.inc(len(changes))
+
+    def _track_boot(self, service, previous, details, now):
+        """Seconds from leaving Stopped/Not found to Ready, once a VM gets there"""
+        if details in BOOT_CANCELLED:
+            self._boot_started.pop(service, None)
+        elif details in BOOT_STARTED:
+            if previous is not None and previous[1] in BOOT_CANCELLED:
+                self._boot_started[service] = now
+        elif details == BOOT_FINISHED and service in self._boot_started:
+            return now - self._boot_started.pop(service)
+        return None
+
+    def _compact_locked(self, now):
+        """Roll raw changes older than the raw retention up into hourly buckets"""
+        self._compacted_at = now
+        cutoff = math.floor((now - self.raw_seconds) / HOUR) * HOUR
+        if cutoff > self._rolled_up_until:
+            start = self._rolled_up_until
+            services = [row[0] for row in self._db.execute(
+                "SELECT DISTINCT service FROM transitions WHERE at < ?", (cutoff,))]
+            with self._db:
+                for service in services:
+                    buckets = Counter()
+                    counts = Counter()
+                    state, since = None, start
+                    row = self._db.execute(
+                        "SELECT status, details FROM transitions WHERE service = ? AND at <= ? "
+                        "ORDER BY at DESC, rowid DESC LIMIT 1", (service, start)).fetchone()
+                    if row is not None:
+                        state = tuple(row)
+                    for at, status, details in self._db.execute(
+                            "SELECT at, status, details FROM transitions WHERE service = ? AND at > ? AND at < ? "
+                            "ORDER BY at, rowid", (service, start, cutoff)):
+                        if state is not None:
+                            for hour, seconds in _hours(since, at):
+                                buckets[(hour, *state)] += seconds
+                        state, since = (status, details), at
+                        counts[(math.floor(at / HOUR) * HOUR, status, details)] += 1
+                    if state is not None:
+                        for hour, seconds in _hours(since, cutoff):
+                            buckets[(hour, *state)] += seconds
+                    self._db.executemany(
+                        "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (service, hour, status, details) DO UPDATE SET "
+                        "seconds = seconds + excluded.seconds, transitions = transitions + excluded.transitions",
+                        [(service, *key, seconds, counts.pop(key, 0)) for key, seconds in buckets.items()]
+                        + [(service, *key, 0, count) for key, count in counts.items()]
+                    )
+                    # Keep the last change before the cutoff: it is the state at the cutoff
+                    self._db.execute(
+                        "DELETE FROM transitions WHERE service = ? AND at < ? AND at < "
+                        "(SELECT MAX(at) FROM transitions WHERE service = ? AND at < ?)",
+                        (service, cutoff, service, cutoff)
+                    )
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('rolled_up_until', ?)", (cutoff,))
+            self._rolled_up_until = cutoff
+        with self._db:
+            self._db.execute("DELETE FROM rollups WHERE hour < ?", (now - self.keep_seconds,))
+            self._db.execute("DELETE FROM boots WHERE at < ?", (now - self.keep_seconds,))
+
+    # Queries
+
+    def services(self):
+        with self._lock:
+            return sorted(self._current)
+
+    def _ring_covering(self, service, start):
+        """A copy of the service's ring buffer if it holds every change from `start` on, else None"""
+        with self._lock:
+            ring = self._rings.get(service)
+            if not ring:
+                return []
+            # A ring that isn't full yet holds the service's whole history
+            if ring[0][0] <= start or len(ring) < self.ring_size or self._db is None:
+                return list(ring)
+        return None
+
+    def _changes(self, service, start, end, conn):
+        """(state at `start`, iterator of (at, status, details) in (start, end))"""
+        ring = self._ring_covering(service, start)
+        if ring is not None or conn is None:
+            initial = None
+            for at, status, details in ring:
+                if at > start:
+                    break
+                initial = (status, details)
+            return initial, iter([entry for entry in ring if start < entry[0] < end])
+        row = conn.execute(
+            "SELECT status, details FROM transitions WHERE service = ? AND at <= ? "
+            "ORDER BY at DESC, rowid DESC LIMIT 1", (service, start)).fetchone()
+        return (tuple(row) if row else None), conn.execute(
+            "SELECT at, status, details FROM transitions WHERE service = ? AND at > ? AND at < ? ORDER BY at, rowid",
+            (service, start, end))
+
+    def summary(self, service, since, until, now=None, conn=None):
+        """Uptime, time in each status and state, changes and boot durations over [since, until)"""
+        now = time.time() if now is None else now
+        until = min(until, now)
+        totals = _Totals()
+
+        # Older than the raw retention: hourly buckets
+        rolled = self._rolled_up_until
+        if conn is not None and since < rolled:
+            for status, details, seconds, transitions in conn.execute(
+                    "SELECT status, details, SUM(seconds), SUM(transitions) FROM rollups "
+                    "WHERE service = ? AND hour >= ? AND hour < ? GROUP BY status, details",
+                    (service, math.floor(since / HOUR) * HOUR, min(until, rolled))):
+                totals.seconds[(status, details)] += seconds
+                totals.transitions += transitions
+
+        # Newer: raw changes, from the ring buffer when it reaches back far enough
+        start = max(since, rolled) if conn is not None else since
+        if start < until:
+            state, changes = self._changes(service, start, until, conn)
+            position = start
+            for at, status, details in changes:
+                totals.add_span(state, position, at)
+                state, position = (status, details), at
+                totals.transitions += 1
+            totals.add_span(state, position, until)
+
+        result = totals.to_dict()
+        boots = self._boot_percentiles(service, since, until, conn)
+        if boots is not None:
+            result["boot_seconds"] = boots
+        return result
+
+    def _boot_percentiles(self, service, since, until, conn):
+        if conn is None:
+            return None
+        where = "FROM boots WHERE service = ? AND at >= ? AND at < ?"
+        args = (service, since, until)
+        count = conn.execute(f"SELECT COUNT(*) {where}", args).fetchone()[0]
+        if not count:
+            return None
+        result = {"count": count}
+        for name, pct in (("p50", 50), ("p95", 95), ("p99", 99)):
+            offset = max(1, int(round(pct / 100 * count))) - 1
+            value = conn.execute(f"SELECT seconds {where} ORDER BY seconds LIMIT 1 OFFSET ?",
+                                 args + (offset,)).fetchone()[0]
+            result[name] = round(value, 1)
+        result["max"] = round(conn.execute(f"SELECT MAX(seconds) {where}", args).fetchone()[0], 1)
+        return result
+
+    def recent(self, service, since, until, limit=100, conn=None):
+        """The last `limit` changes of a service within [since, until), oldest first"""
+        ring = self._ring_covering(service, since)
+        if ring is not None or conn is None:
+            rows = [entry for entry in (ring or []) if since <= entry[0] < until][-limit:]
+        else:
+            rows = conn.execute(
+                "SELECT at, status, details FROM transitions WHERE service = ? AND at >= ? AND at < ? "
+                "ORDER BY at DESC, rowid DESC LIMIT ?", (service, since, until, limit)).fetchall()[::-1]
+        return [{"at": iso(at), "status": status, "details": details} for at, status, details in rows]
+
+    def query(self, since, until, service=None, limit=100, now=None):
+        """Document for /api/status/history: one service with its recent changes, or all services"""
+        now = time.time() if now is None else now
+        conn = self._reader() if self._db is not None else None
+        try:
+            document = {"since": iso(since), "until": iso(min(until, now))}
+            if service is not None:
+                document["service"] = service
+                document.update(self.summary(service, since, until, now, conn))
+                document["recent"] = self.recent(service, since, until, limit, conn)
+            else:
+                document["services"] = {name: self.summary(name, since, until, now, conn)
+                                        for name in self.services()}
+            return document
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,6 @@
+"""
+Shared Python modules for the Megalopolis VM API and status dashboard.
+
+scripts/minimal-vm-api.py and dashboard/server.py both import from here;
+everything is standard library only so the VM operator image stays slim.
+"""
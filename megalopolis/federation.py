@@ -0,0 +1,400 @@
+"""
+Several VM API nodes behind one front end.
+
+Each Mac runs its own minimal-vm-api.py, so clients used to have to know
+which host had capacity. A Federation keeps a registry of nodes
+(VM_FEDERATION_NODES, or POST /nodes on the front end). On an interval it
+health-checks every node over pooled keep-alive connections and caches
+the node's /health, /scheduler, /pools and /vms. scripts/vm-federation.py
+serves the merged inventory from that cache. It routes starts and pool
+acquires to the least-loaded node that can take them.
+"""
+
+import http.client
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from megalopolis import metrics
+
+# Seconds between health checks of every node
+DEFAULT_INTERVAL = float(os.environ.get("VM_FEDERATION_INTERVAL", "5"))
+
+# Seconds a node may take to answer one request
+DEFAULT_TIMEOUT = float(os.environ.get("VM_FEDERATION_TIMEOUT", "10"))
+
+# Consecutive failed checks before a node is taken out of routing
+DOWN_AFTER = 2
+
+# Idle keep-alive connections kept per node
+MAX_IDLE_CONNECTIONS = 4
+
+NodeResponse = namedtuple("NodeResponse", ["status", "headers", "body"])
+
+NODE_REQUESTS = metrics.Counter(
+    "megalopolis_federation_node_requests_total",
+    "Requests sent to federated nodes, by outcome (HTTP status class or error)",
+    ["node", "result"]
+)
+NODE_LATENCY = metrics.Histogram(
+    "megalopolis_federation_node_request_duration_seconds",
+    "Latency of requests to federated nodes",
+    ["node"]
+)
+CONNECTIONS_OPENED = metrics.Counter(
+    "megalopolis_federation_connections_opened_total",
+    "New connections opened to federated nodes (the rest reuse pooled ones)",
+    ["node"]
+)
+
+
+class NodeError(Exception):
+    """A node could not be reached or dropped the connection"""
+
+
+def parse_nodes(spec):
+    """{name: url} from 'mac1=http://mac1.local:8082,mac2=http://10.0.0.5:8082'"""
+    nodes = {}
+    for entry in (spec or "").replace("\n", ",").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        if not sep:
+            name, url = urlsplit(entry).netloc or entry, entry
+        nodes[name.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+def decode_json(body):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+class NodeClient:
+    """HTTP client for one node, keeping idle connections open for reuse"""
+
+    def __init__(self, name, url, timeout=DEFAULT_TIMEOUT, max_idle=MAX_IDLE_CONNECTIONS):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"node URL must be http(s)://host[:port], got {url!r}")
+        self.name = name
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port
+        self.secure = parts.scheme == "https"
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _connect(self, timeout):
+        CONNECTIONS_OPENED.inc(node=self.name)
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send one request; returns a NodeResponse or raises NodeError
+
+        A pooled connection the node has since closed fails on first use;
+        that request is retried once on a new connection.
+        """
+        timeout = timeout or self.timeout
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault("Content-Type", "application/json")
+        started = time.monotonic()
+        for attempt in (0, 1):
+            with self._lock:
+                conn = self._idle.pop() if self._idle and attempt == 0 else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(timeout)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, self.base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                conn.close()
+                if reused:
+                    continue
+                NODE_REQUESTS.inc(node=self.name, result="error")
+                raise NodeError(f"{self.name}: {e}") from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                NODE_REQUESTS.inc(node=self.name, result="error")
+                raise NodeError(f"{self.name}: {e}") from e
+
+            NODE_LATENCY.observe(time.monotonic() - started, node=self.name)
+            NODE_REQUESTS.inc(node=self.name, result=f"{response.status // 100}xx")
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.max_idle:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            return NodeResponse(response.status, dict(response.getheaders()), data)
+        raise NodeError(f"{self.name}: connection closed")
+
+    def get_json(self, path, timeout=None):
+        """GET a JSON document; raises NodeError unless the node answers 200"""
+        response = self.request("GET", path, timeout=timeout)
+        if response.status != 200:
+            raise NodeError(f"{self.name}: GET {path} returned {response.status}")
+        return decode_json(response.body)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Node:
+    """A registered node and what its last health check found"""
+
+    def __init__(self, client):
+        self.client = client
+        self.name = client.name
+        self.up = False
+        self.failures = 0
+        self.last_error = None
+        self.checked_at = None  # time.monotonic() of the last successful check
+        self.check_ms = None
+        self.health = {}
+        self.scheduler = {}
+        self.pools = []
+        self.vms = []
+        self.routed = 0  # starts/acquires sent since the last check
+
+    def load(self):
+        """Share of capacity committed, 0 (idle) to 1 (full); queued starts push it past 1
+
+        Uses the node's capacity scheduler when it has one, otherwise its
+        share of operation slots in flight. Starts routed since the last
+        check count too, so a burst doesn't all land on the same node.
+        """
+        scheduler = self.scheduler or {}
+        capacity = scheduler.get("capacity") or {}
+        committed = scheduler.get("committed") or {}
+        if scheduler.get("enabled") and capacity.get("max_vms"):
+            shares = [
+                committed.get("memory_mb", 0) / capacity["memory_mb"] if capacity.get("memory_mb") else 1,
+                committed.get("cpu", 0) / capacity["cpu"] if capacity.get("cpu") else 1,
+                (committed.get("vms", 0) + self.routed) / capacity["max_vms"],
+            ]
+            return max(shares) + scheduler.get("queue_depth", 0) / capacity["max_vms"]
+        slots = self.health.get("max_concurrent_operations") or 1
+        return (self.health.get("operations_in_flight", 0) + self.routed) / slots
+
+    def running_vms(self):
+        return sum(1 for vm in self.vms if vm.get("status") == "running")
+
+    def ready_in_pool(self, template):
+        for pool in self.pools:
+            if pool.get("template") == template:
+                return (pool.get("vms") or {}).get("ready", 0)
+        return None
+
+    def to_dict(self):
+        age = time.monotonic() - self.checked_at if self.checked_at is not None else None
+        return {
+            "name": self.name,
+            "url": self.client.url,
+            "up": self.up,
+            "load": round(self.load(), 3) if self.up else None,
+            "vms": len(self.vms),
+            "running_vms": self.running_vms(),
+            "pools": {p.get("template"): (p.get("vms") or {}).get("ready", 0) for p in self.pools},
+            "scheduler": bool(self.scheduler.get("enabled")),
+            "check_ms": self.check_ms,
+            "checked_seconds_ago": round(age, 1) if age is not None else None,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class Federation:
+    """Registry of nodes with cached state, merged inventory and load-based routing"""
+
+    def __init__(self, nodes=None, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT, down_after=DOWN_AFTER):
+        self.interval = interval
+        self.timeout = timeout
+        self.down_after = down_after
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="federation-check")
+        self._thread = None
+        self._wake = threading.Event()
+        for name, url in (nodes or {}).items():
+            self.add(name, url, check=False)
+
+        metrics.Gauge(
+            "megalopolis_federation_node_up",
+            "1 if the node passed its last health check",
+            ["node"],
+            func=lambda: {(n.name,): 1 if n.up else 0 for n in self.nodes()}
+        )
+        metrics.Gauge(
+            "megalopolis_federation_node_load",
+            "Share of the node's capacity committed, as used for routing",
+            ["node"],
+            func=lambda: {(n.name,): n.load() for n in self.nodes(up=True)}
+        )
+
+    # Registry
+
+    def add(self, name, url, check=True):
+        """Register (or re-point) a node; raises ValueError for a bad name or URL"""
+        if not name or ":" in name or "/" in name:
+            raise ValueError(f"node name must be non-empty without ':' or '/', got {name!r}")
+        node = Node(NodeClient(name, url, timeout=self.timeout))
+        with self._lock:
+            previous = self._nodes.get(name)
+            self._nodes[name] = node
+        if previous is not None:
+            previous.client.close()
+        if check:
+            self.check(node)
+        return node
+
+    def remove(self, name):
+        with self._lock:
+            node = self._nodes.pop(name, None)
+        if node is not None:
+            node.client.close()
+        return node is not None
+
+    def get(self, name):
+        with self._lock:
+            return self._nodes.get(name)
+
+    def nodes(self, up=None):
+        with self._lock:
+            nodes = sorted(self._nodes.values(), key=lambda n: n.name)
+        return [n for n in nodes if up is None or n.up == up]
+
+    # Health checks
+
+    def check(self, node):
+        """Refresh one node's cached health, capacity, pools and inventory"""
+        started = time.monotonic()
+        try:
+            health = node.client.get_json("/health")
+            scheduler = node.client.get_json("/scheduler")
+            pools = node.client.get_json("/pools")
+            vms = node.client.get_json("/vms")
+        except NodeError as e:
+            node.failures += 1
+            node.last_error = str(e)
+            if node.failures >= self.down_after:
+                node.up = False
+        else:
+            node.health = health or {}
+            node.scheduler = scheduler or {}
+            node.pools = pools or []
+            node.vms = [dict(vm, host=node.name) for vm in vms or []]
+            node.routed = 0
+            node.up = True
+            node.failures = 0
+            node.last_error = None
+            node.checked_at = time.monotonic()
+            node.check_ms = round((time.monotonic() - started) * 1000, 1)
+        return node.up
+
+    def check_all(self):
+        """Check every node in parallel; returns {name: up}"""
+        nodes = self.nodes()
+        return dict(zip((n.name for n in nodes), self._executor.map(self.check, nodes)))
+
+    def start(self):
+        """Check nodes on a background thread every interval"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._check_loop, name="federation", daemon=True)
+            self._thread.start()
+
+    def _check_loop(self):
+        while True:
+            try:
+                self.check_all()
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Federation health check failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refresh_soon(self):
+        """Run the next health check now instead of at the end of the interval"""
+        self._wake.set()
+
+    # Inventory
+
+    def inventory(self, state=None, source=None, host=None):
+        """Merged VM list from every up node, each with a `host`, sorted by (name, host)
+
+        Returns (vms, age) where age is the oldest node snapshot in seconds.
+        """
+        vms = []
+        oldest = None
+        for node in self.nodes(up=True):
+            if host is not None and node.name != host:
+                continue
+            vms.extend(node.vms)
+            if node.checked_at is not None:
+                oldest = min(oldest, node.checked_at) if oldest is not None else node.checked_at
+        vms = [vm for vm in vms
+               if (state is None or vm.get("status") == state)
+               and (source is None or (vm.get("source") or "").lower() == source.lower())]
+        vms.sort(key=lambda vm: (vm.get("name") or "", vm["host"]))
+        return vms, (time.monotonic() - oldest if oldest is not None else None)
+
+    def locate(self, vm_name, host=None, state=None):
+        """Up nodes that have `vm_name` (optionally only in `state`), least loaded first"""
+        nodes = [
+            node for node in self.nodes(up=True)
+            if (host is None or node.name == host)
+            and any(vm.get("name") == vm_name and (state is None or vm.get("status") == state) for vm in node.vms)
+        ]
+        return sorted(nodes, key=self._load_key)
+
+    def pool_candidates(self, template, host=None):
+        """Up nodes with a warm pool for `template`: ones with ready VMs first, then least loaded"""
+        nodes = [node for node in self.nodes(up=True)
+                 if (host is None or node.name == host) and node.ready_in_pool(template) is not None]
+        return sorted(nodes, key=lambda node: (node.ready_in_pool(template) <= 0,) + self._load_key(node))
+
+    def _load_key(self, node):
+        return (round(node.load(), 3), node.running_vms(), node.name)
+
+    def routed(self, node):
+        """Count a start or acquire against `node` until its next health check"""
+        with self._lock:
+            node.routed += 1
+
+    def mark_failed(self, node, error):
+        """A forwarded request could not reach `node`: recheck it right away"""
+        node.last_error = str(error)
+        self.refresh_soon()
+
+    def status(self):
+        nodes = self.nodes()
+        return {
+            "nodes": len(nodes),
+            "up": sum(1 for n in nodes if n.up),
+            "vms": sum(len(n.vms) for n in nodes if n.up),
+            "running_vms": sum(n.running_vms() for n in nodes if n.up),
+        }
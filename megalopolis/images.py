@@ -0,0 +1,325 @@
+"""
+Local cache of the OCI base images in tart/base-images.yaml.
+
+Base images are tens of GB, so the first clone of a template used to
+block on a lazy `tart clone` pull. The cache pre-pulls every configured
+image in the background, and concurrent requests for the same image share
+a single `tart pull`. It keeps an index of digest, size, pull time and
+last clone per image. With a disk budget, the least recently cloned images
+are deleted until the cache fits.
+
+The index is a small JSON file (VM_API_IMAGE_INDEX, default
+~/.megalopolis/images.json); tart itself remains the source of truth for
+which images are present.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from megalopolis import metrics
+
+IMAGE_PULL_DURATION = metrics.Histogram(
+    "megalopolis_image_pull_duration_seconds",
+    "Time taken by `tart pull` of a base image",
+    ["image"],
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+IMAGE_PULL_FAILURES = metrics.Counter(
+    "megalopolis_image_pull_failures_total",
+    "Base image pulls that failed",
+    ["image"]
+)
+IMAGE_EVICTIONS = metrics.Counter(
+    "megalopolis_image_evictions_total",
+    "Base images deleted to stay within the disk budget"
+)
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def default_index_path():
+    return Path(os.path.expanduser(os.environ.get("VM_API_IMAGE_INDEX", "~/.megalopolis/images.json")))
+
+
+def default_budget_gb():
+    """Disk budget from VM_API_IMAGE_BUDGET_GB; 0 (the default) disables eviction"""
+    return float(os.environ.get("VM_API_IMAGE_BUDGET_GB", "0"))
+
+
+def configured_images(base_images):
+    """Image sources from load_base_images(), in file order without duplicates"""
+    return list(dict.fromkeys(image["source"] for image in base_images.values() if image.get("source")))
+
+
+def _repository(source):
+    """'ghcr.io/org/image' from 'ghcr.io/org/image:tag' or '...@sha256:...'"""
+    if "@" in source:
+        return source.split("@", 1)[0]
+    head, sep, tail = source.rpartition(":")
+    return head if sep and "/" not in tail else source
+
+
+class ImageCache:
+    """Pulls, tracks and evicts base images
+
+    `inventory` is a VMInventory: `tart list` reports cached OCI images
+    alongside VMs (source "oci"), with the tag name and a `repo@sha256:`
+    name for the same data.
+    """
+
+    def __init__(self, tart_bin, inventory, images=(), index_path=None, budget_gb=0, max_pulls=2):
+        self.tart_bin = tart_bin
+        self.inventory = inventory
+        self.images = list(images)
+        self.index_path = Path(index_path) if index_path else default_index_path()
+        self.budget_gb = budget_gb
+        self.max_pulls = max_pulls
+        self._cond = threading.Condition()
+        self._pulling = set()
+        self._index = self._load_index()
+        self._thread = None
+
+        metrics.Gauge(
+            "megalopolis_image_cache_size_gigabytes",
+            "Disk used by cached base images",
+            func=lambda: self.used_gb()
+        )
+        metrics.Gauge(
+            "megalopolis_image_pulls_in_flight",
+            "Base image pulls currently running",
+            func=lambda: len(self._pulling)
+        )
+
+    # Index
+
+    def _load_index(self):
+        try:
+            return json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index_locked(self):
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._index, indent=2, sort_keys=True))
+            tmp.replace(self.index_path)
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to save image index: {e}")
+
+    def _entry_locked(self, source):
+        return self._index.setdefault(source, {})
+
+    # Lookups
+
+    def _oci_records(self, refresh=False):
+        if refresh:
+            self.inventory.invalidate()
+        index, _ = self.inventory.snapshot()
+        return [r for r in index.query() if (r.source or "").lower() == "oci"]
+
+    def is_cached(self, source):
+        record, _ = self.inventory.get(source)
+        return record is not None
+
+    def used_gb(self):
+        """GB used by cached images, counting tags only (digest names share their data)"""
+        return sum(r.size or 0 for r in self._oci_records() if "@" not in r.name)
+
+    def touch(self, source):
+        """Record that a VM was just cloned from `source` (eviction is LRU by last clone)"""
+        with self._cond:
+            entry = self._entry_locked(source)
+            entry["last_used"] = utc_now()
+            entry["clones"] = entry.get("clones", 0) + 1
+            self._save_index_locked()
+
+    # Pulls
+
+    def ensure(self, source):
+        """Make sure `source` is cached, pulling it if needed
+
+        Returns True on a cache hit. Callers asking for an image that is
+        already being pulled wait for that pull instead of starting another.
+        Raises RuntimeError if the pull fails.
+        """
+        if self.is_cached(source):
+            metrics.CACHE_REQUESTS.inc(cache="image", result="hit")
+            return True
+        metrics.CACHE_REQUESTS.inc(cache="image", result="miss")
+
+        with self._cond:
+            coalesced = source in self._pulling
+            if coalesced:
+                self._cond.wait_for(lambda: source not in self._pulling)
+            else:
+                self._pulling.add(source)
+        if coalesced:
+            if not self.is_cached(source):
+                raise RuntimeError(f"pull of {source} failed")
+            return False
+
+        try:
+            self._pull(source)
+        finally:
+            with self._cond:
+                self._pulling.discard(source)
+                self._cond.notify_all()
+        self.evict()
+        return False
+
+    def _pull(self, source):
+        repository = _repository(source)
+        before = {r.name for r in self._oci_records() if r.name.startswith(repository + "@")}
+        started = time.monotonic()
+        result = metrics.timed_run([self.tart_bin, "pull", source], capture_output=True, text=True, timeout=7200)
+        duration = time.monotonic() - started
+        if result.returncode != 0:
+            IMAGE_PULL_FAILURES.inc(image=source)
+            raise RuntimeError(f"tart pull {source} failed: {result.stderr.strip() or result.returncode}")
+        IMAGE_PULL_DURATION.observe(duration, image=source)
+
+        records = self._oci_records(refresh=True)
+        digests = [r.name for r in records if r.name.startswith(repository + "@")]
+        # Prefer the digest this pull added; otherwise the only one there is
+        new = [name for name in digests if name not in before]
+        digest = (new or digests)[0].split("@", 1)[1] if len(new or digests) == 1 else None
+        size = next((r.size for r in records if r.name == source), None)
+        with self._cond:
+            entry = self._entry_locked(source)
+            entry.update(digest=digest, size_gb=size, pulled_at=utc_now(), pull_seconds=round(duration, 1))
+            self._save_index_locked()
+
+    def prepull(self):
+        """Pull every configured image that isn't cached, in parallel; returns {source: error}"""
+        errors = {}
+
+        def pull(source):
+            try:
+                self.ensure(source)
+            except Exception as e:
+                errors[source] = str(e)
+
+        with ThreadPoolExecutor(max_workers=self.max_pulls, thread_name_prefix="image-pull") as pool:
+            list(pool.map(pull, self.images))
+        self.evict()
+        return errors
+
+    def start(self):
+        """Pre-pull configured images on a background thread"""
+        if self._thread is None and self.images:
+            self._thread = threading.Thread(target=self._prepull_in_background, name="image-prepull", daemon=True)
+            self._thread.start()
+
+    def _prepull_in_background(self):
+        for source, error in self.prepull().items():
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Pre-pull of {source} failed: {error}")
+
+    # Eviction
+
+    def evict(self):
+        """Delete least recently cloned images until the cache fits the budget; returns their names"""
+        if not self.budget_gb:
+            return []
+        tags = [r for r in self._oci_records(refresh=True) if "@" not in r.name]
+        used = sum(r.size or 0 for r in tags)
+        with self._cond:
+            busy = set(self._pulling)
+            index = {name: dict(entry) for name, entry in self._index.items()}
+
+        def last_used(record):
+            entry = index.get(record.name, {})
+            return entry.get("last_used") or entry.get("pulled_at") or ""
+
+        evicted = []
+        for record in sorted(tags, key=last_used):
+            if used <= self.budget_gb:
+                break
+            if record.name in busy:
+                continue
+            names = [record.name]
+            digest = index.get(record.name, {}).get("digest")
+            if digest:
+                names.append(f"{_repository(record.name)}@{digest}")
+            for name in names:
+                metrics.timed_run([self.tart_bin, "delete", name], capture_output=True, text=True, timeout=300)
+            used -= record.size or 0
+            evicted.append(record.name)
+            IMAGE_EVICTIONS.inc()
+            with self._cond:
+                self._index.pop(record.name, None)
+                self._save_index_locked()
+        if evicted:
+            self.inventory.invalidate()
+        return evicted
+
+    def status(self):
+        """Budget, usage, hit/miss counts and per-image index entries for the API"""
+        records = {r.name: r for r in self._oci_records()}
+        with self._cond:
+            index = {name: dict(entry) for name, entry in self._index.items()}
+            pulling = set(self._pulling)
+        names = list(dict.fromkeys(self.images + sorted(n for n in records if "@" not in n) + sorted(index)))
+        images = []
+        for name in names:
+            entry = index.get(name, {})
+            record = records.get(name)
+            images.append({
+                "source": name,
+                "configured": name in self.images,
+                "cached": record is not None,
+                "pulling": name in pulling,
+                "size_gb": record.size if record is not None else entry.get("size_gb"),
+                "digest": entry.get("digest"),
+                "pulled_at": entry.get("pulled_at"),
+                "pull_seconds": entry.get("pull_seconds"),
+                "last_used": entry.get("last_used"),
+                "clones": entry.get("clones", 0),
+            })
+        return {
+            "budget_gb": self.budget_gb or None,
+            "used_gb": sum(r.size or 0 for n, r in records.items() if "@" not in n),
+            "hits": metrics.CACHE_REQUESTS.value(cache="image", result="hit"),
+            "misses": metrics.CACHE_REQUESTS.value(cache="image", result="miss"),
+            "images": images,
+        }
+
+
+def main(argv=None):
+    """CLI used by `make images`"""
+    from megalopolis.inventory import VMInventory
+    from megalopolis.vmconfig import load_base_images
+
+    parser = argparse.ArgumentParser(description="Manage the cache of base images from tart/base-images.yaml")
+    parser.add_argument("command", nargs="?", choices=["status", "prepull", "evict"], default="status")
+    parser.add_argument("--max-pulls", type=int, default=int(os.environ.get("PROVISION_MAX_PULLS", "2")),
+                        help="Images pulled at once (default: 2)")
+    args = parser.parse_args(argv)
+
+    tart_bin = os.environ.get("TART_BINARY") or str(Path(__file__).resolve().parent.parent / "tart-binary")
+    cache = ImageCache(tart_bin, VMInventory(tart_bin), configured_images(load_base_images()),
+                       budget_gb=default_budget_gb(), max_pulls=args.max_pulls)
+    failed = False
+    if args.command == "prepull":
+        errors = cache.prepull()
+        for source, error in errors.items():
+            print(f"Failed to pull {source}: {error}", file=sys.stderr)
+        failed = bool(errors)
+    elif args.command == "evict":
+        for name in cache.evict():
+            print(f"Evicted {name}")
+    print(json.dumps(cache.status(), indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+VM inventory: one `tart list` parser and a cached, indexed snapshot.
+
+Prefers `tart list --format json` and falls back to the text table for
+tart builds without it. The text parser locates columns from the header
+line (`Source Name Disk Size State`, or the older upper-case `NAME ...`)
+instead of splitting on whitespace, so names containing spaces survive.
+Snapshots are indexed by name, with secondary indexes by state and source
+for filtered listings.
+"""
+
+import bisect
+import json
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from megalopolis import metrics
+
+# Header names of the `tart list` text columns this parser understands
+TEXT_COLUMNS = ("source", "name", "disk", "size", "state")
+
+
+class VMRecord:
+    """One VM as reported by `tart list`"""
+
+    __slots__ = ("name", "source", "disk", "size", "state", "ip")
+
+    def __init__(self, name, source=None, disk=None, size=None, state=None, ip=None):
+        self.name = name
+        self.source = source
+        self.disk = disk
+        self.size = size
+        self.state = state
+        self.ip = ip
+
+    def row(self):
+        return (self.name, self.source, self.disk, self.size, self.state, self.ip)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.state,
+            "source": self.source,
+            "disk": self.disk,
+            "size": self.size,
+            "ip": self.ip,
+        }
+
+
+def _number(value):
+    if isinstance(value, (int, float)) or value is None:
+        return value
+    value = str(value).strip()
+    return int(value) if value.isdigit() else (value or None)
+
+
+def parse_tart_json(data):
+    """VMRecords from decoded `tart list --format json` output"""
+    records = []
+    for entry in data:
+        fields = {str(key).lower(): value for key, value in entry.items()}
+        name = fields.get("name")
+        if not name:
+            continue
+        state = fields.get("state")
+        if state is None and "running" in fields:
+            state = "running" if fields["running"] else "stopped"
+        records.append(VMRecord(
+            str(name),
+            source=fields.get("source"),
+            disk=_number(fields.get("disk")),
+            size=_number(fields.get("size")),
+            state=str(state).lower() if state is not None else None,
+        ))
+    return records
+
+
+def parse_tart_text(output):
+    """VMRecords from the `tart list` text table"""
+    lines = [line for line in output.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    header = [(m.group().lower(), m.start()) for m in re.finditer(r"\S+", lines[0])]
+    names = [name for name, _ in header]
+    if "name" not in names:
+        # No header: Source Name ... State, split on whitespace
+        records = []
+        for line in lines:
+            parts = line.split()
+            if len(parts) >= 3:
+                records.append(VMRecord(parts[1], source=parts[0], state=parts[-1].lower()))
+        return records
+
+    # Slice each row at the header's column offsets
+    bounds = [start for _, start in header[1:]] + [None]
+    records = []
+    for line in lines[1:]:
+        fields = {
+            name: line[start:end].strip()
+            for (name, start), end in zip(header, bounds)
+            if name in TEXT_COLUMNS
+        }
+        if not fields.get("name"):
+            continue
+        records.append(VMRecord(
+            fields["name"],
+            source=fields.get("source") or None,
+            disk=_number(fields.get("disk")),
+            size=_number(fields.get("size")),
+            state=(fields.get("state") or "").lower() or None,
+        ))
+    return records
+
+
+def parse_tart_list(output):
+    """VMRecords from `tart list` output in either JSON or text format"""
+    stripped = output.strip()
+    if stripped.startswith("["):
+        try:
+            return parse_tart_json(json.loads(stripped))
+        except ValueError:
+            pass
+    return parse_tart_text(output)
+
+
+class VMIndex:
+    """One `tart list` snapshot indexed by name, state and source
+
+    `version` changes whenever the content does, so responses built from
+    the snapshot can be cached by it.
+    """
+
+    __slots__ = ("by_name", "names", "by_state", "by_source", "version")
+
+    def __init__(self, records=(), version=0):
+        self.version = version
+        self.by_name = {record.name: record for record in records}
+        self.names = sorted(self.by_name)
+        self.by_state = {}
+        self.by_source = {}
+        for name in self.names:
+            record = self.by_name[name]
+            self.by_state.setdefault(record.state, []).append(record)
+            self.by_source.setdefault(record.source, []).append(record)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def with_prefix(self, prefix):
+        """Names starting with `prefix`, via binary search over the sorted names"""
+        start = bisect.bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+        return self.names[start:end]
+
+    def query(self, state=None, source=None):
+        """Records sorted by name, optionally filtered by state and/or source"""
+        if state is None and source is None:
+            return [self.by_name[name] for name in self.names]
+        # Start from the smallest matching secondary index
+        candidates = []
+        if state is not None:
+            candidates.append(self.by_state.get(state, []))
+        if source is not None:
+            candidates.append(self.by_source.get(source, []))
+        smallest = min(candidates, key=len)
+        return [
+            record for record in smallest
+            if (state is None or record.state == state) and (source is None or record.source == source)
+        ]
+
+
+class VMInventory:
+    """In-memory, indexed snapshot of `tart list`
+
+    A background thread refreshes the snapshot every `refresh_interval`
+    seconds. Concurrent refreshes are coalesced so only one `tart list`
+    subprocess runs at a time; callers arriving while a refresh is in
+    flight wait for its result instead of starting their own.
+
+    With a StateStore, every refresh is saved and the last saved snapshot
+    is loaded at construction. Until the first refresh after startup
+    reconciles it (or two refresh intervals pass), reads are answered from
+    that snapshot instead of waiting on `tart list`; its age is the age of
+    the stored `tart list`.
+    """
+
+    def __init__(self, tart_bin, refresh_interval=5.0, timeout=10, store=None):
+        self.tart_bin = tart_bin
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.store = store
+        self._cond = threading.Condition()
+        self._index = VMIndex()
+        self._ips = {}  # name -> IP learned from readiness probes
+        self._refreshed_at = None  # time.monotonic() of last successful refresh
+        self._refreshing = False
+        self._generation = 0
+        self._last_error = None
+        self._json_format = None  # whether this tart supports --format json; None until known
+        self._restored_until = None  # time.monotonic() until which a stored snapshot is served
+        self._thread = None
+        if store is not None:
+            self._restore()
+
+    def _restore(self):
+        records, taken_at = self.store.load_inventory()
+        if taken_at is None:
+            return
+        self._index = VMIndex(records)
+        self._ips = {record.name: record.ip for record in records if record.ip and record.state == "running"}
+        now = time.monotonic()
+        self._refreshed_at = now - max(time.time() - taken_at, 0.0)
+        self._restored_until = now + 2 * self.refresh_interval + self.timeout
+
+    def start(self):
+        """Start the background refresh thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="vm-inventory", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Inventory refresh failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    def _run_list(self, *extra):
+        return metrics.timed_run(
+            [self.tart_bin, "list", *extra],
+            capture_output=True,
+            text=True,
+            timeout=self.timeout
+        )
+
+    def _list_vms(self):
+        """Run `tart list`, preferring JSON output; raises on failure"""
+        if self._json_format is not False:
+            result = self._run_list("--format", "json")
+            if result.returncode == 0:
+                self._json_format = True
+                return parse_tart_list(result.stdout)
+            if self._json_format:
+                raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+
+        # Older tart without --format, or JSON support still unknown
+        result = self._run_list()
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        self._json_format = False
+        return parse_tart_list(result.stdout)
+
+    def refresh(self):
+        """Re-run `tart list`, or wait for the refresh already in flight"""
+        with self._cond:
+            if self._refreshing:
+                generation = self._generation
+                while self._refreshing:
+                    self._cond.wait()
+                if self._last_error is not None and self._generation == generation + 1:
+                    raise self._last_error
+                return
+            self._refreshing = True
+
+        error = None
+        try:
+            records = self._list_vms()
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            if error is None:
+                for record in records:
+                    if record.state == "running":
+                        record.ip = self._ips.get(record.name)
+                    else:
+                        self._ips.pop(record.name, None)
+                version = self._index.version
+                if sorted(record.row() for record in records) != [r.row() for r in self._index.query()]:
+                    version += 1
+                self._index = VMIndex(records, version)
+                self._refreshed_at = time.monotonic()
+                self._restored_until = None
+            self._last_error = error
+            self._generation += 1
+            self._refreshing = False
+            self._cond.notify_all()
+
+        if error is not None:
+            raise error
+        if self.store is not None:
+            self.store.save_inventory(records)
+
+    def record_ip(self, vm_name, ip):
+        """Remember a running VM's IP so listings can include it"""
+        with self._cond:
+            self._ips[vm_name] = ip
+            record = self._index.get(vm_name)
+            if record is not None and record.ip != ip:
+                record.ip = ip
+                self._index.version += 1
+        if self.store is not None:
+            self.store.save_ip(vm_name, ip)
+
+    def invalidate(self):
+        """Force the next read to refresh (e.g. after start/stop)"""
+        with self._cond:
+            self._refreshed_at = None
+            self._restored_until = None
+
+    def _ensure_fresh(self):
+        with self._cond:
+            refreshed_at = self._refreshed_at
+            restored = self._restored_until is not None and time.monotonic() < self._restored_until
+        # Serve a restored snapshot while the first refresh reconciles it;
+        # otherwise fall back to a synchronous refresh if the snapshot was
+        # invalidated or the background thread has fallen behind
+        if restored:
+            metrics.CACHE_REQUESTS.inc(cache="inventory", result="hit")
+        elif refreshed_at is None or time.monotonic() - refreshed_at > 2 * self.refresh_interval:
+            metrics.CACHE_REQUESTS.inc(cache="inventory", result="miss")
+            self.refresh()
+        else:
+            metrics.CACHE_REQUESTS.inc(cache="inventory", result="hit")
+
+    def _age_locked(self):
+        if self._refreshed_at is None:
+            return 0.0
+        return time.monotonic() - self._refreshed_at
+
+    def age(self):
+        """Seconds since the current snapshot was taken, None before the first one"""
+        with self._cond:
+            if self._refreshed_at is None:
+                return None
+            return self._age_locked()
+
+    def snapshot(self):
+        """Return (VMIndex, snapshot age in seconds)"""
+        self._ensure_fresh()
+        with self._cond:
+            return self._index, self._age_locked()
+
+    def list(self, state=None, source=None):
+        """Return (VMRecords sorted by name, snapshot age in seconds)"""
+        index, age = self.snapshot()
+        return index.query(state, source), age
+
+    def get(self, vm_name, refresh_on_miss=False):
+        """Return (VMRecord or None, snapshot age in seconds)"""
+        index, _ = self.snapshot()
+        if index.get(vm_name) is None and refresh_on_miss:
+            # The VM may have been created since the last snapshot
+            self.refresh()
+        with self._cond:
+            return self._index.get(vm_name), self._age_locked()
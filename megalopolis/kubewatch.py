@@ -0,0 +1,376 @@
+"""
+Kubernetes namespace and pod status from list+watch.
+
+The dashboard used to run `kubectl get namespaces` and `kubectl get pods -n
+...` for every tracked namespace on each refresh, paying a process launch,
+a kubeconfig parse and a TLS handshake per call. KubeWatcher lists
+namespaces and pods once, then follows a watch stream for each over a
+persistent connection and keeps per-namespace pod counts in memory, so
+reading them costs nothing.
+
+Where to connect comes from DASHBOARD_KUBE_API (a plain URL such as a
+`kubectl proxy` or tests/benchmark/fake_kube_api.py), the in-cluster
+service account, or the current context of KUBECONFIG / ~/.kube/config.
+Set DASHBOARD_KUBE_WATCH=0 to go back to running kubectl.
+"""
+
+import base64
+import http.client
+import json
+import os
+import ssl
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode, urlparse
+
+from megalopolis import metrics
+from megalopolis.vmconfig import load_yaml
+
+# Seconds the API server keeps one watch request open before we re-issue it
+WATCH_TIMEOUT = int(os.environ.get("DASHBOARD_KUBE_WATCH_TIMEOUT", "300"))
+
+# Reconnect backoff after a failed list or watch, in seconds
+MIN_BACKOFF = 1
+MAX_BACKOFF = 30
+
+SERVICE_ACCOUNT_DIR = Path("/var/run/secrets/kubernetes.io/serviceaccount")
+
+RESOURCES = ("namespaces", "pods")
+
+WATCH_EVENTS = metrics.Counter(
+    "megalopolis_kube_watch_events_total",
+    "Watch events received from the Kubernetes API",
+    ["resource", "type"]
+)
+WATCH_RESTARTS = metrics.Counter(
+    "megalopolis_kube_watch_restarts_total",
+    "Times a watch had to re-list, by reason (expired or error)",
+    ["resource", "reason"]
+)
+
+
+class WatchExpired(Exception):
+    """The watch's resourceVersion is too old (410 Gone); re-list and watch again"""
+
+
+def _decoded(data):
+    return base64.b64decode(data).decode()
+
+
+def load_kubeconfig(path=None):
+    """Connection settings for the current context of a kubeconfig file
+
+    Returns a dict with server and, where set, ca_data/ca_file, cert_data/
+    cert_file, key_data/key_file, token and insecure. Raises
+    FileNotFoundError if there is no kubeconfig and ValueError if the
+    context can't be used without kubectl (e.g. exec credential plugins).
+    """
+    if path is None:
+        path = (os.environ.get("KUBECONFIG") or "").split(os.pathsep)[0] or "~/.kube/config"
+    path = Path(os.path.expanduser(path))
+    text = path.read_text()
+    try:
+        config = json.loads(text)
+    except ValueError:
+        config = load_yaml(path)
+
+    def named(section, name):
+        for entry in config.get(section) or []:
+            if entry.get("name") == name:
+                return entry
+        raise ValueError(f"kubeconfig {path} has no {section[:-1]} named {name!r}")
+
+    context_name = config.get("current-context")
+    if not context_name:
+        raise ValueError(f"kubeconfig {path} has no current-context")
+    context = named("contexts", context_name).get("context") or {}
+    cluster = named("clusters", context.get("cluster")).get("cluster") or {}
+    user = (named("users", context["user"]).get("user") or {}) if context.get("user") else {}
+
+    def local(file_path):
+        return str(path.parent / os.path.expanduser(file_path))
+
+    settings = {"server": cluster["server"], "insecure": bool(cluster.get("insecure-skip-tls-verify"))}
+    if cluster.get("certificate-authority-data"):
+        settings["ca_data"] = _decoded(cluster["certificate-authority-data"])
+    elif cluster.get("certificate-authority"):
+        settings["ca_file"] = local(cluster["certificate-authority"])
+    if user.get("client-certificate-data"):
+        settings["cert_data"] = _decoded(user["client-certificate-data"])
+        settings["key_data"] = _decoded(user["client-key-data"])
+    elif user.get("client-certificate"):
+        settings["cert_file"] = local(user["client-certificate"])
+        settings["key_file"] = local(user["client-key"])
+    if user.get("token"):
+        settings["token"] = user["token"]
+    elif user.get("tokenFile"):
+        settings["token"] = Path(local(user["tokenFile"])).read_text().strip()
+    if user.get("exec") or user.get("auth-provider"):
+        if not (settings.get("token") or settings.get("cert_data") or settings.get("cert_file")):
+            raise ValueError(f"context {context_name!r} uses a credential plugin; only kubectl can use it")
+    return settings
+
+
+def in_cluster_config():
+    """Settings from the pod's service account, or None outside a cluster"""
+    host = os.environ.get("KUBERNETES_SERVICE_HOST")
+    token_path = SERVICE_ACCOUNT_DIR / "token"
+    if not host or not token_path.exists():
+        return None
+    port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+    host = f"[{host}]" if ":" in host else host
+    return {
+        "server": f"https://{host}:{port}",
+        "ca_file": str(SERVICE_ACCOUNT_DIR / "ca.crt"),
+        "token": token_path.read_text().strip(),
+        "insecure": False,
+    }
+
+
+def default_settings():
+    """DASHBOARD_KUBE_API, then the in-cluster service account, then the kubeconfig"""
+    if os.environ.get("DASHBOARD_KUBE_API"):
+        return {"server": os.environ["DASHBOARD_KUBE_API"], "insecure": False}
+    return in_cluster_config() or load_kubeconfig()
+
+
+def from_environment():
+    """A KubeWatcher for this environment, or None if disabled or there is no usable cluster config"""
+    if os.environ.get("DASHBOARD_KUBE_WATCH", "1") == "0":
+        return None
+    try:
+        return KubeWatcher(default_settings())
+    except (OSError, ValueError, KeyError, ssl.SSLError) as e:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Kubernetes watch disabled, using kubectl: {e}")
+        return None
+
+
+def ssl_context(settings):
+    """Client SSL context for the settings from load_kubeconfig()"""
+    context = ssl.create_default_context(cafile=settings.get("ca_file"), cadata=settings.get("ca_data"))
+    if settings.get("insecure"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if settings.get("cert_data"):
+        # load_cert_chain only takes paths; keep the key on disk just long enough to load it
+        with tempfile.TemporaryDirectory(prefix="kubewatch-") as directory:
+            cert_file = Path(directory) / "client.crt"
+            key_file = Path(directory) / "client.key"
+            cert_file.write_text(settings["cert_data"])
+            key_file.touch(mode=0o600)
+            key_file.write_text(settings["key_data"])
+            context.load_cert_chain(str(cert_file), str(key_file))
+    elif settings.get("cert_file"):
+        context.load_cert_chain(settings["cert_file"], settings.get("key_file"))
+    return context
+
+
+def summarize(resource, item):
+    """The part of a namespace or pod the readiness model keeps: (key, value)"""
+    meta = item.get("metadata") or {}
+    status = item.get("status") or {}
+    if resource == "namespaces":
+        return meta.get("name"), status.get("phase", "Active")
+    # kubectl shows pods being deleted as Terminating whatever their phase
+    phase = "Terminating" if meta.get("deletionTimestamp") else status.get("phase", "Unknown")
+    ready = any(c.get("type") == "Ready" and c.get("status") == "True" for c in status.get("conditions") or [])
+    return (meta.get("namespace"), meta.get("name")), (phase, ready)
+
+
+class KubeWatcher:
+    """In-memory namespace/pod readiness kept current by list+watch
+
+    Each resource has one thread holding one HTTP/1.1 connection: it lists,
+    then re-issues watches from the last resourceVersion on the same
+    connection. HTTP/1.1 carries one streamed response at a time, so
+    namespaces and pods use a connection each. After a 410 Gone the
+    resource is re-listed; after an error the connection is replaced with
+    exponential backoff, and `synced` is False until the list succeeds.
+    """
+
+    def __init__(self, settings, timeout=10, watch_timeout=WATCH_TIMEOUT):
+        url = urlparse(settings["server"])
+        self.server = settings["server"]
+        self.host = url.hostname
+        self.port = url.port
+        self.base_path = url.path.rstrip("/")
+        self.secure = url.scheme == "https"
+        self.token = settings.get("token")
+        self.timeout = timeout
+        self.watch_timeout = watch_timeout
+        self._context = ssl_context(settings) if self.secure else None
+        self._cond = threading.Condition()
+        self._objects = {resource: {} for resource in RESOURCES}
+        self._synced = set()
+        self._errors = {}
+        self._version = 0
+        self._threads = []
+        self._stopped = threading.Event()
+
+        metrics.Gauge(
+            "megalopolis_kube_watch_synced",
+            "1 when namespaces and pods are listed and being watched",
+            func=lambda: 1 if self.synced else 0
+        )
+
+    # Model
+
+    @property
+    def synced(self):
+        with self._cond:
+            return len(self._synced) == len(RESOURCES)
+
+    def namespaces(self):
+        """{namespace: {"phase", "pods", "running", "ready"}} for every namespace"""
+        with self._cond:
+            model = {name: {"phase": phase, "pods": 0, "running": 0, "ready": 0}
+                     for name, phase in self._objects["namespaces"].items()}
+            for (namespace, _), (phase, ready) in self._objects["pods"].items():
+                counts = model.setdefault(namespace, {"phase": None, "pods": 0, "running": 0, "ready": 0})
+                counts["pods"] += 1
+                counts["running"] += phase == "Running"
+                counts["ready"] += ready
+        return model
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the model changes from `version`; returns the current version"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def status(self):
+        with self._cond:
+            return {
+                "server": self.server,
+                "synced": sorted(self._synced),
+                "objects": {resource: len(objects) for resource, objects in self._objects.items()},
+                "errors": dict(self._errors),
+            }
+
+    def _replace(self, resource, items):
+        objects = dict(summarize(resource, item) for item in items)
+        with self._cond:
+            self._objects[resource] = objects
+            self._synced.add(resource)
+            self._errors.pop(resource, None)
+            self._version += 1
+            self._cond.notify_all()
+
+    def _apply(self, resource, event_type, item):
+        key, value = summarize(resource, item)
+        with self._cond:
+            if event_type == "DELETED":
+                changed = self._objects[resource].pop(key, None) is not None
+            else:
+                changed = self._objects[resource].get(key) != value
+                self._objects[resource][key] = value
+            if changed:
+                self._version += 1
+                self._cond.notify_all()
+
+    def _unsynced(self, resource, error):
+        with self._cond:
+            self._synced.discard(resource)
+            self._errors[resource] = error
+            self._version += 1
+            self._cond.notify_all()
+
+    # Connection
+
+    def start(self):
+        """Start one list+watch thread per resource"""
+        if not self._threads:
+            for resource in RESOURCES:
+                thread = threading.Thread(target=self._follow, args=(resource,), name=f"kube-watch-{resource}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _connect(self):
+        # The socket timeout must outlast a quiet watch; the server ends it after watch_timeout
+        timeout = self.watch_timeout + self.timeout
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=self._context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _request(self, conn, resource, **params):
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        conn.request("GET", f"{self.base_path}/api/v1/{resource}?{urlencode(params)}", headers=headers)
+        response = conn.getresponse()
+        if response.status == 410:
+            response.read()
+            raise WatchExpired()
+        if response.status != 200:
+            body = response.read().decode(errors="replace")
+            raise http.client.HTTPException(f"GET {resource} returned {response.status}: {body[:200]}")
+        return response
+
+    def _list(self, conn, resource):
+        """Replace the resource's objects with a fresh list; returns its resourceVersion"""
+        items = []
+        params = {"limit": 500}
+        while True:
+            body = json.loads(self._request(conn, resource, **params).read())
+            items.extend(body.get("items") or [])
+            meta = body.get("metadata") or {}
+            if not meta.get("continue"):
+                break
+            params["continue"] = meta["continue"]
+        self._replace(resource, items)
+        return meta.get("resourceVersion", "")
+
+    def _watch(self, conn, resource, version):
+        """Apply events from one watch request; returns the last resourceVersion seen"""
+        response = self._request(conn, resource, watch=1, allowWatchBookmarks="true",
+                                 resourceVersion=version, timeoutSeconds=self.watch_timeout)
+        expired = False
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            event_type = event.get("type")
+            item = event.get("object") or {}
+            WATCH_EVENTS.inc(resource=resource, type=event_type)
+            if event_type == "ERROR":
+                # The server ends the stream after an error; keep reading so the connection can be reused
+                expired = expired or item.get("code") == 410
+                continue
+            version = (item.get("metadata") or {}).get("resourceVersion", version)
+            if event_type in ("ADDED", "MODIFIED", "DELETED"):
+                self._apply(resource, event_type, item)
+        if expired:
+            raise WatchExpired()
+        return version
+
+    def _follow(self, resource):
+        backoff = MIN_BACKOFF
+        while not self._stopped.is_set():
+            conn = self._connect()
+            try:
+                version = self._list(conn, resource)
+                backoff = MIN_BACKOFF
+                while not self._stopped.is_set():
+                    try:
+                        version = self._watch(conn, resource, version)
+                    except WatchExpired:
+                        WATCH_RESTARTS.inc(resource=resource, reason="expired")
+                        version = self._list(conn, resource)
+            except (OSError, ValueError, WatchExpired, http.client.HTTPException) as e:
+                WATCH_RESTARTS.inc(resource=resource, reason="error")
+                self._unsynced(resource, str(e) or type(e).__name__)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Kubernetes {resource} watch failed, "
+                      f"retrying in {backoff}s: {e}")
+            finally:
+                conn.close()
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
@@ -0,0 +1,321 @@
+"""
+Minimal Prometheus metrics (text exposition format 0.0.4).
+
+Standard library only: counters, gauges and histograms with labels, a
+process-wide registry rendered by the /metrics endpoints, plus helpers to
+time HTTP requests and the tart/kubectl/docker subprocesses behind them.
+"""
+
+import os
+import subprocess
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers in-memory reads through slow tart/kubectl calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed at scrape time
+
+    With `func`, the gauge calls it on every scrape. It returns a number
+    for an unlabelled gauge, or {label values tuple: number}.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, func=None):
+        super().__init__(name, help, labelnames, registry)
+        self.func = func
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:
+                return []
+            items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in items if v is not None
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "megalopolis_http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["route", "method", "code"]
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "megalopolis_http_requests_in_flight",
+    "HTTP requests currently being handled"
+)
+SUBPROCESS_DURATION = Histogram(
+    "megalopolis_subprocess_duration_seconds",
+    "Wall time of tart/kubectl/docker subprocesses",
+    ["command"]
+)
+SUBPROCESS_SPAWNED = Counter(
+    "megalopolis_subprocess_spawned_total",
+    "Subprocesses started",
+    ["command"]
+)
+SUBPROCESS_TIMEOUTS = Counter(
+    "megalopolis_subprocess_timeouts_total",
+    "Subprocesses killed after exceeding their timeout",
+    ["command"]
+)
+SUBPROCESS_ERRORS = Counter(
+    "megalopolis_subprocess_errors_total",
+    "Subprocesses that failed to start or exited non-zero",
+    ["command"]
+)
+CACHE_REQUESTS = Counter(
+    "megalopolis_cache_requests_total",
+    "Cache lookups by outcome (hit or miss)",
+    ["cache", "result"]
+)
+
+
+def _cache_hit_ratios():
+    with CACHE_REQUESTS._lock:
+        values = dict(CACHE_REQUESTS._values)
+    totals = {}
+    for (cache, result), count in values.items():
+        hits, total = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (count if result == "hit" else 0), total + count)
+    return {(cache,): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+CACHE_HIT_RATIO = Gauge(
+    "megalopolis_cache_hit_ratio",
+    "Fraction of cache lookups served without a refresh",
+    ["cache"],
+    func=_cache_hit_ratios
+)
+
+
+def command_label(args):
+    """Short label for a command line, e.g. 'tart list' or 'kubectl get'"""
+    args = list(args)
+    if args and os.path.basename(args[0]) == "nohup":
+        args = args[1:]
+    if not args:
+        return "unknown"
+    name = os.path.basename(str(args[0]))
+    if name.endswith("-binary"):
+        name = name[:-len("-binary")]
+    if len(args) > 1 and not str(args[1]).startswith("-"):
+        return f"{name} {args[1]}"
+    return name
+
+
+def observe_command(args, duration, timed_out=False, failed=False):
+    """Record a finished subprocess"""
+    label = command_label(args)
+    SUBPROCESS_SPAWNED.inc(command=label)
+    SUBPROCESS_DURATION.observe(duration, command=label)
+    if timed_out:
+        SUBPROCESS_TIMEOUTS.inc(command=label)
+    elif failed:
+        SUBPROCESS_ERRORS.inc(command=label)
+
+
+def timed_run(args, **kwargs):
+    """subprocess.run() that records duration, timeouts and failures"""
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(args, **kwargs)
+    except subprocess.TimeoutExpired:
+        observe_command(args, time.perf_counter() - started, timed_out=True)
+        raise
+    except OSError:
+        observe_command(args, time.perf_counter() - started, failed=True)
+        raise
+    observe_command(args, time.perf_counter() - started, failed=result.returncode != 0)
+    return result
+
+
+class InstrumentedHandlerMixin:
+    """Per-route latency for BaseHTTPRequestHandler subclasses
+
+    Handlers set `self.route` to the route template (e.g. '/vms/{name}')
+    while dispatching; unmatched requests are recorded as 'other'. Timing
+    starts once the request line has been read.
+    """
+
+    route = None
+
+    def handle_one_request(self):
+        self._request_started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._request_started is not None:
+                HTTP_REQUESTS_IN_FLIGHT.dec()
+                HTTP_REQUEST_DURATION.observe(
+                    time.perf_counter() - self._request_started,
+                    route=self.route or "other",
+                    method=getattr(self, "command", None) or "unknown",
+                    code=getattr(self, "_status_code", None) or 0
+                )
+
+    def parse_request(self):
+        self._request_started = time.perf_counter()
+        self._status_code = None
+        self.route = None
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._status_code = code
+        super().send_response(code, message)
+
+    def send_metrics(self):
+        """Write the registry in Prometheus text format"""
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
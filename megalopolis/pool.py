@@ -0,0 +1,535 @@
+"""
+Warm pools of pre-cloned, pre-booted VMs.
+
+For every template in tart/vm-configs/*.yaml with a `warm_pool` section,
+keeps `size` clones booted and SSH-ready. A job acquires one with a lease
+and gets a VM that is already reachable, instead of waiting through
+clone -> boot -> IP -> SSH. Released (or expired) VMs are destroyed or,
+with `on_release: recycle`, rebooted and returned to the pool, and the
+pool is refilled in the background.
+
+    warm_pool:
+      size: 2               # clones kept ready
+      on_release: destroy   # or recycle
+      lease_ttl: 3600       # seconds before an unreleased lease is reclaimed
+
+With a capacity scheduler, pool VMs only boot into spare capacity: they
+ask at WARM_POOL_PRIORITY without queueing, so starts requested through
+the API always come first.
+"""
+
+import os
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from megalopolis import metrics
+from megalopolis.readiness import READY
+from megalopolis.scheduler import CapacityError
+from megalopolis.vmlogs import start_console, timed
+
+# Pool VM lifecycle states
+PROVISIONING = "provisioning"
+READY_STATE = "ready"
+LEASED = "leased"
+RELEASING = "releasing"
+
+POOL_STATES = (PROVISIONING, READY_STATE, LEASED, RELEASING)
+
+# Scheduler priority of pool refills; API starts default to 0
+WARM_POOL_PRIORITY = -10
+
+PROVISION_DURATION = metrics.Histogram(
+    "megalopolis_warm_pool_provision_duration_seconds",
+    "Time from clone to SSH-ready for warm pool VMs",
+    ["template"],
+    buckets=(5, 10, 30, 60, 120, 180, 300, 600)
+)
+PROVISION_FAILURES = metrics.Counter(
+    "megalopolis_warm_pool_provision_failures_total",
+    "Warm pool VMs that failed to clone, boot or become SSH-ready",
+    ["template"]
+)
+
+
+def parse_pool_sizes(value):
+    """{template: size} from 'macos-ci-farm=2,macos-ci=1'"""
+    sizes = {}
+    for item in (value or "").split(","):
+        name, sep, size = item.strip().partition("=")
+        if sep and name.strip():
+            sizes[name.strip()] = int(size)
+    return sizes
+
+
+def default_pool_sizes():
+    """Pool size overrides from VM_API_WARM_POOLS"""
+    return parse_pool_sizes(os.environ.get("VM_API_WARM_POOLS", ""))
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PoolVM:
+    """One clone owned by a warm pool"""
+
+    __slots__ = ("name", "template", "state", "ip", "proc", "created_at", "ready_at",
+                 "lease_id", "leased_at", "lease_expires", "holder")
+
+    def __init__(self, name, template):
+        self.name = name
+        self.template = template
+        self.state = PROVISIONING
+        self.ip = None
+        self.proc = None
+        self.created_at = utc_now()
+        self.ready_at = None
+        self.lease_id = None
+        self.leased_at = None
+        self.lease_expires = None  # time.monotonic() deadline
+        self.holder = None
+
+    def lease_dict(self):
+        return {
+            "lease_id": self.lease_id,
+            "template": self.template,
+            "vm_name": self.name,
+            "ip": self.ip,
+            "holder": self.holder,
+            "acquired_at": self.leased_at,
+            "expires_in_seconds": round(max(self.lease_expires - time.monotonic(), 0), 1),
+        }
+
+    def to_record(self):
+        """State worth keeping across an API restart; the lease expiry as epoch time"""
+        expires_at = None
+        if self.lease_expires is not None:
+            expires_at = time.time() + self.lease_expires - time.monotonic()
+        return {
+            "name": self.name,
+            "template": self.template,
+            "state": self.state,
+            "ip": self.ip,
+            "created_at": self.created_at,
+            "ready_at": self.ready_at,
+            "lease_id": self.lease_id,
+            "leased_at": self.leased_at,
+            "lease_expires_at": expires_at,
+            "holder": self.holder,
+        }
+
+
+class WarmPool:
+    """Target size and release policy for one template"""
+
+    def __init__(self, template, size, on_release="destroy", lease_ttl=3600):
+        if on_release not in ("destroy", "recycle"):
+            raise ValueError(f"on_release must be 'destroy' or 'recycle', got {on_release!r}")
+        self.template = template
+        self.size = size
+        self.on_release = on_release
+        self.lease_ttl = lease_ttl
+        self.failures = 0  # consecutive provisioning failures
+        self.retry_at = 0.0  # time.monotonic() before which refills are held back
+
+
+class WarmPoolManager:
+    """Keeps warm pools filled and hands out VMs from them
+
+    `limiter` (optional) is shared with the API's start/stop operations so
+    pool refills never push tart past the configured concurrency.
+    `exists` (optional) reports whether a local VM exists; a local VM named
+    after the template is used as the clone source (it already has its
+    post_setup applied), otherwise the template's base image is cloned.
+    `scheduler` (optional) is a CapacityScheduler that must admit each
+    pool VM before it boots. `images` (optional) is the ImageCache used
+    when cloning from a base image. `store` (optional) is a StateStore
+    that pool VMs and their leases are saved to, so restore() can pick
+    them up again after a restart. `running` (optional) reports whether a
+    VM is running; it is how VMs re-adopted by restore(), which have no
+    `tart run` process of ours, are noticed going down. `logs` (optional)
+    is a VMLogs that gets each pool VM's console and clone/boot timings.
+    """
+
+    def __init__(self, tart_bin, templates, prober, sizes=None, limiter=None, exists=None,
+                 on_change=None, boot_timeout=300, interval=5.0, slot_timeout=120, scheduler=None,
+                 images=None, store=None, running=None, logs=None):
+        self.tart_bin = tart_bin
+        self.templates = templates
+        self.prober = prober
+        self.limiter = limiter
+        self.scheduler = scheduler
+        self.images = images
+        self.store = store
+        self.exists = exists
+        self.running = running
+        self.logs = logs
+        self.on_change = on_change
+        self.boot_timeout = boot_timeout
+        self.interval = interval
+        self.slot_timeout = slot_timeout
+        self.pools = {}
+        sizes = sizes or {}
+        for name, template in templates.items():
+            config = template.warm_pool
+            size = sizes.get(name, config.get("size", 0))
+            if size > 0:
+                self.pools[name] = WarmPool(
+                    name, size,
+                    on_release=config.get("on_release", "destroy"),
+                    lease_ttl=float(config.get("lease_ttl", 3600))
+                )
+        self._cond = threading.Condition()
+        self._vms = {}  # name -> PoolVM
+        self._leases = {}  # lease_id -> PoolVM
+        self._thread = None
+
+        metrics.Gauge(
+            "megalopolis_warm_pool_vms",
+            "Warm pool VMs by template and state",
+            ["template", "state"],
+            func=self._count_states
+        )
+
+    def _count_states(self):
+        counts = {(t, s): 0 for t in self.pools for s in POOL_STATES}
+        with self._cond:
+            for vm in self._vms.values():
+                counts[(vm.template, vm.state)] = counts.get((vm.template, vm.state), 0) + 1
+        return counts
+
+    def start(self):
+        """Start filling the pools in the background"""
+        if self._thread is None and self.pools:
+            self._thread = threading.Thread(target=self._maintain_loop, name="warm-pools", daemon=True)
+            self._thread.start()
+
+    def _maintain_loop(self):
+        while True:
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Warm pool maintenance failed: {e}")
+            time.sleep(self.interval)
+
+    def maintain(self):
+        """Reclaim expired leases and top up every pool"""
+        now = time.monotonic()
+        expired = []
+        refill = []
+        with self._cond:
+            adopted = [vm.name for vm in self._vms.values() if vm.state == READY_STATE and vm.proc is None]
+        # Checked outside the lock: it may wait on a `tart list`
+        gone = {name for name in adopted if self.running is not None and not self.running(name)}
+        with self._cond:
+            for vm in list(self._leases.values()):
+                if vm.lease_expires <= now:
+                    expired.append(vm)
+            for vm in list(self._vms.values()):
+                # A pooled VM whose tart process died can't be handed out
+                if vm.state != READY_STATE:
+                    continue
+                if (vm.proc is not None and vm.proc.poll() is not None) or (vm.proc is None and vm.name in gone):
+                    vm.state = RELEASING
+                    expired.append(vm)
+            for pool in self.pools.values():
+                if now < pool.retry_at:
+                    continue
+                available = sum(
+                    1 for vm in self._vms.values()
+                    if vm.template == pool.template and vm.state in (PROVISIONING, READY_STATE)
+                )
+                for _ in range(pool.size - available):
+                    vm = PoolVM(f"{pool.template}-pool-{uuid.uuid4().hex[:6]}", pool.template)
+                    self._vms[vm.name] = vm
+                    refill.append(vm)
+
+        for vm in expired:
+            if vm.lease_id is not None:
+                self.release(vm.template, vm.lease_id)
+            else:
+                self._spawn(self._destroy, vm)
+        for vm in refill:
+            self._spawn(self._provision, vm)
+
+    def _spawn(self, target, vm):
+        threading.Thread(target=target, args=(vm,), name=f"pool-{vm.name}", daemon=True).start()
+
+    def acquire(self, template, holder=None, wait=0):
+        """Lease a ready VM, waiting up to `wait` seconds for one
+
+        Returns the lease dict, or None if no VM became ready in time.
+        Raises KeyError for templates without a warm pool.
+        """
+        pool = self.pools[template]
+        with self._cond:
+            vm = self._cond.wait_for(lambda: self._next_ready(template), wait)
+            if vm:
+                vm.state = LEASED
+                vm.lease_id = uuid.uuid4().hex[:12]
+                vm.leased_at = utc_now()
+                vm.lease_expires = time.monotonic() + pool.lease_ttl
+                vm.holder = holder
+                self._leases[vm.lease_id] = vm
+                lease = vm.lease_dict()
+                record = vm.to_record()
+        if vm:
+            self._save(record)
+        metrics.CACHE_REQUESTS.inc(cache="warm_pool", result="hit" if vm else "miss")
+        # Refill right away rather than on the next maintenance tick
+        threading.Thread(target=self.maintain, name="warm-pool-refill", daemon=True).start()
+        return lease if vm else None
+
+    def _next_ready(self, template):
+        for vm in self._vms.values():
+            if vm.template == template and vm.state == READY_STATE and (vm.proc is None or vm.proc.poll() is None):
+                return vm
+        return None
+
+    def release(self, template, lease_id):
+        """Return a leased VM; False if the lease is unknown"""
+        pool = self.pools[template]
+        with self._cond:
+            vm = self._leases.get(lease_id)
+            if vm is None or vm.template != template:
+                return False
+            del self._leases[lease_id]
+            vm.state = RELEASING
+            vm.lease_id = vm.holder = vm.leased_at = vm.lease_expires = None
+            self._cond.notify_all()
+            record = vm.to_record()
+        self._save(record)
+        self._spawn(self._recycle if pool.on_release == "recycle" else self._destroy, vm)
+        return True
+
+    def get_lease(self, lease_id):
+        with self._cond:
+            vm = self._leases.get(lease_id)
+            return vm.lease_dict() if vm else None
+
+    def status(self):
+        """Per-pool size, state counts and active leases"""
+        with self._cond:
+            result = []
+            for pool in self.pools.values():
+                vms = [vm for vm in self._vms.values() if vm.template == pool.template]
+                result.append({
+                    "template": pool.template,
+                    "size": pool.size,
+                    "on_release": pool.on_release,
+                    "lease_ttl_seconds": pool.lease_ttl,
+                    "vms": {state: sum(1 for vm in vms if vm.state == state) for state in POOL_STATES},
+                    "leases": [vm.lease_dict() for vm in vms if vm.state == LEASED],
+                })
+            return result
+
+    # tart steps
+
+    def _tart(self, *args, timeout=600):
+        result = metrics.timed_run([self.tart_bin, *args], capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"tart {args[0]} failed: {result.stderr.strip() or result.returncode}")
+        return result
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _save(self, record):
+        if self.store is not None:
+            self.store.save_pool_vm(record)
+
+    def _boot(self, vm, template):
+        """Run the VM and wait until it accepts SSH; raises on failure"""
+        args = [self.tart_bin, "run"] + (["--no-graphics"] if template.headless else []) + [vm.name]
+        vm.proc = start_console(self.logs, vm.name, ["nohup", *args])
+        metrics.SUBPROCESS_SPAWNED.inc(command="tart run")
+        self._changed()
+
+        self.prober.forget(vm.name)
+        deadline = time.monotonic() + self.boot_timeout
+        while time.monotonic() < deadline:
+            if vm.proc.poll() is not None:
+                raise RuntimeError(f"tart run exited with code {vm.proc.returncode}")
+            readiness = self.prober.check({vm.name: "running"})[vm.name]
+            if readiness.state == READY:
+                vm.ip = readiness.ip
+                return
+            time.sleep(max(0.1, min(readiness.next_check - time.monotonic(), 5.0)))
+        raise RuntimeError(f"not SSH-ready after {self.boot_timeout}s")
+
+    def _reserve(self, vm, template):
+        """Claim scheduler capacity for booting `vm`; raises CapacityError if there is none to spare"""
+        if self.scheduler is not None:
+            self.scheduler.request(vm.name, priority=WARM_POOL_PRIORITY, memory_mb=template.memory_mb,
+                                   cpu=template.cpu, source="warm-pool", queue=False)
+
+    def _with_slot(self, step):
+        if self.limiter is not None and not self.limiter.acquire(timeout=self.slot_timeout):
+            raise RuntimeError("timed out waiting for an operation slot")
+        try:
+            return step()
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    def _provision(self, vm):
+        template = self.templates[vm.template]
+        started = time.monotonic()
+        try:
+            self._reserve(vm, template)
+        except CapacityError:
+            # Nothing cloned yet; try again on a later maintenance pass
+            with self._cond:
+                self._vms.pop(vm.name, None)
+            return
+        # Saved before cloning so a restart mid-provisioning cleans the clone up
+        self._save(vm.to_record())
+        try:
+            source = template.name if self.exists is not None and self.exists(template.name) else template.image_source
+            if not source:
+                raise RuntimeError(f"no clone source for template '{template.name}'")
+            from_image = source == template.image_source and self.images is not None
+            if from_image:
+                # Outside the operation slot: a long pull shouldn't hold up starts and stops
+                with timed(self.logs, vm.name, "pull"):
+                    self.images.ensure(source)
+
+            def clone_and_run():
+                self._tart("clone", source, vm.name)
+                self._tart("set", vm.name, "--cpu", str(template.cpu), "--memory", str(template.memory_mb),
+                           "--disk-size", str(template.disk_gb), timeout=60)
+                self._changed()
+
+            with timed(self.logs, vm.name, "clone"):
+                self._with_slot(clone_and_run)
+            if from_image:
+                self.images.touch(source)
+            with timed(self.logs, vm.name, "boot"):
+                self._boot(vm, template)
+        except Exception as e:
+            self._provision_failed(vm, e)
+            return
+
+        PROVISION_DURATION.observe(time.monotonic() - started, template=vm.template)
+        with self._cond:
+            self.pools[vm.template].failures = 0
+            vm.state = READY_STATE
+            vm.ready_at = utc_now()
+            self._cond.notify_all()
+            record = vm.to_record()
+        self._save(record)
+
+    def _provision_failed(self, vm, error):
+        PROVISION_FAILURES.inc(template=vm.template)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Warm pool VM {vm.name} failed: {error}")
+        with self._cond:
+            # Back off refills so a broken template doesn't clone in a tight loop
+            pool = self.pools[vm.template]
+            pool.failures += 1
+            pool.retry_at = time.monotonic() + min(self.interval * 2 ** pool.failures, 300)
+            vm.state = RELEASING
+        self._destroy(vm)
+
+    def _stop(self, vm):
+        try:
+            self._tart("stop", vm.name, timeout=60)
+        except Exception:
+            pass
+        if vm.proc is not None:
+            try:
+                vm.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                vm.proc.kill()
+                vm.proc.wait()
+        self.prober.forget(vm.name)
+        if self.scheduler is not None:
+            self.scheduler.release(vm.name)
+
+    def _destroy(self, vm):
+        self._stop(vm)
+        try:
+            self._tart("delete", vm.name, timeout=120)
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to delete {vm.name}: {e}")
+        with self._cond:
+            self._vms.pop(vm.name, None)
+            self._cond.notify_all()
+        if self.store is not None:
+            self.store.delete_pool_vm(vm.name)
+        self._changed()
+
+    def _recycle(self, vm):
+        """Reboot a released VM and put it back in the pool"""
+        self._stop(vm)
+        with self._cond:
+            vm.state = PROVISIONING
+            vm.ip = None
+            record = vm.to_record()
+        self._save(record)
+        try:
+            self._reserve(vm, self.templates[vm.template])
+            self._boot(vm, self.templates[vm.template])
+        except Exception as e:
+            self._provision_failed(vm, e)
+            return
+        with self._cond:
+            vm.state = READY_STATE
+            vm.ready_at = utc_now()
+            self._cond.notify_all()
+            record = vm.to_record()
+        self._save(record)
+
+    def restore(self, vm_states):
+        """Re-adopt the pool VMs saved by a previous run
+
+        Ready and leased clones that are still running come back as they
+        were, leases included, so jobs can release them as usual. Clones
+        that were mid-provisioning or mid-release are destroyed. Returns the
+        number of VMs adopted.
+        """
+        if self.store is None:
+            return 0
+        adopted = 0
+        now, wall = time.monotonic(), time.time()
+        for record in self.store.load_pool_vms():
+            name, template = record["name"], record["template"]
+            if template not in self.pools or name not in vm_states:
+                self.store.delete_pool_vm(name)
+                continue
+            vm = PoolVM(name, template)
+            vm.ip = record.get("ip")
+            vm.created_at = record.get("created_at") or vm.created_at
+            vm.ready_at = record.get("ready_at")
+            with self._cond:
+                if name in self._vms:
+                    continue
+                self._vms[name] = vm
+                if vm_states[name] == "running" and record["state"] in (READY_STATE, LEASED):
+                    vm.state = record["state"]
+                    if vm.state == LEASED:
+                        vm.lease_id = record["lease_id"]
+                        vm.leased_at = record.get("leased_at")
+                        vm.holder = record.get("holder")
+                        vm.lease_expires = now + (record.get("lease_expires_at") or wall) - wall
+                        self._leases[vm.lease_id] = vm
+                    adopted += 1
+                    continue
+                vm.state = RELEASING
+            self._spawn(self._destroy, vm)
+        return adopted
+
+    def cleanup_stale(self, vm_states):
+        """Delete stopped pool clones left by a previous run
+
+        Running clones may still be leased to a job, so they are left alone.
+        """
+        with self._cond:
+            owned = set(self._vms)
+        for name, state in vm_states.items():
+            template = name.rsplit("-pool-", 1)[0] if "-pool-" in name else None
+            if template in self.pools and name not in owned and state != "running":
+                self._spawn(self._destroy, PoolVM(name, template))
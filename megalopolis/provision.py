@@ -0,0 +1,627 @@
+"""
+DAG-based VM provisioning from tart/base-images.yaml and tart/vm-configs.
+
+Each requested VM becomes a chain of steps:
+
+    pull image -> clone -> set resources -> boot -> post_setup
+
+Pull steps are shared between VMs using the same base image. Steps whose
+dependencies are done run concurrently, bounded per kind: pulls by
+`max_pulls`, clone/set/`tart run` by the operation limiter, boots by the
+capacity scheduler. Every step first checks whether its result already
+exists (image cached, VM cloned, resources set, VM running and SSH-ready,
+post_setup marker present) and is skipped if so, so reruns only do what
+is missing. Given a VMLogs, each executed step is timed in the VM's log,
+`tart run` output is captured, and post_setup output streams in with a
+timing per command.
+
+    python3 -m megalopolis.provision macos-dev ci-worker-1=macos-ci-farm
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from pathlib import Path
+
+from megalopolis import metrics
+from megalopolis.readiness import READY
+from megalopolis.vmlogs import POST_SETUP as POST_SETUP_STREAM, start_console
+
+# Step kinds, in dependency order
+PULL = "pull"
+CLONE = "clone"
+CONFIGURE = "configure"
+BOOT = "boot"
+POST_SETUP = "post_setup"
+
+# Step states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+SKIPPED = "skipped"  # already satisfied
+FAILED = "failed"
+BLOCKED = "blocked"  # a dependency failed
+
+# Provisioned by `make setup-vms` when no VMs are named (DEFAULT_VMS in setup-vms.sh)
+DEFAULT_VMS = ("macos-dev", "macos-ci")
+
+# Marker written inside a VM once its post_setup commands succeeded
+POST_SETUP_MARKER = "~/.megalopolis/post_setup.sha256"
+
+# Echoed around each post_setup command so its output and duration can be told apart
+COMMAND_MARKER = "##megalopolis-command"
+
+SSH_OPTIONS = [
+    "-o", "ConnectTimeout=5", "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null", "-o", "LogLevel=ERROR", "-o", "BatchMode=yes",
+]
+
+STEP_DURATION = metrics.Histogram(
+    "megalopolis_provision_step_duration_seconds",
+    "Time spent executing provisioning steps (skipped steps excluded)",
+    ["step"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+STEPS_COMPLETED = metrics.Counter(
+    "megalopolis_provision_steps_total",
+    "Provisioning steps by kind and outcome",
+    ["step", "result"]
+)
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def ssh_settings(config_dir=None):
+    """(user, key path or None) from global_settings in base-images.yaml"""
+    from megalopolis.vmconfig import default_config_dir, load_yaml
+
+    path = Path(config_dir or default_config_dir()) / "base-images.yaml"
+    settings = (load_yaml(path).get("global_settings") or {}) if path.exists() else {}
+    key = os.path.expanduser(settings.get("ssh_key_path") or "~/.ssh/tart_rsa")
+    return settings.get("default_user") or "admin", key if os.path.exists(key) else None
+
+
+def parse_vm_specs(specs):
+    """[(vm name, template name)] from 'name' or 'name=template' strings"""
+    result = []
+    for spec in specs:
+        name, sep, template = spec.partition("=")
+        if not name:
+            raise ValueError(f"Invalid VM spec {spec!r}")
+        result.append((name, template if sep else name))
+    return result
+
+
+class Step:
+    """One node of the provisioning graph"""
+
+    __slots__ = ("id", "kind", "vm_name", "template", "target", "deps", "dependents", "state",
+                 "error", "started_at", "duration")
+
+    def __init__(self, kind, target, template, vm_name=None, deps=()):
+        self.id = f"{kind}:{target}"
+        self.kind = kind
+        self.target = target  # image source for pulls, VM name otherwise
+        self.vm_name = vm_name
+        self.template = template
+        self.deps = list(deps)
+        self.dependents = []
+        self.state = PENDING
+        self.error = None
+        self.started_at = None
+        self.duration = None
+        for dep in self.deps:
+            dep.dependents.append(self)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "step": self.kind,
+            "vm_name": self.vm_name,
+            "template": self.template.name,
+            "depends_on": [dep.id for dep in self.deps],
+            "state": self.state,
+            "error": self.error,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 3) if self.duration is not None else None,
+        }
+
+
+class ProvisionRun:
+    """A planned graph of steps and its progress"""
+
+    def __init__(self, vms, steps):
+        self.id = uuid.uuid4().hex[:12]
+        self.vms = vms
+        self.steps = steps
+        self.created_at = utc_now()
+        self.finished_at = None
+
+    @property
+    def state(self):
+        states = {step.state for step in self.steps}
+        if states & {PENDING, RUNNING}:
+            return RUNNING if self.finished_at is None else FAILED
+        return FAILED if states & {FAILED, BLOCKED} else DONE
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "vms": [{"name": name, "template": template} for name, template in self.vms],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+
+class Provisioner:
+    """Plans and executes provisioning graphs
+
+    `inventory` is a VMInventory, `prober` a ReadinessProber. `limiter`
+    (anything with acquire(timeout=)/release()) caps concurrent tart
+    clone/set/run calls; `scheduler` (optional CapacityScheduler) admits
+    boots; `images` (optional ImageCache) does the pulls, so they are
+    shared with the background pre-pull and indexed. With `queue_timeout`, a boot waits that long for capacity;
+    otherwise it fails straight away when the host is full. `logs`
+    (optional VMLogs) gets console output and step timings per VM.
+    """
+
+    def __init__(self, tart_bin, templates, inventory, prober, limiter=None, scheduler=None, images=None,
+                 max_workers=8, max_pulls=2, boot_timeout=300, slot_timeout=120, queue_timeout=None,
+                 ssh_user="admin", ssh_key=None, on_event=None, max_runs=100, logs=None):
+        self.tart_bin = tart_bin
+        self.templates = templates
+        self.inventory = inventory
+        self.prober = prober
+        self.limiter = limiter
+        self.scheduler = scheduler
+        self.images = images
+        self.max_workers = max_workers
+        self.boot_timeout = boot_timeout
+        self.slot_timeout = slot_timeout
+        self.queue_timeout = queue_timeout
+        self.ssh_user = ssh_user
+        self.ssh_key = ssh_key
+        self.on_event = on_event
+        self.max_runs = max_runs
+        self.logs = logs
+        self._pulls = threading.BoundedSemaphore(max_pulls)
+        self._lock = threading.Lock()
+        self._runs = OrderedDict()
+
+    # Planning
+
+    def plan(self, vms, boot=True, post_setup=True):
+        """Build a ProvisionRun for [(vm name, template name)]; raises ValueError"""
+        steps = OrderedDict()
+
+        def add(kind, target, template, vm_name=None, deps=()):
+            step_id = f"{kind}:{target}"
+            if step_id not in steps:
+                steps[step_id] = Step(kind, target, template, vm_name, deps)
+            return steps[step_id]
+
+        names = [name for name, _ in vms]
+        if len(set(names)) != len(names):
+            raise ValueError("Each VM may only be listed once")
+        index, _ = self.inventory.snapshot()
+        for vm_name, template_name in vms:
+            template = self.templates.get(template_name)
+            if template is None:
+                raise ValueError(f"Unknown VM template '{template_name}'")
+            deps = []
+            if index.get(vm_name) is None:
+                if not template.image_source:
+                    raise ValueError(f"Template '{template_name}' has no base image source")
+                deps.append(add(PULL, template.image_source, template))
+            step = add(CLONE, vm_name, template, vm_name, deps)
+            step = add(CONFIGURE, vm_name, template, vm_name, [step])
+            if boot:
+                step = add(BOOT, vm_name, template, vm_name, [step])
+                if post_setup and template.post_setup:
+                    add(POST_SETUP, vm_name, template, vm_name, [step])
+
+        run = ProvisionRun(list(vms), list(steps.values()))
+        with self._lock:
+            self._runs[run.id] = run
+            finished = [i for i, r in self._runs.items() if r.finished_at is not None]
+            for run_id in finished[:max(len(self._runs) - self.max_runs, 0)]:
+                del self._runs[run_id]
+        return run
+
+    def get(self, run_id):
+        with self._lock:
+            run = self._runs.get(run_id)
+            return run.to_dict() if run else None
+
+    def list(self):
+        with self._lock:
+            return [{"id": r.id, "state": r.state, "created_at": r.created_at, "finished_at": r.finished_at}
+                    for r in self._runs.values()]
+
+    # Execution
+
+    def execute(self, run):
+        """Run every step whose dependencies succeeded; returns True if none failed"""
+        remaining = {step.id: len(step.deps) for step in run.steps}
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="provision") as pool:
+            def submit_ready():
+                for step in run.steps:
+                    if step.state == PENDING and remaining[step.id] == 0:
+                        step.state = RUNNING
+                        futures[pool.submit(self._run_step, step)] = step
+
+            submit_ready()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = futures.pop(future)
+                    if step.state in (DONE, SKIPPED):
+                        for dependent in step.dependents:
+                            remaining[dependent.id] -= 1
+                    else:
+                        self._block_dependents(step)
+                submit_ready()
+        run.finished_at = utc_now()
+        return run.state == DONE
+
+    def start(self, run):
+        """Execute a run on a background thread"""
+        threading.Thread(target=self.execute, args=(run,), name=f"provision-{run.id}", daemon=True).start()
+
+    def _block_dependents(self, step):
+        for dependent in step.dependents:
+            if dependent.state == PENDING:
+                dependent.state = BLOCKED
+                dependent.error = f"{step.id} {step.state}"
+                self._event(dependent)
+                self._block_dependents(dependent)
+
+    def _event(self, step):
+        if step.state not in (PENDING, RUNNING):
+            STEPS_COMPLETED.inc(step=step.kind, result=step.state)
+        if self.on_event is not None:
+            self.on_event(step)
+
+    def _run_step(self, step):
+        check, action = {
+            PULL: (self._image_cached, self._pull),
+            CLONE: (self._vm_exists, self._clone),
+            CONFIGURE: (self._configured, self._configure),
+            BOOT: (self._booted, self._boot),
+            POST_SETUP: (self._post_setup_done, self._post_setup),
+        }[step.kind]
+        step.started_at = utc_now()
+        started = time.monotonic()
+        timings = []
+        try:
+            if check(step):
+                step.state = SKIPPED
+            else:
+                self._event(step)
+                if self.logs is not None:
+                    # A pull is timed in the log of every VM waiting on it
+                    vm_names = [step.vm_name] if step.vm_name else [d.vm_name for d in step.dependents]
+                    timings = [self.logs.begin_step(vm_name, step.kind) for vm_name in vm_names]
+                action(step)
+                step.state = DONE
+                STEP_DURATION.observe(time.monotonic() - started, step=step.kind)
+        except Exception as e:
+            step.state = FAILED
+            step.error = str(e)
+        step.duration = time.monotonic() - started
+        for timing in timings:
+            self.logs.end_step(timing, error=step.error)
+        self._event(step)
+
+    # tart helpers
+
+    def _tart(self, *args, timeout=600):
+        result = metrics.timed_run([self.tart_bin, *args], capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"tart {args[0]} failed: {result.stderr.strip() or result.returncode}")
+        return result
+
+    def _with_slot(self, action):
+        if self.limiter is not None and not self.limiter.acquire(timeout=self.slot_timeout):
+            raise RuntimeError("timed out waiting for an operation slot")
+        try:
+            return action()
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    def _record(self, name):
+        self.inventory.invalidate()
+        record, _ = self.inventory.get(name)
+        return record
+
+    # Step checks and actions
+
+    def _image_cached(self, step):
+        if self.images is not None:
+            return self.images.is_cached(step.target)
+        return self._record(step.target) is not None
+
+    def _pull(self, step):
+        with self._pulls:
+            if self.images is not None:
+                self.images.ensure(step.target)
+            else:
+                self._tart("pull", step.target, timeout=3600)
+
+    def _vm_exists(self, step):
+        return self._record(step.vm_name) is not None
+
+    def _clone(self, step):
+        self._with_slot(lambda: self._tart("clone", step.template.image_source, step.vm_name, timeout=1800))
+        if self.images is not None:
+            self.images.touch(step.template.image_source)
+        self.inventory.invalidate()
+
+    def _configured(self, step):
+        record = self._record(step.vm_name)
+        if record is not None and record.state == "running":
+            # tart can't change a running VM; it keeps its current resources
+            return True
+        try:
+            info = json.loads(self._tart("get", step.vm_name, "--format", "json", timeout=30).stdout)
+        except (RuntimeError, ValueError):
+            return False
+        info = {str(key).lower(): value for key, value in info.items()}
+        template = step.template
+        return (
+            info.get("cpu") == template.cpu
+            and info.get("memory") == template.memory_mb
+            and (info.get("disk") or 0) >= template.disk_gb
+        )
+
+    def _configure(self, step):
+        template = step.template
+        self._with_slot(lambda: self._tart(
+            "set", step.vm_name, "--cpu", str(template.cpu), "--memory", str(template.memory_mb),
+            "--disk-size", str(template.disk_gb), timeout=60
+        ))
+
+    def _booted(self, step):
+        record = self._record(step.vm_name)
+        if record is None or record.state != "running":
+            return False
+        # Running already: wait for it to be reachable rather than starting it again
+        self._wait_ready(step.vm_name, None)
+        return True
+
+    def _boot(self, step):
+        template = step.template
+        reservation = None
+        if self.scheduler is not None:
+            reservation = self.scheduler.request(
+                step.vm_name, memory_mb=template.memory_mb, cpu=template.cpu, source="provision",
+                queue=self.queue_timeout is not None
+            )
+            if reservation is not None and not self.scheduler.wait(reservation, timeout=self.queue_timeout):
+                raise RuntimeError(f"no host capacity after {self.queue_timeout:g}s")
+
+        args = [self.tart_bin, "run"] + (["--no-graphics"] if template.headless else []) + [step.vm_name]
+
+        def run():
+            # A new session keeps the VM running when make or the API is interrupted
+            return start_console(self.logs, step.vm_name, ["nohup", *args], start_new_session=True)
+
+        try:
+            proc = self._with_slot(run)
+        except Exception:
+            if reservation is not None:
+                self.scheduler.cancel(reservation)
+            raise
+        metrics.SUBPROCESS_SPAWNED.inc(command="tart run")
+        # Reap the VM process whenever it exits
+        threading.Thread(target=proc.wait, name=f"reap-{step.vm_name}", daemon=True).start()
+        self.inventory.invalidate()
+        self.prober.forget(step.vm_name)
+        self._wait_ready(step.vm_name, proc)
+
+    def _wait_ready(self, vm_name, proc):
+        """Wait until the VM accepts SSH; returns its IP, raises on exit or timeout"""
+        deadline = time.monotonic() + self.boot_timeout
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"tart run exited with code {proc.returncode}")
+            readiness = self.prober.check({vm_name: "running"})[vm_name]
+            if readiness.state == READY:
+                self.inventory.record_ip(vm_name, readiness.ip)
+                return readiness.ip
+            time.sleep(max(0.1, min(readiness.next_check - time.monotonic(), 5.0)))
+        raise RuntimeError(f"not SSH-ready after {self.boot_timeout:g}s")
+
+    def _ssh(self, vm_name, command, script=None, timeout=60):
+        ip = self._wait_ready(vm_name, None)
+        args = ["ssh", *SSH_OPTIONS]
+        if self.ssh_key:
+            args += ["-i", self.ssh_key]
+        return metrics.timed_run(
+            args + [f"{self.ssh_user}@{ip}", command],
+            input=script, capture_output=True, text=True, timeout=timeout
+        )
+
+    @staticmethod
+    def _post_setup_digest(template):
+        return hashlib.sha256("\n".join(template.post_setup).encode()).hexdigest()
+
+    def _post_setup_done(self, step):
+        result = self._ssh(step.vm_name, f"cat {POST_SETUP_MARKER} 2>/dev/null", timeout=30)
+        return result.returncode == 0 and result.stdout.strip() == self._post_setup_digest(step.template)
+
+    def _post_setup(self, step):
+        """Run the template's post_setup commands over SSH, streaming their output
+
+        Each command is echoed between markers, so its output lands in the
+        VM's log under a step of its own, timed and with its exit code.
+        """
+        digest = self._post_setup_digest(step.template)
+        commands = []
+        script = ["exec 2>&1"]  # keeps stderr in order with the markers
+        for command in step.template.post_setup:
+            if command.lstrip().startswith("#"):
+                script.append(command)
+                continue
+            commands.append(command)
+            script += [f"echo '{COMMAND_MARKER} {len(commands)}'", command,
+                       f'echo "{COMMAND_MARKER}-end {len(commands)} $?"']
+        script.append(f"mkdir -p ~/.megalopolis && echo {digest} > {POST_SETUP_MARKER}")
+
+        ip = self._wait_ready(step.vm_name, None)
+        args = ["ssh", *SSH_OPTIONS] + (["-i", self.ssh_key] if self.ssh_key else [])
+        args += [f"{self.ssh_user}@{ip}", "bash -s"]
+        started = time.monotonic()
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors="replace")
+        expired = threading.Event()
+
+        def kill():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(3600, kill)
+        timer.start()
+        timing = None
+        last_lines = deque(maxlen=20)  # for the error message
+        try:
+            proc.stdin.write("\n".join(script) + "\n")
+            proc.stdin.close()
+            for line in proc.stdout:
+                line = line.rstrip("\n")
+                marker, _, rest = line.partition(" ")
+                if marker == COMMAND_MARKER and rest.isdigit() and int(rest) <= len(commands):
+                    if self.logs is not None:
+                        timing = self.logs.begin_step(step.vm_name, POST_SETUP, commands[int(rest) - 1])
+                elif marker == COMMAND_MARKER + "-end" and timing is not None:
+                    code = rest.partition(" ")[2]
+                    self.logs.end_step(timing, error=None if code == "0" else f"exited with code {code}")
+                    timing = None
+                else:
+                    last_lines.append(line)
+                    if self.logs is not None:
+                        self.logs.append(step.vm_name, line, stream=POST_SETUP_STREAM)
+            proc.wait()
+        finally:
+            timer.cancel()
+            if timing is not None:
+                self.logs.end_step(timing, error=f"post_setup exited with code {proc.poll()}")
+        metrics.observe_command(args, time.monotonic() - started, timed_out=expired.is_set(),
+                                failed=proc.returncode != 0)
+        if expired.is_set():
+            raise RuntimeError("post_setup timed out after 3600s")
+        if proc.returncode != 0:
+            tail = "\n".join(last_lines).strip()[-500:]
+            raise RuntimeError(f"post_setup exited with code {proc.returncode}: {tail}")
+
+
+def main(argv=None):
+    """CLI used by `make provision` and scripts/setup-vms.sh"""
+    from megalopolis.images import ImageCache, configured_images, default_budget_gb
+    from megalopolis.inventory import VMInventory
+    from megalopolis.readiness import ReadinessProber
+    from megalopolis.scheduler import CapacityScheduler, default_capacity, scheduler_enabled, template_resources
+    from megalopolis.vmconfig import default_config_dir, load_base_images, load_templates
+
+    parser = argparse.ArgumentParser(
+        description="Provision tart VMs from tart/vm-configs, running independent steps in parallel"
+    )
+    parser.add_argument("vms", nargs="*", help="VM to provision, as NAME (template NAME) or NAME=TEMPLATE "
+                        f"(default: {' '.join(DEFAULT_VMS)})")
+    parser.add_argument("--config-dir", help="Directory with base-images.yaml and vm-configs/")
+    parser.add_argument("--no-boot", action="store_true", help="Clone and configure only")
+    parser.add_argument("--no-post-setup", action="store_true", help="Skip post_setup commands")
+    parser.add_argument("--jobs", type=int, default=int(os.environ.get("PROVISION_JOBS", "8")),
+                        help="Steps executed at once (default: 8)")
+    parser.add_argument("--max-pulls", type=int, default=int(os.environ.get("PROVISION_MAX_PULLS", "2")),
+                        help="Image pulls at once (default: 2)")
+    parser.add_argument("--max-operations", type=int,
+                        default=int(os.environ.get("VM_API_MAX_CONCURRENT_OPERATIONS", "3")),
+                        help="tart clone/set/run calls at once (default: 3)")
+    parser.add_argument("--boot-timeout", type=float, default=float(os.environ.get("VM_STARTUP_TIMEOUT", "300")),
+                        help="Seconds a VM has to become SSH-ready (default: 300)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan without executing it")
+    parser.add_argument("--json", action="store_true", help="Print the finished run as JSON")
+    args = parser.parse_args(argv)
+
+    config_dir = Path(args.config_dir) if args.config_dir else default_config_dir()
+    tart_bin = os.environ.get("TART_BINARY") or str(Path(__file__).resolve().parent.parent / "tart-binary")
+    templates = load_templates(config_dir)
+    ssh_user, ssh_key = ssh_settings(config_dir)
+
+    inventory = VMInventory(tart_bin)
+    capacity = default_capacity()
+    scheduler = None
+    if scheduler_enabled() and capacity["memory_mb"]:
+        scheduler = CapacityScheduler(
+            resources_for=template_resources(templates),
+            observed_vms=lambda: {vm.name: vm.state for vm in inventory.snapshot()[0].query()},
+            admit_grace=args.boot_timeout,
+            **capacity
+        )
+
+    def log(step):
+        if args.json:
+            return
+        detail = f" ({step.error})" if step.error else ""
+        took = f" in {step.duration:.1f}s" if step.duration is not None and step.state == DONE else ""
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {step.id}: {step.state}{took}{detail}", flush=True)
+
+    provisioner = Provisioner(
+        tart_bin, templates, inventory, ReadinessProber(tart_bin),
+        limiter=threading.BoundedSemaphore(args.max_operations),
+        scheduler=scheduler,
+        images=ImageCache(tart_bin, inventory, configured_images(load_base_images(config_dir)),
+                          budget_gb=default_budget_gb(), max_pulls=args.max_pulls),
+        max_workers=args.jobs,
+        max_pulls=args.max_pulls,
+        boot_timeout=args.boot_timeout,
+        ssh_user=ssh_user,
+        ssh_key=ssh_key,
+        on_event=log,
+    )
+    try:
+        run = provisioner.plan(
+            parse_vm_specs(args.vms) if args.vms else [(name, name) for name in DEFAULT_VMS],
+            boot=not args.no_boot,
+            post_setup=not args.no_post_setup
+        )
+    except (ValueError, subprocess.SubprocessError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    if args.dry_run:
+        for step in run.steps:
+            deps = f" after {', '.join(dep.id for dep in step.deps)}" if step.deps else ""
+            print(f"{step.id}{deps}")
+        return 0
+
+    ok = provisioner.execute(run)
+    if args.json:
+        print(json.dumps(run.to_dict(), indent=2))
+    else:
+        counts = {}
+        for step in run.steps:
+            counts[step.state] = counts.get(step.state, 0) + 1
+        print("Provisioning " + ("completed" if ok else "failed") + ": "
+              + ", ".join(f"{count} {state}" for state, count in sorted(counts.items())))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
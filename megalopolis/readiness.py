@@ -0,0 +1,213 @@
+"""
+Native VM readiness prober.
+
+Python replacement for get_vm_status/check_vm_health in
+scripts/vm-readiness-monitor.sh. Instead of forking `nc` and `ssh` per VM
+with fixed sleeps, all due VMs are probed concurrently on one asyncio loop:
+a non-blocking TCP connect to port 22 followed by an SSH banner read.
+IPs and states are cached per VM, ready VMs are rechecked on a slow
+interval and VMs that are still coming up back off exponentially.
+"""
+
+import asyncio
+import threading
+import time
+
+from megalopolis import metrics
+
+# States reported by vm-readiness-monitor.sh `status`
+READY = "ready"
+SSH_PENDING = "ssh-pending"
+BOOTING = "booting"
+STOPPED = "stopped"
+NOT_FOUND = "not_found"
+UNKNOWN = "unknown"
+
+
+class VMReadiness:
+    """Last known readiness of one VM"""
+
+    __slots__ = ("name", "state", "ip", "banner", "checked_at", "next_check", "failures", "latency")
+
+    def __init__(self, name, state, ip=None, banner=None, latency=0.0):
+        self.name = name
+        self.state = state
+        self.ip = ip
+        self.banner = banner
+        self.checked_at = time.time()
+        self.next_check = 0.0  # time.monotonic() after which the cache is stale
+        self.failures = 0
+        self.latency = latency
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "ip": self.ip,
+            "ssh_banner": self.banner,
+            "checked_at": self.checked_at,
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+
+
+class ReadinessProber:
+    """Concurrent, cached SSH readiness checks for tart VMs
+
+    Callers pass the tart state of each VM (from an inventory snapshot) so
+    the prober never needs its own `tart list`. Only `tart ip` is run, and
+    only for VMs without a cached IP or whose cached IP stopped answering.
+    `on_change` (optional) is called with the results whose state or IP
+    changed, e.g. to persist them.
+    """
+
+    def __init__(self, tart_bin, port=22, connect_timeout=2.0, ip_timeout=5.0,
+                 ready_recheck=30.0, min_backoff=1.0, max_backoff=10.0, on_change=None):
+        self.tart_bin = tart_bin
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.ip_timeout = ip_timeout
+        self.ready_recheck = ready_recheck
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get(self, vm_name):
+        """Cached readiness for a VM, or None if it was never checked"""
+        with self._lock:
+            return self._cache.get(vm_name)
+
+    def check(self, vm_states, force=False):
+        """Return {name: VMReadiness} for {name: tart state or None}
+
+        Running VMs whose cached result is still fresh are not probed
+        again unless `force` is set; the rest are probed concurrently.
+        """
+        now = time.monotonic()
+        results = {}
+        due = []
+        changed = []
+        with self._lock:
+            for name, tart_state in vm_states.items():
+                if tart_state != "running":
+                    state = {None: NOT_FOUND, "stopped": STOPPED}.get(tart_state, UNKNOWN)
+                    previous = self._cache.get(name)
+                    results[name] = self._cache[name] = VMReadiness(name, state)
+                    if previous is None or previous.state != state:
+                        changed.append(results[name])
+                    continue
+                cached = self._cache.get(name)
+                if cached is not None and not force and now < cached.next_check:
+                    metrics.CACHE_REQUESTS.inc(cache="readiness", result="hit")
+                    results[name] = cached
+                else:
+                    metrics.CACHE_REQUESTS.inc(cache="readiness", result="miss")
+                    due.append((name, cached.ip if cached is not None else None))
+
+        if due:
+            probed = asyncio.run(self._probe_all(due))
+            now = time.monotonic()
+            with self._lock:
+                for record in probed:
+                    previous = self._cache.get(record.name)
+                    if record.state == READY:
+                        record.next_check = now + self.ready_recheck
+                    else:
+                        record.failures = (previous.failures + 1) if previous is not None else 1
+                        backoff = self.min_backoff * 2 ** (record.failures - 1)
+                        record.next_check = now + min(backoff, self.max_backoff)
+                    results[record.name] = self._cache[record.name] = record
+                    if previous is None or (previous.state, previous.ip) != (record.state, record.ip):
+                        changed.append(record)
+
+        if changed and self.on_change is not None:
+            self.on_change(changed)
+        return results
+
+    def restore(self, known):
+        """Seed the cache from {name: (state, ip, checked_at)} saved by an earlier run
+
+        Seeded entries are due for a probe straight away, but through the
+        saved IP, so VMs that kept running skip `tart ip`.
+        """
+        with self._lock:
+            for name, (state, ip, checked_at) in known.items():
+                if name not in self._cache:
+                    record = VMReadiness(name, state, ip)
+                    record.checked_at = checked_at
+                    self._cache[name] = record
+
+    def forget(self, vm_name):
+        """Drop cached state, e.g. after the VM was stopped or restarted"""
+        with self._lock:
+            self._cache.pop(vm_name, None)
+
+    async def _probe_all(self, due):
+        return await asyncio.gather(*(self._probe_vm(name, ip) for name, ip in due))
+
+    async def _probe_vm(self, name, cached_ip):
+        started = time.monotonic()
+        ip = cached_ip
+        state, banner = SSH_PENDING, None
+        if ip is not None:
+            state, banner = await self._probe_ssh(ip)
+
+        # No IP yet, or the cached one stopped answering: ask tart again
+        if state != READY:
+            resolved = await self._resolve_ip(name)
+            if resolved is None:
+                return VMReadiness(name, BOOTING, latency=time.monotonic() - started)
+            if resolved != ip:
+                ip = resolved
+                state, banner = await self._probe_ssh(ip)
+
+        return VMReadiness(name, state, ip, banner, time.monotonic() - started)
+
+    async def _resolve_ip(self, name):
+        args = [self.tart_bin, "ip", name]
+        started = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError:
+            metrics.observe_command(args, time.perf_counter() - started, failed=True)
+            return None
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), self.ip_timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            metrics.observe_command(args, time.perf_counter() - started, timed_out=True)
+            return None
+        metrics.observe_command(args, time.perf_counter() - started, failed=proc.returncode != 0)
+        ip = stdout.decode().strip()
+        return ip if proc.returncode == 0 and ip else None
+
+    async def _probe_ssh(self, ip):
+        """Connect to the SSH port and read the server banner"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, self.port), self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return SSH_PENDING, None
+
+        try:
+            banner = await asyncio.wait_for(reader.readline(), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError):
+            banner = b""
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+        # Port open but sshd not answering yet is still pending
+        if banner.startswith(b"SSH-"):
+            return READY, banner.decode(errors="replace").strip()
+        return SSH_PENDING, None
@@ -0,0 +1,284 @@
+"""
+Response layer shared by the VM API, the federation front end and the
+status dashboard.
+
+- HTTP/1.1 keep-alive: every response carries a Content-Length, idle
+  connections are closed after KEEPALIVE_TIMEOUT seconds, and a request
+  whose body the handler never read closes its connection rather than
+  leaving the body to be parsed as the next request.
+- JSON is compact, and gzip-encoded for clients that accept it once the
+  body is large enough to gain from it.
+- Every GET response gets a content-hash ETag; a matching If-None-Match
+  is answered 304 with no body.
+- Bodies that only change with some version (an inventory snapshot, a
+  status collection) are serialized, hashed and compressed once per
+  version in a RepresentationCache. A poll that finds nothing changed
+  costs a dictionary lookup, and a few bytes when it sends its ETag.
+- Static files are held in memory and revalidated by mtime.
+- Streams of unknown length (log follows) use chunked transfer encoding,
+  so their connection can be kept alive too.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer
+
+from megalopolis import metrics
+
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "5"))
+
+# Pending connections the kernel queues before accept(); socketserver's
+# default of 5 drops SYNs under bursts and clients stall for a 1s retransmit
+LISTEN_BACKLOG = int(os.environ.get("HTTP_LISTEN_BACKLOG", "128"))
+
+# Smaller bodies are sent uncompressed
+GZIP_MIN_SIZE = 1024
+
+NOT_MODIFIED = metrics.Counter(
+    "megalopolis_http_not_modified_total",
+    "Conditional GETs answered 304 Not Modified",
+    ["route"]
+)
+RESPONSE_BYTES = metrics.Counter(
+    "megalopolis_http_response_bytes_total",
+    "Response body bytes written, by content encoding",
+    ["encoding"]
+)
+
+
+def encode_json(data):
+    """Compact JSON bytes"""
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def accepts_gzip(header):
+    """True if an Accept-Encoding header allows gzip"""
+    for item in (header or "").split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        name, _, value = params.strip().partition("=")
+        try:
+            return name.strip().lower() != "q" or float(value) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match header lists `etag` (weak comparison)"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    base = etag.strip('"')
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == base or tag == base + "-gzip":
+            return True
+    return False
+
+
+class Representation:
+    """A serialized response body with its ETag and, once asked for, its gzip encoding"""
+
+    __slots__ = ("body", "content_type", "etag", "_gzipped")
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self._gzipped = None
+
+    @classmethod
+    def json(cls, data):
+        return cls(encode_json(data), "application/json")
+
+    def gzipped(self):
+        if self._gzipped is None:
+            # mtime=0 keeps the encoding, and so its ETag, stable
+            self._gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzipped
+
+
+class RepresentationCache:
+    """Representations by key, least recently used evicted beyond `max_entries`
+
+    Keys carry whatever version the content depends on, so an entry is
+    never stale: a new version is a new key.
+    """
+
+    def __init__(self, name, max_entries=64):
+        self.name = name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, build):
+        """The representation for `key`, calling `build()` to make it on a miss"""
+        with self._lock:
+            representation = self._entries.get(key)
+            if representation is not None:
+                self._entries.move_to_end(key)
+        if representation is not None:
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return representation
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        representation = build()
+        with self._lock:
+            self._entries[key] = representation
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return representation
+
+
+class StaticFiles:
+    """Files held in memory, re-read only when their mtime or size changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def get(self, path):
+        """The representation of the file at `path`; None if it isn't a readable file"""
+        try:
+            stat = os.stat(path)
+            with self._lock:
+                cached = self._files.get(path)
+            if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+                metrics.CACHE_REQUESTS.inc(cache="static", result="hit")
+                return cached[1]
+            metrics.CACHE_REQUESTS.inc(cache="static", result="miss")
+            with open(path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+            content_type += "; charset=utf-8"
+        representation = Representation(body, content_type)
+        with self._lock:
+            self._files[path] = ((stat.st_mtime_ns, stat.st_size), representation)
+        return representation
+
+
+class ResponseMixin:
+    """HTTP/1.1 keep-alive, compression and conditional GET for BaseHTTPRequestHandler subclasses
+
+    Goes first in the bases, ahead of metrics.InstrumentedHandlerMixin.
+    Handlers read request bodies through read_body() and answer through
+    send_body(), send_json_body() or send_representation(), or stream
+    with send_chunked(), write_chunk() and end_chunks().
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle_one_request(self):
+        self._body_read = False
+        super().handle_one_request()
+        headers = getattr(self, "headers", None)
+        if headers is not None and not self._body_read and (
+                (headers.get("Content-Length") or "0").strip() not in ("", "0")
+                or headers.get("Transfer-Encoding")):
+            # The unread body would be parsed as the next request
+            self.close_connection = True
+
+    def log_error(self, format, *args):
+        # An idle keep-alive connection timing out is routine, not an error
+        if not format.startswith("Request timed out"):
+            super().log_error(format, *args)
+
+    def read_body(self):
+        """The request body as bytes; b'' without one. Raises ValueError on a bad Content-Length"""
+        self._body_read = True
+        length = int(self.headers.get("Content-Length") or 0)
+        if length < 0:
+            raise ValueError("negative Content-Length")
+        return self.rfile.read(length) if length else b""
+
+    def send_representation(self, status, representation, headers=None, cache_control="no-cache"):
+        """Send a representation, or 304 if it is a GET the client already has"""
+        conditional = self.command in ("GET", "HEAD") and status == 200
+        if conditional and etag_matches(self.headers.get("If-None-Match"), representation.etag):
+            NOT_MODIFIED.inc(route=getattr(self, "route", None) or "other")
+            self.send_response(304)
+            self.send_header("ETag", representation.etag)
+            self.send_header("Cache-Control", cache_control)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        body = representation.body
+        encoding = "identity"
+        if len(body) >= GZIP_MIN_SIZE and accepts_gzip(self.headers.get("Accept-Encoding")):
+            body = representation.gzipped()
+            encoding = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", representation.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding == "gzip":
+            self.send_header("Content-Encoding", "gzip")
+        if conditional:
+            etag = representation.etag
+            self.send_header("ETag", etag[:-1] + '-gzip"' if encoding == "gzip" else etag)
+            self.send_header("Vary", "Accept-Encoding")
+        if cache_control:
+            self.send_header("Cache-Control", cache_control)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+            RESPONSE_BYTES.inc(len(body), encoding=encoding)
+
+    def send_body(self, status, body, content_type, headers=None, cache_control="no-cache"):
+        """Send bytes as a one-off representation"""
+        self.send_representation(status, Representation(body, content_type), headers, cache_control)
+
+    def send_json_body(self, status, data, headers=None, cache_control="no-cache"):
+        """Send data as compact JSON"""
+        self.send_representation(status, Representation.json(data), headers, cache_control)
+
+    def send_chunked(self, status, content_type, headers=None):
+        """Start a streamed response; HTTP/1.0 clients get one ended by closing the connection"""
+        self._chunked = self.request_version != "HTTP/1.0"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        if self._chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def write_chunk(self, data):
+        """Write and flush part of a send_chunked() response"""
+        if not data:
+            return
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if self._chunked else data)
+        self.wfile.flush()
+        RESPONSE_BYTES.inc(len(data), encoding="identity")
+
+    def end_chunks(self):
+        if self._chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+
+class KeepAliveHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog sized for many polling clients"""
+
+    request_queue_size = LISTEN_BACKLOG
@@ -0,0 +1,352 @@
+"""
+Capacity-aware admission for VM starts.
+
+Replaces the hard-coded memory estimates scripts/auto-provision-vms.sh
+used to make. Every VM that runs holds a reservation of the memory and
+CPUs from its tart/vm-configs template. A start is admitted
+when the host still has room, queued (by priority, then arrival) when it
+will fit once something stops, and rejected outright when it can never
+fit. VMs already running when the API starts, or started outside it, are
+picked up from the inventory so they count against capacity too.
+"""
+
+import itertools
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from megalopolis import metrics
+from megalopolis.vmconfig import DEFAULT_CPU, DEFAULT_MEMORY_MB
+
+# Reservation states
+QUEUED = "queued"
+ADMITTED = "admitted"  # resources held, VM not yet seen running
+RUNNING = "running"
+CANCELLED = "cancelled"
+
+SCHEDULER_DECISIONS = metrics.Counter(
+    "megalopolis_scheduler_decisions_total",
+    "VM admission decisions by outcome",
+    ["result"]
+)
+SCHEDULER_QUEUE_WAIT = metrics.Histogram(
+    "megalopolis_scheduler_queue_wait_seconds",
+    "Time queued VM starts waited for capacity",
+    buckets=(0.1, 1, 5, 10, 30, 60, 120, 300, 600)
+)
+
+
+class CapacityError(Exception):
+    """A start that cannot be admitted or queued
+
+    `retryable` is False when the VM can never fit on this host.
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def host_memory_mb():
+    """Physical memory in MB, None if the platform doesn't report it"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def scheduler_enabled():
+    """Whether to admit starts against host capacity
+
+    VM_API_SCHEDULER=1 or 0 turns admission on or off. Left unset, it is on
+    only when VM_API_HOST_MEMORY_MB and VM_API_HOST_CPUS are both given:
+    detected values describe whatever runs the API, which in a container
+    is the Docker VM rather than the Mac, and would reject starts that fit.
+    """
+    setting = os.environ.get("VM_API_SCHEDULER", "").strip().lower()
+    if setting in ("0", "false", "off"):
+        return False
+    if setting in ("1", "true", "on"):
+        return True
+    return bool(os.environ.get("VM_API_HOST_MEMORY_MB") and os.environ.get("VM_API_HOST_CPUS"))
+
+
+def default_capacity():
+    """CapacityScheduler settings from the VM_API_HOST_* / VM_API_SCHEDULER_* env vars
+
+    Host memory and CPUs are detected unless overridden; this matters when
+    the API runs in a container that sees less than the Mac it drives.
+    The host keeps 16GB or a quarter of its memory, whichever is smaller.
+    `memory_mb` is None when it can't be detected.
+    """
+    memory_mb = int(os.environ.get("VM_API_HOST_MEMORY_MB") or 0) or host_memory_mb()
+    reserved = os.environ.get("VM_API_HOST_RESERVED_MEMORY_MB")
+    return {
+        "memory_mb": memory_mb,
+        "cpus": int(os.environ.get("VM_API_HOST_CPUS") or 0) or os.cpu_count() or 1,
+        "reserved_memory_mb": int(reserved) if reserved else min(16384, (memory_mb or 0) // 4),
+        "cpu_overcommit": float(os.environ.get("VM_API_CPU_OVERCOMMIT", "1.0")),
+        "max_vms": int(os.environ.get("VM_API_MAX_RUNNING_VMS", "8")),
+        "max_queue": int(os.environ.get("VM_API_SCHEDULER_MAX_QUEUE", "100")),
+    }
+
+
+def template_resources(templates):
+    """resources_for() over VM templates
+
+    A VM is matched to the template with its name, or the longest template
+    name it starts with (so `macos-ci-farm-pool-1a2b` and `macos-ci-2` are
+    charged like their templates); anything else gets the defaults.
+    """
+    by_length = sorted(templates, key=len, reverse=True)
+
+    def resources_for(vm_name):
+        template = templates.get(vm_name)
+        if template is None:
+            template = next((templates[t] for t in by_length if vm_name.startswith(t + "-")), None)
+        if template is None:
+            return DEFAULT_MEMORY_MB, DEFAULT_CPU
+        return template.memory_mb, template.cpu
+
+    return resources_for
+
+
+class Reservation:
+    """Memory and CPUs held (or waited for) on behalf of one VM"""
+
+    __slots__ = ("id", "vm_name", "memory_mb", "cpu", "priority", "state", "source",
+                 "requested_at", "admitted_at", "created", "seq")
+
+    def __init__(self, vm_name, memory_mb, cpu, priority=0, source="api", seq=0):
+        self.id = f"r{seq}"
+        self.vm_name = vm_name
+        self.memory_mb = memory_mb
+        self.cpu = cpu
+        self.priority = priority
+        self.state = QUEUED
+        self.source = source
+        self.requested_at = datetime.now(timezone.utc).isoformat()
+        self.admitted_at = None
+        self.created = time.monotonic()
+        self.seq = seq
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "vm_name": self.vm_name,
+            "memory_mb": self.memory_mb,
+            "cpu": self.cpu,
+            "priority": self.priority,
+            "state": self.state,
+            "source": self.source,
+            "requested_at": self.requested_at,
+            "admitted_at": self.admitted_at,
+        }
+
+
+class CapacityScheduler:
+    """Admits, queues or rejects VM starts against host memory and CPU
+
+    `reserved_memory_mb` is kept free for the host itself; CPUs may be
+    overcommitted by `cpu_overcommit` (1.0 = none). `max_vms` caps the
+    number of VMs holding reservations. A queued request only holds back
+    requests of lower priority, so smaller requests at the same priority
+    can backfill around one that is waiting for a large slot.
+    """
+
+    def __init__(self, memory_mb, cpus, reserved_memory_mb=16384, cpu_overcommit=1.0, max_vms=8,
+                 max_queue=100, resources_for=None, observed_vms=None, admit_grace=300):
+        self.memory_mb = max(memory_mb - reserved_memory_mb, 0)
+        self.cpus = cpus * cpu_overcommit
+        self.host_memory_mb = memory_mb
+        self.reserved_memory_mb = reserved_memory_mb
+        self.max_vms = max_vms
+        self.max_queue = max_queue
+        self.resources_for = resources_for or (lambda name: (DEFAULT_MEMORY_MB, DEFAULT_CPU))
+        self.observed_vms = observed_vms
+        self.admit_grace = admit_grace
+        self._cond = threading.Condition()
+        self._seq = itertools.count(1)
+        self._reservations = {}  # vm_name -> Reservation holding resources
+        self._queue = []  # waiting Reservations
+
+        metrics.Gauge(
+            "megalopolis_scheduler_queue_depth",
+            "VM starts waiting for capacity",
+            func=lambda: len(self._queue)
+        )
+        metrics.Gauge(
+            "megalopolis_scheduler_committed",
+            "Resources reserved by admitted and running VMs",
+            ["resource"],
+            func=lambda: dict(zip([("memory_mb",), ("cpu",), ("vms",)], self._committed()))
+        )
+        metrics.Gauge(
+            "megalopolis_scheduler_capacity",
+            "Resources available to VMs in total",
+            ["resource"],
+            func=lambda: {("memory_mb",): self.memory_mb, ("cpu",): self.cpus, ("vms",): self.max_vms}
+        )
+
+    def _committed(self):
+        with self._cond:
+            held = list(self._reservations.values())
+        return sum(r.memory_mb for r in held), sum(r.cpu for r in held), len(held)
+
+    def _fits_locked(self, memory_mb, cpu, extra_vms=1):
+        held = self._reservations.values()
+        return (
+            sum(r.memory_mb for r in held) + memory_mb <= self.memory_mb
+            and sum(r.cpu for r in held) + cpu <= self.cpus
+            and len(self._reservations) + extra_vms <= self.max_vms
+        )
+
+    def request(self, vm_name, priority=0, memory_mb=None, cpu=None, source="api", queue=True):
+        """Reserve capacity for starting `vm_name`
+
+        Returns a Reservation that is either admitted or queued; wait() on
+        a queued one. Returns None if the VM already holds a reservation
+        (it is running or being started). Raises CapacityError if the VM can never fit, or if
+        it doesn't fit now and queueing is disabled or the queue is full.
+        """
+        if memory_mb is None or cpu is None:
+            default_memory, default_cpu = self.resources_for(vm_name)
+            memory_mb = default_memory if memory_mb is None else memory_mb
+            cpu = default_cpu if cpu is None else cpu
+        if memory_mb > self.memory_mb or cpu > self.cpus:
+            SCHEDULER_DECISIONS.inc(result="rejected")
+            raise CapacityError(
+                f"VM '{vm_name}' needs {memory_mb}MB / {cpu} CPUs; this host offers VMs at most "
+                f"{self.memory_mb}MB / {self.cpus:g} CPUs",
+                retryable=False
+            )
+
+        self.reconcile()
+        with self._cond:
+            if vm_name in self._reservations:
+                return None
+            if any(r.vm_name == vm_name for r in self._queue):
+                raise CapacityError(f"VM '{vm_name}' is already waiting for capacity")
+            reservation = Reservation(vm_name, memory_mb, cpu, priority, source, next(self._seq))
+            blocked = any(r.priority > priority for r in self._queue)
+            if not blocked and self._fits_locked(memory_mb, cpu):
+                self._admit_locked(reservation)
+                SCHEDULER_DECISIONS.inc(result="admitted")
+                return reservation
+            if not queue or len(self._queue) >= self.max_queue:
+                SCHEDULER_DECISIONS.inc(result="rejected")
+                reason = "queue is full" if queue else "no capacity right now"
+                raise CapacityError(f"Cannot start VM '{vm_name}': {reason}")
+            self._queue.append(reservation)
+            self._queue.sort(key=lambda r: (-r.priority, r.seq))
+            SCHEDULER_DECISIONS.inc(result="queued")
+            return reservation
+
+    def _admit_locked(self, reservation):
+        reservation.state = ADMITTED
+        reservation.admitted_at = datetime.now(timezone.utc).isoformat()
+        reservation.created = time.monotonic()
+        self._reservations[reservation.vm_name] = reservation
+
+    def _dispatch_locked(self):
+        """Admit queued requests that now fit, in priority order"""
+        blocked_priority = None
+        for reservation in list(self._queue):
+            if blocked_priority is not None and reservation.priority < blocked_priority:
+                break
+            if reservation.vm_name in self._reservations:
+                continue
+            if self._fits_locked(reservation.memory_mb, reservation.cpu):
+                self._queue.remove(reservation)
+                SCHEDULER_QUEUE_WAIT.observe(time.monotonic() - reservation.created)
+                self._admit_locked(reservation)
+            elif blocked_priority is None:
+                blocked_priority = reservation.priority
+        self._cond.notify_all()
+
+    def wait(self, reservation, timeout=None):
+        """Block until a queued reservation is admitted; False on timeout (it is then cancelled)"""
+        with self._cond:
+            admitted = self._cond.wait_for(lambda: reservation.state != QUEUED, timeout)
+            if not admitted:
+                self._queue.remove(reservation)
+                reservation.state = CANCELLED
+                self._dispatch_locked()
+            return reservation.state in (ADMITTED, RUNNING)
+
+    def release(self, vm_name):
+        """Free the capacity held for a VM (stopped, deleted or failed to start)"""
+        with self._cond:
+            reservation = self._reservations.pop(vm_name, None)
+            if reservation is not None:
+                self._dispatch_locked()
+            return reservation is not None
+
+    def cancel(self, reservation):
+        """Withdraw a queued request or release an admitted one"""
+        with self._cond:
+            if reservation in self._queue:
+                self._queue.remove(reservation)
+                reservation.state = CANCELLED
+                self._dispatch_locked()
+                return
+        if self._reservations.get(reservation.vm_name) is reservation:
+            self.release(reservation.vm_name)
+
+    def reconcile(self, vm_states=None):
+        """Match reservations to the VMs that are actually running
+
+        Running VMs without a reservation are charged their template's
+        resources; admitted VMs that never showed up within `admit_grace`
+        seconds, and running ones that stopped, are released.
+        """
+        if vm_states is None:
+            if self.observed_vms is None:
+                return
+            try:
+                vm_states = self.observed_vms()
+            except Exception:
+                return
+        now = time.monotonic()
+        with self._cond:
+            for name, state in vm_states.items():
+                held = self._reservations.get(name)
+                if state == "running":
+                    if held is None:
+                        memory_mb, cpu = self.resources_for(name)
+                        held = Reservation(name, memory_mb, cpu, source="observed", seq=next(self._seq))
+                        self._admit_locked(held)
+                    held.state = RUNNING
+            for name, held in list(self._reservations.items()):
+                state = vm_states.get(name)
+                if state == "running":
+                    continue
+                if held.state == RUNNING or now - held.created > self.admit_grace:
+                    del self._reservations[name]
+            self._dispatch_locked()
+
+    def status(self):
+        """Capacity, commitments, queue and reservations for the API"""
+        with self._cond:
+            held = sorted(self._reservations.values(), key=lambda r: r.seq)
+            queue = list(self._queue)
+        memory, cpu = sum(r.memory_mb for r in held), sum(r.cpu for r in held)
+        return {
+            "capacity": {
+                "host_memory_mb": self.host_memory_mb,
+                "reserved_for_host_mb": self.reserved_memory_mb,
+                "memory_mb": self.memory_mb,
+                "cpu": self.cpus,
+                "max_vms": self.max_vms,
+            },
+            "committed": {"memory_mb": memory, "cpu": cpu, "vms": len(held)},
+            "available": {
+                "memory_mb": self.memory_mb - memory,
+                "cpu": self.cpus - cpu,
+                "vms": self.max_vms - len(held),
+            },
+            "queue_depth": len(queue),
+            "queue": [r.to_dict() for r in queue],
+            "reservations": [r.to_dict() for r in held],
+        }
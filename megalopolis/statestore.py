@@ -0,0 +1,204 @@
+"""
+Durable state for the VM API, so a restart comes back warm.
+
+Everything the API knows is otherwise derived in memory: the `tart list`
+snapshot, IPs and SSH readiness learned by probing, the operation journal
+and warm pool leases. StateStore keeps a copy in a SQLite file
+(VM_API_STATE_DB) in WAL mode. On startup the API serves the stored
+snapshot straight away while the first `tart list` reconciles it, resumes
+operations that were in flight and re-adopts pool VMs that are still
+running. tart remains the source of truth: stored state is only a starting
+point that the next refresh corrects.
+
+Writes are incremental. The inventory is diffed against what was last
+stored, so a refresh that changes nothing writes one timestamp.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from megalopolis import metrics
+from megalopolis.inventory import VMRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vms (
+    name TEXT PRIMARY KEY, source TEXT, disk INTEGER, size INTEGER, state TEXT, ip TEXT
+);
+CREATE TABLE IF NOT EXISTS readiness (
+    name TEXT PRIMARY KEY, state TEXT NOT NULL, ip TEXT, checked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS operations (
+    id TEXT PRIMARY KEY, created_at TEXT NOT NULL, done INTEGER NOT NULL, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pool_vms (
+    name TEXT PRIMARY KEY, template TEXT NOT NULL, state TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+VM_COLUMNS = ("name", "source", "disk", "size", "state", "ip")
+
+STATE_WRITES = metrics.Counter(
+    "megalopolis_state_store_writes_total",
+    "Rows written to or deleted from the VM API state store",
+    ["table"]
+)
+STATE_ERRORS = metrics.Counter(
+    "megalopolis_state_store_errors_total",
+    "State store reads and writes that failed",
+    ["table"]
+)
+
+
+def default_state_path():
+    """VM_API_STATE_DB, default ~/.megalopolis/vm-api-state.db; None when set to 'off'"""
+    value = os.environ.get("VM_API_STATE_DB", "~/.megalopolis/vm-api-state.db")
+    if value.lower() in ("", "off", "none", "0"):
+        return None
+    return Path(os.path.expanduser(value))
+
+
+class StateStore:
+    """SQLite copy of the VM API's inventory, readiness, operations and pool VMs
+
+    One connection is shared by all threads and serialized by a lock;
+    every write is its own small transaction. A failed write is logged and
+    counted but never raised, since the in-memory state stays authoritative
+    for the running process.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        # Last stored row per VM, so refreshes only write what changed
+        self._vms = {row[0]: row for row in self._db.execute(f"SELECT {', '.join(VM_COLUMNS)} FROM vms")}
+
+    def _write(self, table, statements):
+        """Run (sql, params) pairs in one transaction; False if it failed"""
+        with self._lock:
+            try:
+                with self._db:
+                    for sql, params in statements:
+                        self._db.execute(sql, params)
+            except sqlite3.Error as e:
+                STATE_ERRORS.inc(table=table)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] State store write to {table} failed: {e}")
+                return False
+        STATE_WRITES.inc(len(statements), table=table)
+        return True
+
+    def _read(self, table, sql, params=()):
+        with self._lock:
+            try:
+                return self._db.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                STATE_ERRORS.inc(table=table)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] State store read of {table} failed: {e}")
+                return []
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # Inventory
+
+    def load_inventory(self):
+        """(VMRecords, epoch time of the `tart list` they came from); ([], None) if never saved"""
+        rows = self._read("meta", "SELECT value FROM meta WHERE key = 'inventory_at'")
+        if not rows:
+            return [], None
+        with self._lock:
+            records = [VMRecord(*row) for row in self._vms.values()]
+        return records, rows[0][0]
+
+    def save_inventory(self, records, taken_at=None):
+        """Store a `tart list` snapshot, writing only VMs that were added, changed or removed"""
+        rows = {record.name: tuple(getattr(record, column) for column in VM_COLUMNS) for record in records}
+        with self._lock:
+            changed = [row for name, row in rows.items() if self._vms.get(name) != row]
+            removed = [name for name in self._vms if name not in rows]
+        statements = [(f"INSERT OR REPLACE INTO vms VALUES ({', '.join('?' * len(VM_COLUMNS))})", row)
+                      for row in changed]
+        statements += [("DELETE FROM vms WHERE name = ?", (name,)) for name in removed]
+        statements.append(("INSERT OR REPLACE INTO meta VALUES ('inventory_at', ?)",
+                           (time.time() if taken_at is None else taken_at,)))
+        if self._write("vms", statements):
+            with self._lock:
+                self._vms = rows
+
+    def save_ip(self, vm_name, ip):
+        """Remember the IP learned for a VM between refreshes"""
+        with self._lock:
+            row = self._vms.get(vm_name)
+        if row is None or row[-1] == ip:
+            return
+        if self._write("vms", [("UPDATE vms SET ip = ? WHERE name = ?", (ip, vm_name))]):
+            with self._lock:
+                if vm_name in self._vms:
+                    self._vms[vm_name] = row[:-1] + (ip,)
+
+    # Readiness
+
+    def load_readiness(self):
+        """{name: (state, ip, checked_at)} as last probed"""
+        rows = self._read("readiness", "SELECT name, state, ip, checked_at FROM readiness")
+        return {name: (state, ip, checked_at) for name, state, ip, checked_at in rows}
+
+    def save_readiness(self, records):
+        """Store VMReadiness results, dropping VMs that are no longer running"""
+        statements = []
+        for record in records:
+            if record.state in ("stopped", "not_found"):
+                statements.append(("DELETE FROM readiness WHERE name = ?", (record.name,)))
+            else:
+                statements.append(("INSERT OR REPLACE INTO readiness VALUES (?, ?, ?, ?)",
+                                   (record.name, record.state, record.ip, record.checked_at)))
+        if statements:
+            self._write("readiness", statements)
+
+    # Operations
+
+    def load_operations(self, limit):
+        """The newest `limit` operation dicts, oldest first"""
+        rows = self._read(
+            "operations",
+            "SELECT data FROM operations ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,)
+        )
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def save_operation(self, op):
+        """Store an operation dict (Operation.to_dict())"""
+        self._write("operations", [(
+            "INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?)",
+            (op["id"], op["created_at"], int(op["done"]), json.dumps(op))
+        )])
+
+    def delete_operations(self, op_ids):
+        if op_ids:
+            self._write("operations", [("DELETE FROM operations WHERE id = ?", (op_id,)) for op_id in op_ids])
+
+    # Warm pool VMs
+
+    def load_pool_vms(self):
+        """Pool VM dicts as last stored"""
+        return [json.loads(data) for (data,) in self._read("pool_vms", "SELECT data FROM pool_vms")]
+
+    def save_pool_vm(self, vm):
+        """Store a pool VM dict (PoolVM.to_record())"""
+        self._write("pool_vms", [(
+            "INSERT OR REPLACE INTO pool_vms VALUES (?, ?, ?, ?)",
+            (vm["name"], vm["template"], vm["state"], json.dumps(vm))
+        )])
+
+    def delete_pool_vm(self, vm_name):
+        self._write("pool_vms", [("DELETE FROM pool_vms WHERE name = ?", (vm_name,))])
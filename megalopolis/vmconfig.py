@@ -0,0 +1,201 @@
+"""
+VM templates from tart/vm-configs/*.yaml and images from tart/base-images.yaml.
+
+Uses PyYAML when it is installed. The VM operator image is standard
+library only, so a small parser for the subset these files use (nested
+mappings, block lists, quoted scalars and comments) is the fallback.
+"""
+
+import os
+import re
+from pathlib import Path
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Used when a template or base-images.yaml leaves a resource out
+DEFAULT_MEMORY_MB = 4096
+DEFAULT_CPU = 2
+DEFAULT_DISK_GB = 40
+
+_KEY_RE = re.compile(r"^(?P<key>[^:#][^:]*?|\"[^\"]*\"|'[^']*'):(?:\s+(?P<value>.*))?$")
+
+# "- key: value": a list item that is a mapping (kubeconfig clusters, users, ...)
+_ITEM_MAPPING_RE = re.compile(r"^-\s+[\w.\-/]+:(\s|$)")
+
+
+def _strip_comment(line):
+    """Drop a trailing # comment that is not inside quotes"""
+    quote = None
+    for i, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "#" and (i == 0 or line[i - 1].isspace()):
+            return line[:i].rstrip()
+    return line.rstrip()
+
+
+def _scalar(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1].replace("''", "'")
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return text[1:-1].encode().decode("unicode_escape")
+    if text in ("", "~", "null", "Null", "NULL"):
+        return None
+    if text in ("true", "True", "TRUE", "yes"):
+        return True
+    if text in ("false", "False", "FALSE", "no"):
+        return False
+    if text == "[]":
+        return []
+    if text == "{}":
+        return {}
+    if text.startswith("[") and text.endswith("]"):
+        return [_scalar(item) for item in text[1:-1].split(",")]
+    for number in (int, float):
+        try:
+            return number(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _parse_block(lines, i, indent):
+    """Parse the mapping or list starting at lines[i]; returns (value, next index)"""
+    if lines[i][1].startswith("-"):
+        items = []
+        while i < len(lines) and lines[i][0] == indent and lines[i][1].startswith("-"):
+            item = lines[i][1][1:].strip()
+            i += 1
+            if item:
+                items.append(_scalar(item))
+            elif i < len(lines) and lines[i][0] > indent:
+                value, i = _parse_block(lines, i, lines[i][0])
+                items.append(value)
+            else:
+                items.append(None)
+        return items, i
+
+    mapping = {}
+    while i < len(lines) and lines[i][0] == indent and not lines[i][1].startswith("-"):
+        match = _KEY_RE.match(lines[i][1])
+        if match is None:
+            raise ValueError(f"Unsupported YAML line: {lines[i][1]!r}")
+        key = match.group("key").strip("'\"")
+        value = match.group("value")
+        i += 1
+        if value is not None and value.strip():
+            mapping[key] = _scalar(value)
+        elif i < len(lines) and (lines[i][0] > indent or (lines[i][0] == indent and lines[i][1].startswith("-"))):
+            mapping[key], i = _parse_block(lines, i, lines[i][0])
+        else:
+            mapping[key] = None
+    return mapping, i
+
+
+def parse_simple_yaml(text):
+    """Parse the YAML subset used by the tart config files"""
+    lines = []
+    for raw in text.splitlines():
+        line = _strip_comment(raw)
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip(" "))
+        content = line.strip()
+        if _ITEM_MAPPING_RE.match(content):
+            # Split into an empty item and the mapping's first key, indented like its siblings
+            rest = content[1:]
+            lines.append((indent, "-"))
+            indent += 1 + len(rest) - len(rest.lstrip())
+            content = rest.strip()
+        lines.append((indent, content))
+    if not lines:
+        return {}
+    value, _ = _parse_block(lines, 0, lines[0][0])
+    return value
+
+
+def load_yaml(path):
+    text = Path(path).read_text()
+    if yaml is not None:
+        return yaml.safe_load(text) or {}
+    return parse_simple_yaml(text)
+
+
+def default_config_dir():
+    """tart/ config directory: VM_API_CONFIG_DIR, the container copy, or the repo"""
+    if os.environ.get("VM_API_CONFIG_DIR"):
+        return Path(os.environ["VM_API_CONFIG_DIR"])
+    if Path("/app/tart").is_dir():
+        return Path("/app/tart")
+    return Path(__file__).resolve().parent.parent / "tart"
+
+
+def _int(value, default):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+class VMTemplate:
+    """A VM definition from tart/vm-configs/<name>.yaml"""
+
+    __slots__ = ("name", "base_image", "image_source", "description", "memory_mb", "cpu", "disk_gb",
+                 "settings", "post_setup", "network", "warm_pool", "path")
+
+    def __init__(self, data, path=None, base_images=None):
+        base_images = base_images or {}
+        resources = data.get("resources") or {}
+        image = base_images.get(data.get("base_image")) or {}
+        self.name = data["name"]
+        self.base_image = data.get("base_image")
+        self.image_source = image.get("source")
+        self.description = data.get("description", "")
+        self.memory_mb = _int(resources.get("memory"), _int(image.get("recommended_memory"), DEFAULT_MEMORY_MB))
+        self.cpu = _int(resources.get("cpu"), DEFAULT_CPU)
+        self.disk_gb = _int(resources.get("disk"), _int(image.get("recommended_disk"), DEFAULT_DISK_GB))
+        self.settings = data.get("settings") or {}
+        self.post_setup = [c for c in (data.get("post_setup") or {}).get("commands") or [] if c]
+        self.network = data.get("network") or {}
+        self.warm_pool = data.get("warm_pool") or {}
+        self.path = str(path) if path else None
+
+    @property
+    def headless(self):
+        return not self.settings.get("vnc_enabled", False)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "base_image": self.base_image,
+            "image_source": self.image_source,
+            "description": self.description,
+            "resources": {"memory_mb": self.memory_mb, "cpu": self.cpu, "disk_gb": self.disk_gb},
+        }
+
+
+def load_base_images(config_dir=None):
+    """{image name: settings} from base-images.yaml, {} if it is missing"""
+    path = Path(config_dir or default_config_dir()) / "base-images.yaml"
+    if not path.exists():
+        return {}
+    return load_yaml(path).get("base_images") or {}
+
+
+def load_templates(config_dir=None):
+    """{template name: VMTemplate} for every vm-configs/*.yaml"""
+    config_dir = Path(config_dir or default_config_dir())
+    base_images = load_base_images(config_dir)
+    templates = {}
+    for path in sorted((config_dir / "vm-configs").glob("*.yaml")):
+        data = load_yaml(path)
+        if isinstance(data, dict) and data.get("name"):
+            templates[data["name"]] = VMTemplate(data, path, base_images)
+    return templates
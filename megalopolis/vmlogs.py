@@ -0,0 +1,337 @@
+"""
+Per-VM console and provisioning logs, held in bounded ring buffers.
+
+`tart run` output used to go to /dev/null and post_setup commands ran
+blind. Now every VM gets a ring of recent log lines and a record of how
+long each boot and provisioning step took:
+
+- `tart run` writes to a per-VM file under VM_API_LOG_DIR (default
+  ~/.megalopolis/vm-logs), truncated at every boot, and a thread tails
+  that file into the ring. A file rather than a pipe keeps the VM alive
+  when the API restarts (nothing is left to break with SIGPIPE), and the
+  restarted API picks the tail up again with attach().
+- Steps (queueing for capacity, clone, boot, SSH, each post_setup command)
+  are timed with step() or begin_step()/end_step(). Each start and finish
+  is also logged as a line, so a follower sees the timings as they happen.
+
+Memory stays bounded: VM_API_LOG_LINES lines per VM, MAX_LINE_CHARS per
+line, MAX_STEPS step records per VM and VM_API_LOG_MAX_VMS VMs, dropping
+the least recently written VM that nothing is writing to.
+"""
+
+import itertools
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+from megalopolis import metrics
+
+# Lines kept per VM
+MAX_LINES = int(os.environ.get("VM_API_LOG_LINES", "2000"))
+
+# VMs whose logs are kept
+MAX_VMS = int(os.environ.get("VM_API_LOG_MAX_VMS", "256"))
+
+# Longer lines are cut; a runaway progress bar shouldn't fill the ring on its own
+MAX_LINE_CHARS = 4096
+
+# Step records kept per VM
+MAX_STEPS = 100
+
+# Seconds between reads of a console file that has nothing new
+TAIL_INTERVAL = 0.5
+
+# Log streams
+CONSOLE = "console"  # tart run output
+POST_SETUP = "post_setup"  # post_setup command output
+STEP = "step"  # step started / finished
+
+LOG_LINES = metrics.Counter(
+    "megalopolis_vm_log_lines_total",
+    "Lines captured into per-VM log buffers",
+    ["stream"]
+)
+LOG_LINES_DROPPED = metrics.Counter(
+    "megalopolis_vm_log_lines_dropped_total",
+    "Lines evicted from full per-VM log buffers"
+)
+VM_STEP_DURATION = metrics.Histogram(
+    "megalopolis_vm_step_duration_seconds",
+    "Time taken by VM boot and provisioning steps",
+    ["step"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def default_log_dir():
+    return Path(os.path.expanduser(os.environ.get("VM_API_LOG_DIR", "~/.megalopolis/vm-logs")))
+
+
+def start_console(logs, vm_name, args, **kwargs):
+    """Popen a `tart run` command line, capturing its output into `logs` if there are any"""
+    if logs is not None:
+        proc = logs.spawn(vm_name, args, **kwargs)
+        if proc is not None:
+            return proc
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+class StepTiming:
+    """How long one step of booting or provisioning a VM took"""
+
+    __slots__ = ("vm_name", "kind", "command", "state", "error", "started_at", "started", "duration")
+
+    def __init__(self, vm_name, kind, command=None):
+        self.vm_name = vm_name
+        self.kind = kind
+        self.command = command[:200] if command else None  # the post_setup command, for per-command steps
+        self.state = "running"
+        self.error = None
+        self.started_at = utc_now()
+        self.started = time.monotonic()
+        self.duration = None
+
+    @property
+    def label(self):
+        return f"{self.kind}: {self.command.splitlines()[0]}" if self.command else self.kind
+
+    def to_dict(self):
+        duration = self.duration if self.duration is not None else time.monotonic() - self.started
+        return {
+            "step": self.kind,
+            "command": self.command,
+            "state": self.state,
+            "error": self.error,
+            "started_at": self.started_at,
+            "duration_seconds": round(duration, 3),
+        }
+
+
+class VMLog:
+    """One VM's ring of lines and step timings"""
+
+    __slots__ = ("lines", "steps", "next_seq", "dropped", "producers", "tail", "offset")
+
+    def __init__(self, max_lines):
+        self.lines = deque(maxlen=max_lines)  # (seq, epoch time, stream, text)
+        self.steps = deque(maxlen=MAX_STEPS)
+        self.next_seq = 0
+        self.dropped = 0
+        self.producers = 0  # tails and steps still running; followers wait while there are any
+        self.tail = 0  # generation of the running console tail; 0 when there is none
+        self.offset = None  # (inode, position) the console file was read up to
+
+
+class VMLogs:
+    """Bounded log buffers for every VM, with long-poll reads for followers"""
+
+    def __init__(self, log_dir=None, max_lines=MAX_LINES, max_vms=MAX_VMS):
+        self.log_dir = Path(log_dir) if log_dir is not None else default_log_dir()
+        self.max_lines = max_lines
+        self.max_vms = max_vms
+        self._cond = threading.Condition()
+        self._logs = OrderedDict()  # least recently written first
+        self._generations = itertools.count(1)
+
+    def _log(self, vm_name):
+        # Caller holds self._cond
+        log = self._logs.get(vm_name)
+        if log is None:
+            log = self._logs[vm_name] = VMLog(self.max_lines)
+            excess = len(self._logs) - self.max_vms
+            for name in [name for name, old in self._logs.items() if not old.producers][:max(excess, 0)]:
+                del self._logs[name]
+        else:
+            self._logs.move_to_end(vm_name)
+        return log
+
+    def _append(self, log, stream, text):
+        # Caller holds self._cond
+        if len(log.lines) == log.lines.maxlen:
+            log.dropped += 1
+            LOG_LINES_DROPPED.inc()
+        log.lines.append((log.next_seq, time.time(), stream, text[:MAX_LINE_CHARS]))
+        log.next_seq += 1
+        LOG_LINES.inc(stream=stream)
+
+    def append(self, vm_name, text, stream=CONSOLE):
+        with self._cond:
+            self._append(self._log(vm_name), stream, text)
+            self._cond.notify_all()
+
+    # Console capture
+
+    def console_path(self, vm_name):
+        return self.log_dir / f"{vm_name.replace('/', '_')}.log"
+
+    def spawn(self, vm_name, args, **kwargs):
+        """Popen `args` with its output going to the VM's console file; None if that can't be opened"""
+        path = self.console_path(vm_name)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            output = open(path, "wb")
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Not capturing console of {vm_name}: {e}")
+            return None
+        with output:
+            proc = subprocess.Popen(args, stdout=output, stderr=subprocess.STDOUT, **kwargs)
+        with self._cond:
+            self._append(self._log(vm_name), STEP, f"tart run started (pid {proc.pid})")
+            self._cond.notify_all()
+        # The file was just truncated: any tail of the previous boot is replaced
+        self.attach(vm_name, lambda: proc.poll() is None, restart=True)
+        return proc
+
+    def attach(self, vm_name, alive, restart=False):
+        """Tail the VM's console file while `alive()` is true, unless it is tailed already
+
+        Reading resumes where the last tail stopped if the file is the same
+        one, so a VM started by a previous API process is picked up without
+        repeating lines. With `restart` a running tail is replaced and the
+        file read from the start. Returns False if there is no console file.
+        """
+        path = self.console_path(vm_name)
+        if not path.exists():
+            return False
+        with self._cond:
+            log = self._log(vm_name)
+            if log.tail and not restart:
+                return True
+            if restart:
+                log.offset = None
+            log.tail = generation = next(self._generations)
+            log.producers += 1
+        threading.Thread(target=self._tail, args=(vm_name, log, generation, path, alive),
+                         name=f"console-{vm_name}", daemon=True).start()
+        return True
+
+    def _tail(self, vm_name, log, generation, path, alive):
+        partial = b""
+        try:
+            with open(path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                with self._cond:
+                    if log.offset is not None and log.offset[0] == inode:
+                        f.seek(log.offset[1])
+                while log.tail == generation:
+                    running = alive()
+                    chunk = f.read(65536)
+                    if chunk:
+                        *lines, partial = (partial + chunk).split(b"\n")
+                        with self._cond:
+                            if log.tail != generation:
+                                break
+                            for line in lines:
+                                self._append(log, CONSOLE, line.decode("utf-8", "replace").rstrip("\r"))
+                            log.offset = (inode, f.tell() - len(partial))
+                            self._cond.notify_all()
+                    elif not running:
+                        break
+                    else:
+                        time.sleep(TAIL_INTERVAL)
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Console tail of {vm_name} stopped: {e}")
+        with self._cond:
+            if log.tail == generation:
+                if partial:
+                    self._append(log, CONSOLE, partial.decode("utf-8", "replace").rstrip("\r"))
+                    if log.offset is not None:
+                        log.offset = (log.offset[0], log.offset[1] + len(partial))
+                log.tail = 0
+            log.producers -= 1
+            self._cond.notify_all()
+
+    # Step timing
+
+    def begin_step(self, vm_name, kind, command=None):
+        """Start timing a step; finish it with end_step()"""
+        step = StepTiming(vm_name, kind, command)
+        with self._cond:
+            log = self._log(vm_name)
+            log.steps.append(step)
+            log.producers += 1
+            self._append(log, STEP, f"{step.label} started")
+            self._cond.notify_all()
+        return step
+
+    def end_step(self, step, error=None):
+        """Finish a step begun with begin_step(); failed if `error` is given. Safe to call twice"""
+        with self._cond:
+            if step.duration is not None:
+                return
+            step.duration = time.monotonic() - step.started
+            step.state = "failed" if error else "done"
+            step.error = str(error) if error else None
+            log = self._logs.get(step.vm_name)
+            if log is not None:
+                log.producers -= 1
+                detail = f": {step.error}" if step.error else ""
+                self._append(log, STEP, f"{step.label} {step.state} in {step.duration:.1f}s{detail}")
+                self._cond.notify_all()
+        VM_STEP_DURATION.observe(step.duration, step=step.kind)
+
+    @contextmanager
+    def step(self, vm_name, kind, command=None):
+        """Time the enclosed block as a step, failed if it raises"""
+        step = self.begin_step(vm_name, kind, command)
+        try:
+            yield step
+        except BaseException as e:
+            self.end_step(step, error=e)
+            raise
+        self.end_step(step)
+
+    # Reads
+
+    def _lines_since(self, log, since):
+        return [
+            {"seq": seq, "time": datetime.fromtimestamp(at, timezone.utc).isoformat(), "stream": stream, "line": text}
+            for seq, at, stream, text in log.lines if seq >= since
+        ]
+
+    def read(self, vm_name, since=0, tail=None):
+        """Buffered lines from `since` on (only the last `tail` with it) and step timings; None if unknown"""
+        with self._cond:
+            log = self._logs.get(vm_name)
+            if log is None:
+                return None
+            lines = self._lines_since(log, since)
+            return {
+                "vm_name": vm_name,
+                "lines": lines[-tail:] if tail else lines,
+                "next_seq": log.next_seq,
+                "dropped": log.dropped,
+                "streaming": log.producers > 0,
+                "steps": [step.to_dict() for step in log.steps],
+            }
+
+    def wait(self, vm_name, since, timeout):
+        """Long-poll for lines after `since`: (lines, next_seq, streaming)
+
+        Returns as soon as there are new lines, once nothing is writing to
+        the VM's log any more, or after `timeout` seconds.
+        """
+        with self._cond:
+            def ready():
+                log = self._logs.get(vm_name)
+                return log is None or log.next_seq > since or not log.producers
+
+            self._cond.wait_for(ready, timeout)
+            log = self._logs.get(vm_name)
+            if log is None:
+                return [], since, False
+            return self._lines_since(log, since), log.next_seq, log.producers > 0
+
+
+def timed(logs, vm_name, kind, command=None):
+    """logs.step(), or a no-op context when there are no logs"""
+    return logs.step(vm_name, kind, command) if logs is not None else nullcontext()
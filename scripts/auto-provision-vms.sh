@@ -38,84 +38,30 @@ ci-worker-3:macos-ci-farm.yaml
 simulator-farm:macos-simulator-farm.yaml
 "
 
-# Resource limits for 128GB system
-MAX_TOTAL_VM_MEMORY=100000  # 100GB max for VMs (leaving 28GB for host)
-MAX_VMS=8                   # Maximum number of VMs
-MIN_HOST_MEMORY=16000       # 16GB minimum for host
+# Maximum number of VMs; memory and CPU limits are enforced by the
+# capacity scheduler with the host capacity from export_host_capacity
+MAX_VMS=8
 
-# Get current system memory usage
-get_system_memory_usage() {
-    # Get total system memory in GB
-    local total_memory_bytes
-    total_memory_bytes=$(sysctl -n hw.memsize)
-    local total_memory_gb=$((total_memory_bytes / 1024 / 1024 / 1024))
-    
-    # Calculate used memory (simplified - would need more accurate calculation in production)
-    local used_memory_gb
-    used_memory_gb=$(vm_stat | awk '
-        /Pages free/ {free = $3}
-        /Pages active/ {active = $3} 
-        /Pages inactive/ {inactive = $3}
-        /Pages speculative/ {spec = $3}
-        /Pages wired down/ {wired = $4}
-        END {
-            if (free && active && inactive && spec && wired) {
-                used_pages = active + inactive + spec + wired
-                used_gb = (used_pages * 4096) / (1024 * 1024 * 1024)
-                print int(used_gb)
-            } else {
-                print 32  # fallback estimate
-            }
-        }'
-    )
-    
-    echo "$total_memory_gb $used_memory_gb"
-}
-
-# Calculate VM memory usage
-get_vm_memory_usage() {
-    local total_vm_memory=0
-    
-    if command -v ./tart-binary >/dev/null 2>&1; then
-        # This is a simplified calculation - in production you'd query actual VM memory usage
-        local vm_count
-        vm_count=$(./tart-binary list 2>/dev/null | tail -n +2 | wc -l | tr -d ' ')
-        
-        # Estimate based on our VM configurations (average 10GB per VM)
-        total_vm_memory=$((vm_count * 10))
+# Turn on the capacity scheduler (megalopolis/scheduler.py) for the
+# provisioning run. This script runs on the Mac itself, so its memory and
+# CPUs are the host's; VM_API_HOST_* already in the environment win.
+export_host_capacity() {
+    local memsize cpus
+    memsize=$(sysctl -n hw.memsize 2>/dev/null || echo "")
+    cpus=$(sysctl -n hw.ncpu 2>/dev/null || echo "")
+    if [ -z "${VM_API_HOST_MEMORY_MB:-}" ] && [ -n "$memsize" ]; then
+        export VM_API_HOST_MEMORY_MB=$((memsize / 1024 / 1024))
     fi
-    
-    echo "$total_vm_memory"
-}
-
-# Check if we can provision a new VM
-can_provision_vm() {
-    local vm_memory="$1"  # Memory required for new VM in GB
-    
-    read -r total_memory used_memory <<< "$(get_system_memory_usage)"
-    local vm_memory_usage
-    vm_memory_usage=$(get_vm_memory_usage)
-    
-    local available_memory=$((total_memory - used_memory - vm_memory_usage))
-    local projected_usage=$((used_memory + vm_memory_usage + vm_memory))
-    
-    log_info "Memory analysis:"
-    log_info "  Total system memory: ${total_memory}GB"
-    log_info "  Currently used: ${used_memory}GB"
-    log_info "  VM memory usage: ${vm_memory_usage}GB"
-    log_info "  Available: ${available_memory}GB"
-    log_info "  Required for new VM: ${vm_memory}GB"
-    
-    # Check if we have enough memory
-    if [ "$available_memory" -ge "$((vm_memory + MIN_HOST_MEMORY))" ]; then
-        return 0
-    else
-        log_warn "Insufficient memory for VM requiring ${vm_memory}GB"
-        return 1
+    if [ -z "${VM_API_HOST_CPUS:-}" ] && [ -n "$cpus" ]; then
+        export VM_API_HOST_CPUS="$cpus"
     fi
+    export VM_API_SCHEDULER="${VM_API_SCHEDULER:-1}"
+    export VM_API_MAX_RUNNING_VMS="${VM_API_MAX_RUNNING_VMS:-$MAX_VMS}"
+    log_info "Host capacity: ${VM_API_HOST_MEMORY_MB:-detected}MB RAM, ${VM_API_HOST_CPUS:-detected} CPUs, at most ${VM_API_MAX_RUNNING_VMS} running VMs"
 }
 
-# Get VM memory requirement from config
+# Rough memory of a VM from its config, shown by --dry-run only; real
+# provisioning charges the resources in tart/vm-configs/
 get_vm_memory_requirement() {
     local config_file="$1"
     
@@ -128,50 +74,6 @@ get_vm_memory_requirement() {
     esac
 }
 
-# Provision a single VM
-provision_vm() {
-    local vm_name="$1"
-    local config_file="$2"
-    
-    log_step "Provisioning $vm_name with $config_file"
-    
-    # Check if VM already exists
-    if ./tart-binary list 2>/dev/null | grep -q "^$vm_name"; then
-        log_warn "$vm_name already exists, skipping"
-        return 0
-    fi
-    
-    # Check resource availability
-    local required_memory
-    required_memory=$(get_vm_memory_requirement "$config_file")
-    
-    if ! can_provision_vm "$required_memory"; then
-        log_error "Cannot provision $vm_name (requires ${required_memory}GB)"
-        return 1
-    fi
-    
-    # Create the VM
-    if ./scripts/setup-vms.sh create "$vm_name" "$config_file"; then
-        log_info "✅ $vm_name created successfully"
-        
-        # Wait for VM to initialize
-        log_info "⏳ Waiting for $vm_name to initialize..."
-        sleep 30
-        
-        # Start the VM
-        if ./scripts/setup-vms.sh start "$vm_name"; then
-            log_info "🟢 $vm_name is running"
-            return 0
-        else
-            log_warn "VM created but failed to start"
-            return 1
-        fi
-    else
-        log_error "❌ Failed to create $vm_name"
-        return 1
-    fi
-}
-
 # Main provisioning logic
 main() {
     log_info "🚀 Starting automated VM provisioning for high-resource system"
@@ -195,37 +97,39 @@ main() {
         exit 0
     fi
     
-    # Provision VMs in priority order
-    local provisioned=0
-    local failed=0
-    
-    echo "$VM_CONFIGS" | grep -v "^$" | while IFS=: read -r vm_name config_file; do
-        
-        echo ""
-        log_step "Processing $vm_name..."
-        
-        if provision_vm "$vm_name" "$config_file"; then
-            provisioned=$((provisioned + 1))
-        else
-            failed=$((failed + 1))
+    # New VMs only, up to the VM limit
+    local existing
+    existing=$(./tart-binary list 2>/dev/null | awk 'NR > 1 {print $2}')
+    local specs=()
+    while IFS=: read -r vm_name config_file; do
+        [ -n "$vm_name" ] || continue
+        if echo "$existing" | grep -qx "$vm_name"; then
+            log_warn "$vm_name already exists, skipping"
+            continue
         fi
-        
-        # Check if we've hit limits
-        current_vms=$((current_vms + 1))
-        if [ "$current_vms" -ge "$MAX_VMS" ]; then
-            log_warn "VM limit reached, stopping provisioning"
-            break
+        if [ "${#specs[@]}" -ge "$((MAX_VMS - current_vms))" ]; then
+            log_warn "VM limit reached ($MAX_VMS), not provisioning $vm_name"
+            continue
         fi
-        
-        # Brief pause between provisions
-        sleep 5
-    done
+        specs+=("$vm_name=${config_file%.yaml}")
+    done <<< "$VM_CONFIGS"
     
+    if [ "${#specs[@]}" -eq 0 ]; then
+        log_info "No new VMs to provision"
+        exit 0
+    fi
+    
+    # Provision the VMs as one dependency graph: the shared base image is
+    # pulled once and independent clones and boots run in parallel. Boots
+    # are admitted by the capacity scheduler against the host capacity
+    # exported here. post_setup needs key-based SSH, so it is left to
+    # `make provision` as in `make init`.
+    export_host_capacity
     echo ""
-    log_info "🎉 VM provisioning completed!"
-    log_info "Provisioned: $provisioned VMs"
-    if [ "$failed" -gt 0 ]; then
-        log_warn "Failed: $failed VMs"
+    if TART_BINARY=./tart-binary python3 -m megalopolis.provision --no-post-setup "${specs[@]}"; then
+        log_info "🎉 VM provisioning completed!"
+    else
+        log_warn "Some VMs failed to provision (see the steps above)"
     fi
     
     echo ""
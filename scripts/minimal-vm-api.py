@@ -10,315 +10,1404 @@ import json
 import os
 import sys
 import subprocess
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
 from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs, unquote, urlencode
 
-class MinimalVMAPIHandler(BaseHTTPRequestHandler):
+# Shared modules: next to this script in the container image, project root locally
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from megalopolis import metrics, responses
+from megalopolis.images import ImageCache, configured_images, default_budget_gb
+from megalopolis.inventory import VMInventory
+from megalopolis.pool import WarmPoolManager, default_pool_sizes
+from megalopolis.provision import Provisioner, parse_vm_specs, ssh_settings
+from megalopolis.readiness import ReadinessProber, READY
+from megalopolis.scheduler import (QUEUED, CapacityError, CapacityScheduler, default_capacity, scheduler_enabled,
+                                   template_resources)
+from megalopolis.statestore import StateStore, default_state_path
+from megalopolis.vmconfig import load_base_images, load_templates
+from megalopolis.vmlogs import VMLogs, start_console
+
+# How often the background thread re-runs `tart list` (seconds)
+INVENTORY_REFRESH_INTERVAL = float(os.environ.get("VM_API_REFRESH_INTERVAL", "5"))
+
+# Matches vm_management.max_concurrent_operations in k8s-manifests/vm-api-bridge.yaml
+MAX_CONCURRENT_OPERATIONS = int(os.environ.get("VM_API_MAX_CONCURRENT_OPERATIONS", "3"))
+
+# Upper bound on connections handled at once, idle keep-alive ones included;
+# extra connections get a 503
+MAX_WORKERS = int(os.environ.get("VM_API_MAX_WORKERS", "32"))
+
+# Listen address; bind to 0.0.0.0 for a federation front end on another host
+BIND_ADDRESS = os.environ.get("VM_API_BIND", "localhost")
+PORT = int(os.environ.get("VM_API_PORT", "8082"))
+
+
+def get_tart_binary():
+    """Get tart binary path (TART_BINARY override, container, or local)"""
+    if os.environ.get("TART_BINARY"):
+        return os.environ["TART_BINARY"]
+    if os.path.exists("/app/bin/tart-binary"):
+        return "/app/bin/tart-binary"
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(script_dir)
+    return os.path.join(project_root, "tart-binary")
+
+
+class OperationLimiter:
+    """Caps the number of tart operations in flight at once"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Condition()
+        self._in_flight = 0
+
+    def try_acquire(self):
+        """Claim a slot without blocking; False if the limit is reached"""
+        return self.acquire(timeout=0)
+
+    def acquire(self, timeout=None):
+        """Claim a slot, waiting up to `timeout` seconds; False on timeout"""
+        with self._lock:
+            if not self._lock.wait_for(lambda: self._in_flight < self.limit, timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._lock.notify()
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+
+operation_limiter = OperationLimiter(MAX_CONCURRENT_OPERATIONS)
+
+_inventory = None
+_inventory_lock = threading.Lock()
+_state_store = None
+_state_store_lock = threading.Lock()
+_vm_logs = None
+_vm_logs_lock = threading.Lock()
+
+# Seconds a batch member waits for an operation slot before giving up
+BATCH_SLOT_TIMEOUT = 120
+
+# Seconds a started VM has to become SSH-ready before its operation times out
+BOOT_TIMEOUT = float(os.environ.get("VM_API_BOOT_TIMEOUT", "300"))
+
+# Finished operations kept for GET /operations/{id}
+MAX_TRACKED_OPERATIONS = 1000
+
+# Upper bound for ?wait= on GET /operations/{id}
+MAX_OPERATION_WAIT = 60
+
+# Upper bound for ?limit= on GET /vms
+MAX_PAGE_SIZE = 1000
+
+# Default and upper bound for ?timeout= on GET /vms/{name}/logs?follow=1
+LOG_FOLLOW_TIMEOUT = 300
+MAX_LOG_FOLLOW_TIMEOUT = 3600
+
+# Seconds a queued start waits for host capacity before it fails
+SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get("VM_API_SCHEDULER_QUEUE_TIMEOUT", "1800"))
+
+# Pull the base images from tart/base-images.yaml in the background at startup (off by default:
+# they are tens of GB each)
+IMAGE_PREPULL = os.environ.get("VM_API_IMAGE_PREPULL", "0") == "1"
+
+
+def get_state_store():
+    """Return the state store, or None if VM_API_STATE_DB is 'off' or can't be opened"""
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = False
+            path = default_state_path()
+            if path is not None:
+                try:
+                    _state_store = StateStore(path)
+                except Exception as e:
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] State store disabled, "
+                          f"can't open {path}: {e}")
+        return _state_store or None
+
+
+def get_vm_logs():
+    """Return the per-VM console and provisioning log buffers"""
+    global _vm_logs
+    with _vm_logs_lock:
+        if _vm_logs is None:
+            _vm_logs = VMLogs()
+        return _vm_logs
+
+
+def get_inventory():
+    """Return the process-wide VM inventory, starting it on first use
+
+    With a state store the last saved snapshot is served until the first
+    `tart list` reconciles it.
+    """
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = VMInventory(get_tart_binary(), refresh_interval=INVENTORY_REFRESH_INTERVAL,
+                                     store=get_state_store())
+            _inventory.start()
+        return _inventory
+
+
+class Operation:
+    """A start or stop request tracked from submission to completion"""
+
+    # Progress order for start operations; used by ?until= long-polls
+    START_STATES = ["pending", "queued", "booting", "ip-assigned", "ssh-ready"]
+    STOP_STATES = ["pending", "stopping", "stopped"]
+    FAILED_STATES = {"failed", "timeout"}
+
+    def __init__(self, kind, vm_name):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.vm_name = vm_name
+        self.state = "pending"
+        self.done = False
+        self.error = None
+        self.ip = None
+        self.pid = None
+        self.exit_code = None
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.history = [{"state": "pending", "at": self.created_at}]
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an operation saved with to_dict()"""
+        op = cls(data["operation"], data["vm_name"])
+        op.id = data["id"]
+        op.state = data["state"]
+        op.done = data["done"]
+        op.error = data.get("error")
+        op.ip = data.get("ip")
+        op.pid = data.get("pid")
+        op.exit_code = data.get("exit_code")
+        op.created_at = data["created_at"]
+        op.history = list(data.get("history") or [])
+        return op
+
+    @property
+    def states(self):
+        return self.START_STATES if self.kind == "start" else self.STOP_STATES
+
+    def reached(self, state):
+        """True once the operation is at or past `state`, or finished"""
+        if self.done:
+            return True
+        states = self.states
+        return state in states and self.state in states and states.index(self.state) >= states.index(state)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "operation": self.kind,
+            "vm_name": self.vm_name,
+            "state": self.state,
+            "done": self.done,
+            "success": self.done and self.state not in self.FAILED_STATES,
+            "error": self.error,
+            "ip": self.ip,
+            "pid": self.pid,
+            "exit_code": self.exit_code,
+            "created_at": self.created_at,
+            "history": list(self.history)
+        }
+
+
+class OperationConflict(Exception):
+    """A VM operation refused because one already in flight covers it"""
+
+    def __init__(self, message, operation=None):
+        super().__init__(message)
+        self.operation = operation  # the conflicting operation's to_dict(), if any
+
+
+class OperationManager:
+    """Runs VM operations on supervisor threads and records their progress
+
+    Start operations launch `tart run`, keep the child process handle so it
+    is reaped when the VM shuts down, and follow the VM through the same
+    phases as vm-readiness-monitor.sh: booting -> ip-assigned -> ssh-ready.
+    Stop operations run `tart stop` off the request thread.
+
+    Every change is journaled to the state store, if there is one, so
+    restore() can bring operations back after the API restarts.
+
+    A VM has at most one start in flight: while any operation on it is
+    unfinished a start is refused, and so is a second stop.
+    """
+
+    def __init__(self, max_operations=MAX_TRACKED_OPERATIONS, boot_timeout=BOOT_TIMEOUT):
+        self.max_operations = max_operations
+        self.boot_timeout = boot_timeout
+        self._cond = threading.Condition()
+        self._operations = OrderedDict()
+        self._in_flight = {}  # VM name -> its latest unfinished operation
+        self._prober = None
+
+    @property
+    def prober(self):
+        # Created lazily so the tart path is resolved at first use
+        if self._prober is None:
+            store = get_state_store()
+            self._prober = ReadinessProber(get_tart_binary(), on_change=store.save_readiness if store else None)
+            if store is not None:
+                self._prober.restore(store.load_readiness())
+        return self._prober
+
+    def _save(self, data):
+        store = get_state_store()
+        if store is not None:
+            store.save_operation(data)
+
+    def submit(self, kind, vm_name, tart_bin, slot_held=False, reservation=None):
+        """Create an operation and start supervising it
+
+        With slot_held the caller has already claimed an operation slot;
+        otherwise the supervisor waits for one. A start may carry the
+        scheduler reservation made for it; a queued one is waited for
+        before tart runs. Raises OperationConflict if an operation in
+        flight on the VM covers this one.
+        """
+        op = Operation(kind, vm_name)
+        with self._cond:
+            existing = self._conflict_locked(kind, vm_name)
+            if existing is not None:
+                raise OperationConflict(
+                    f"VM '{vm_name}' already has a {existing.kind} operation in progress", existing.to_dict())
+            self._operations[op.id] = op
+            self._in_flight[vm_name] = op
+            pruned = self._prune()
+            data = op.to_dict()
+        self._save(data)
+        store = get_state_store()
+        if pruned and store is not None:
+            store.delete_operations(pruned)
+        if kind == "start":
+            target, args = self._supervise_start, (op, tart_bin, slot_held, reservation)
+        else:
+            target, args = self._supervise_stop, (op, tart_bin, slot_held)
+        threading.Thread(
+            target=target,
+            args=args,
+            name=f"op-{kind}-{vm_name}",
+            daemon=True
+        ).start()
+        return op
+
+    def _conflict_locked(self, kind, vm_name):
+        # Caller holds self._cond
+        existing = self._in_flight.get(vm_name)
+        if existing is not None and (kind == "start" or existing.kind == kind):
+            return existing
+        return None
+
+    def conflict(self, kind, vm_name):
+        """The unfinished operation a new `kind` operation on the VM would duplicate, or None"""
+        with self._cond:
+            existing = self._conflict_locked(kind, vm_name)
+            return existing.to_dict() if existing else None
+
+    def _prune(self):
+        # Forget the oldest finished operations beyond the retention limit
+        excess = len(self._operations) - self.max_operations
+        pruned = [i for i, o in self._operations.items() if o.done][:max(excess, 0)]
+        for op_id in pruned:
+            del self._operations[op_id]
+        return pruned
+
+    def restore(self):
+        """Load the journal from the state store and resume unfinished operations
+
+        Finished operations can be looked up again by ID. Unfinished ones
+        are reconciled against a fresh `tart list` on a background thread.
+        Returns the number of operations loaded.
+        """
+        store = get_state_store()
+        if store is None:
+            return 0
+        unfinished = []
+        with self._cond:
+            for data in store.load_operations(self.max_operations):
+                try:
+                    op = Operation.from_dict(data)
+                except (KeyError, TypeError):
+                    continue
+                self._operations[op.id] = op
+                if not op.done:
+                    self._in_flight[op.vm_name] = op
+                    unfinished.append(op)
+            count = len(self._operations)
+        if unfinished:
+            threading.Thread(target=self._resume, args=(unfinished,), name="op-resume", daemon=True).start()
+        return count
+
+    def _resume(self, ops):
+        """Pick up operations that were in flight when the API last stopped"""
+        inventory = get_inventory()
+        try:
+            inventory.refresh()
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Resuming operations on the stored inventory: {e}")
+        for op in ops:
+            vm, _ = inventory.get(op.vm_name)
+            running = vm is not None and vm.state == "running"
+            if op.kind == "stop":
+                if not running:
+                    self._transition(op, "stopped", done=True)
+                    continue
+                target, args = self._supervise_stop, (op, inventory.tart_bin, False)
+            elif running:
+                # tart run outlived the old process: follow the VM to SSH-ready
+                target, args = self._follow_boot, (op,)
+            elif op.pid is None:
+                # Still waiting for capacity or a slot when the API stopped
+                reservation = None
+                scheduler = get_scheduler()
+                if scheduler is not None:
+                    try:
+                        reservation = scheduler.request(op.vm_name)
+                    except CapacityError as e:
+                        self._transition(op, "failed", str(e), done=True)
+                        continue
+                target, args = self._supervise_start, (op, inventory.tart_bin, False, reservation)
+            else:
+                self._transition(op, "failed", "VM exited while the API was restarting", done=True)
+                continue
+            threading.Thread(target=target, args=args, name=f"op-{op.kind}-{op.vm_name}", daemon=True).start()
+
+    def get(self, op_id):
+        with self._cond:
+            op = self._operations.get(op_id)
+            return op.to_dict() if op else None
+
+    def list(self):
+        with self._cond:
+            return [op.to_dict() for op in self._operations.values()]
+
+    def count_active(self):
+        """{(operation, state): count} for operations still in progress"""
+        counts = {}
+        with self._cond:
+            for op in self._operations.values():
+                if not op.done:
+                    counts[(op.kind, op.state)] = counts.get((op.kind, op.state), 0) + 1
+        return counts
+
+    def wait(self, op_id, until=None, timeout=0):
+        """Long-poll: wait until the operation reaches `until` (default: done)"""
+        with self._cond:
+            op = self._operations.get(op_id)
+            if op is None:
+                return None
+            self._cond.wait_for(lambda: op.reached(until) if until else op.done, timeout)
+            return op.to_dict()
+
+    def _transition(self, op, state, error=None, done=False):
+        with self._cond:
+            if done and not op.done:
+                OPERATIONS_COMPLETED.inc(operation=op.kind, state=state)
+            op.state = state
+            op.error = error
+            op.done = op.done or done
+            if op.done and self._in_flight.get(op.vm_name) is op:
+                del self._in_flight[op.vm_name]
+            op.history.append({"state": state, "at": datetime.now(timezone.utc).isoformat()})
+            self._cond.notify_all()
+            data = op.to_dict()
+        self._save(data)
+        get_inventory().invalidate()
+
+    def _claim_slot(self, op, slot_held):
+        if slot_held or operation_limiter.acquire(timeout=BATCH_SLOT_TIMEOUT):
+            return True
+        self._transition(op, "failed", "Timed out waiting for an operation slot", done=True)
+        return False
+
+    def _wait_for_capacity(self, op, reservation):
+        if reservation is None or reservation.state != QUEUED:
+            return True
+        self._transition(op, "queued")
+        timing = get_vm_logs().begin_step(op.vm_name, "queue")
+        admitted = get_scheduler().wait(reservation, timeout=SCHEDULER_QUEUE_TIMEOUT)
+        get_vm_logs().end_step(timing, error=None if admitted else "no host capacity")
+        if admitted:
+            return True
+        self._transition(op, "timeout", f"No host capacity for VM after {SCHEDULER_QUEUE_TIMEOUT:g}s", done=True)
+        return False
+
+    def _release_capacity(self, reservation):
+        if reservation is not None:
+            get_scheduler().cancel(reservation)
+
+    def _supervise_start(self, op, tart_bin, slot_held, reservation=None):
+        if not self._wait_for_capacity(op, reservation):
+            return
+        if not self._claim_slot(op, slot_held):
+            self._release_capacity(reservation)
+            return
+        try:
+            # nohup keeps the VM running if the API's session goes away; its
+            # output goes to a console file the VM's log buffer tails
+            proc = start_console(get_vm_logs(), op.vm_name, ["nohup", tart_bin, "run", op.vm_name])
+            metrics.SUBPROCESS_SPAWNED.inc(command="tart run")
+        except Exception as e:
+            self._release_capacity(reservation)
+            self._transition(op, "failed", f"Failed to start VM '{op.vm_name}': {e}", done=True)
+            return
+        finally:
+            operation_limiter.release()
+
+        op.pid = proc.pid
+        self._transition(op, "booting")
+
+        # Any cached readiness predates this boot
+        self.prober.forget(op.vm_name)
+        self._follow_boot(op, proc, reservation)
+
+    def _follow_boot(self, op, proc=None, reservation=None):
+        """Follow a booting VM to SSH-ready, then reap `tart run` when it exits
+
+        A start resumed after a restart has no `tart run` process of its
+        own, so the inventory tells whether the VM is still up. Time to an
+        IP ("boot") and from there to SSH ("ssh") are logged as steps.
+        """
+        logs = get_vm_logs()
+        timing = logs.begin_step(op.vm_name, "boot" if op.ip is None else "ssh")
+        deadline = time.monotonic() + self.boot_timeout
+        try:
+            while not op.done:
+                if proc is not None and proc.poll() is not None:
+                    op.exit_code = proc.returncode
+                    self._release_capacity(reservation)
+                    self._transition(op, "failed", f"tart run exited with code {proc.returncode}", done=True)
+                    return
+                if proc is None and getattr(get_inventory().get(op.vm_name)[0], "state", None) != "running":
+                    self._transition(op, "failed", "VM is no longer running", done=True)
+                    return
+                if time.monotonic() > deadline:
+                    self._transition(op, "timeout", f"VM not SSH-ready after {self.boot_timeout}s", done=True)
+                    break
+
+                readiness = self.prober.check({op.vm_name: "running"})[op.vm_name]
+                if op.ip is None and readiness.ip is not None:
+                    op.ip = readiness.ip
+                    get_inventory().record_ip(op.vm_name, op.ip)
+                    self._transition(op, "ip-assigned")
+                    logs.end_step(timing)
+                    timing = logs.begin_step(op.vm_name, "ssh")
+                if readiness.state == READY:
+                    self._transition(op, "ssh-ready", done=True)
+                    break
+
+                # The prober backs off while the VM boots; sleep until its next check
+                time.sleep(max(0.1, min(readiness.next_check - time.monotonic(), 5.0)))
+        finally:
+            logs.end_step(timing, error=op.error if op.state in Operation.FAILED_STATES else None)
+
+        if proc is None:
+            return
+        # Reap the VM process when it exits so no zombies accumulate
+        proc.wait()
+        with self._cond:
+            op.exit_code = proc.returncode
+            data = op.to_dict()
+        self._save(data)
+        # The VM is down (stopped, crashed or never booted): free its capacity
+        self._release_capacity(reservation)
+        get_inventory().invalidate()
+
+    def _supervise_stop(self, op, tart_bin, slot_held):
+        if not self._claim_slot(op, slot_held):
+            return
+        self.prober.forget(op.vm_name)
+        try:
+            self._transition(op, "stopping")
+            stop_result = metrics.timed_run(
+                [tart_bin, "stop", op.vm_name],
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+            op.exit_code = stop_result.returncode
+            if stop_result.returncode == 0:
+                scheduler = get_scheduler()
+                if scheduler is not None:
+                    scheduler.release(op.vm_name)
+                self._transition(op, "stopped", done=True)
+            else:
+                self._transition(op, "failed", f"Failed to stop VM '{op.vm_name}': {stop_result.stderr.strip()}", done=True)
+        except subprocess.TimeoutExpired:
+            self._transition(op, "timeout", "VM stop command timed out", done=True)
+        except Exception as e:
+            self._transition(op, "failed", f"Failed to stop VM '{op.vm_name}': {e}", done=True)
+        finally:
+            operation_limiter.release()
+
+
+operations = OperationManager()
+
+_templates = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_pool_manager = None
+_pool_manager_lock = threading.Lock()
+_provisioner = None
+_provisioner_lock = threading.Lock()
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_templates():
+    """VM templates from tart/vm-configs, loaded once; {} if they can't be read"""
+    global _templates
+    if _templates is None:
+        try:
+            _templates = load_templates()
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to load VM templates: {e}")
+            _templates = {}
+    return _templates
+
+
+def get_image_cache():
+    """Return the base image cache, pre-pulling configured images on first use if enabled"""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            try:
+                images = configured_images(load_base_images())
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to load base images: {e}")
+                images = []
+            _image_cache = ImageCache(get_tart_binary(), get_inventory(), images, budget_gb=default_budget_gb())
+            if IMAGE_PREPULL:
+                _image_cache.start()
+        return _image_cache
+
+
+def get_scheduler():
+    """Return the capacity scheduler, or None if it is disabled
+
+    Admission control is off unless the host's capacity is configured
+    (see scheduler_enabled()); it is also off when host memory can't be
+    detected.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None and scheduler_enabled():
+            capacity = default_capacity()
+            if capacity["memory_mb"]:
+                inventory = get_inventory()
+                _scheduler = CapacityScheduler(
+                    resources_for=template_resources(get_templates()),
+                    observed_vms=lambda: {vm.name: vm.state for vm in inventory.snapshot()[0].query()},
+                    admit_grace=BOOT_TIMEOUT,
+                    **capacity
+                )
+        return _scheduler
+
+
+def get_pool_manager():
+    """Return the warm pool manager, loading templates and filling pools on first use"""
+    global _pool_manager
+    with _pool_manager_lock:
+        if _pool_manager is None:
+            inventory = get_inventory()
+            _pool_manager = WarmPoolManager(
+                get_tart_binary(),
+                get_templates(),
+                operations.prober,
+                sizes=default_pool_sizes(),
+                limiter=operation_limiter,
+                exists=lambda name: inventory.get(name)[0] is not None,
+                on_change=inventory.invalidate,
+                boot_timeout=BOOT_TIMEOUT,
+                slot_timeout=BATCH_SLOT_TIMEOUT,
+                scheduler=get_scheduler(),
+                images=get_image_cache(),
+                running=lambda name: getattr(inventory.get(name)[0], "state", None) == "running",
+                store=get_state_store(),
+                logs=get_vm_logs()
+            )
+            try:
+                vms, _ = inventory.list()
+                vm_states = {vm.name: vm.state for vm in vms}
+                adopted = _pool_manager.restore(vm_states)
+                if adopted:
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Re-adopted {adopted} warm pool VMs")
+                _pool_manager.cleanup_stale(vm_states)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Skipping stale pool cleanup: {e}")
+            _pool_manager.start()
+        return _pool_manager
+
+
+def get_provisioner():
+    """Return the provisioning engine shared by POST /provision requests"""
+    global _provisioner
+    with _provisioner_lock:
+        if _provisioner is None:
+            ssh_user, ssh_key = ssh_settings()
+            _provisioner = Provisioner(
+                get_tart_binary(),
+                get_templates(),
+                get_inventory(),
+                operations.prober,
+                limiter=operation_limiter,
+                scheduler=get_scheduler(),
+                images=get_image_cache(),
+                boot_timeout=BOOT_TIMEOUT,
+                slot_timeout=BATCH_SLOT_TIMEOUT,
+                queue_timeout=SCHEDULER_QUEUE_TIMEOUT,
+                ssh_user=ssh_user,
+                ssh_key=ssh_key,
+                logs=get_vm_logs()
+            )
+        return _provisioner
+
+
+OPERATIONS_COMPLETED = metrics.Counter(
+    "megalopolis_vm_operations_completed_total",
+    "Finished VM operations by final state",
+    ["operation", "state"]
+)
+metrics.Gauge(
+    "megalopolis_vm_operations_active",
+    "VM operations still in progress, by current state",
+    ["operation", "state"],
+    func=lambda: operations.count_active()
+)
+metrics.Gauge(
+    "megalopolis_tart_operations_in_flight",
+    "tart start/stop invocations currently holding an operation slot",
+    func=lambda: operation_limiter.in_flight
+)
+metrics.Gauge(
+    "megalopolis_inventory_age_seconds",
+    "Age of the cached tart inventory snapshot",
+    func=lambda: _inventory.age() if _inventory is not None else None
+)
+SERVER_BUSY_REJECTIONS = metrics.Counter(
+    "megalopolis_http_rejected_total",
+    "Connections answered 503 because all workers were busy"
+)
+
+
+def operation_accepted(op):
+    """Response body for a newly submitted operation"""
+    return {
+        "status": "success",
+        "message": f"VM '{op.vm_name}' {op.kind} command issued",
+        "vm_name": op.vm_name,
+        "operation_id": op.id,
+        "operation_url": f"/operations/{op.id}",
+        "state": op.state,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def operation_conflict(vm_name, message, existing=None):
+    """Response body for an operation refused because the VM is running or busy"""
+    response = {
+        "status": "error",
+        "message": message,
+        "vm_name": vm_name,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    if existing is not None:
+        response.update(operation_id=existing["id"], operation_url=f"/operations/{existing['id']}",
+                        state=existing["state"])
+    return response
+
+
+def duplicate_operation(kind, vm_name, vm):
+    """operation_conflict() body if a `kind` operation on the VM would duplicate one, else None
+
+    A start is refused while the VM is running or has any operation in
+    flight; a stop only while another stop is.
+    """
+    existing = operations.conflict(kind, vm_name)
+    if existing is not None:
+        return operation_conflict(
+            vm_name, f"VM '{vm_name}' already has a {existing['operation']} operation in progress", existing)
+    if kind == "start" and vm.state == "running":
+        return operation_conflict(vm_name, f"VM '{vm_name}' is already running")
+    return None
+
+
+# GET /vms bodies by inventory version and query
+vm_list_cache = responses.RepresentationCache("vm_list")
+
+
+class MinimalVMAPIHandler(responses.ResponseMixin, metrics.InstrumentedHandlerMixin, BaseHTTPRequestHandler):
     """Simple HTTP request handler for VM operations"""
     
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health':
+        url = urlsplit(self.path)
+        path = url.path
+        if path == '/health':
+            self.route = '/health'
             self.handle_health()
-        elif self.path == '/vms':
-            self.handle_vms()
-        elif self.path.startswith('/vms/'):
-            vm_name = self.path[5:]  # Remove '/vms/' prefix
+        elif path == '/metrics':
+            self.route = '/metrics'
+            self.send_metrics()
+        elif path == '/vms':
+            self.route = '/vms'
+            self.handle_vms(parse_qs(url.query))
+        elif path.startswith('/vms/') and path.endswith('/logs'):
+            self.route = '/vms/{name}/logs'
+            self.handle_vm_logs(unquote(path[5:-5]), parse_qs(url.query))
+        elif path.startswith('/vms/'):
+            self.route = '/vms/{name}'
+            vm_name = unquote(path[5:])  # Remove '/vms/' prefix
             self.handle_vm_detail(vm_name)
+        elif path == '/pools':
+            self.route = '/pools'
+            self.handle_pools()
+        elif path.startswith('/pools/'):
+            self.route = '/pools/{template}'
+            self.handle_pool_detail(unquote(path[7:]))
+        elif path == '/scheduler':
+            self.route = '/scheduler'
+            self.handle_scheduler()
+        elif path == '/images':
+            self.route = '/images'
+            self.send_json(200, get_image_cache().status())
+        elif path == '/provision':
+            self.route = '/provision'
+            self.send_json(200, get_provisioner().list())
+        elif path.startswith('/provision/'):
+            self.route = '/provision/{id}'
+            self.handle_provision_detail(path[11:])
+        elif path == '/operations':
+            self.route = '/operations'
+            self.handle_operations()
+        elif path.startswith('/operations/'):
+            self.route = '/operations/{id}'
+            self.handle_operation_detail(path[12:], parse_qs(url.query))
         else:
             self.send_error(404, "Endpoint not found")
     
     def do_POST(self):
         """Handle POST requests"""
-        if self.path.startswith('/vms/') and self.path.endswith('/start'):
-            vm_name = self.path[5:-6]  # Remove '/vms/' prefix and '/start' suffix
-            self.handle_vm_start(vm_name)
-        elif self.path.startswith('/vms/') and self.path.endswith('/stop'):
-            vm_name = self.path[5:-5]  # Remove '/vms/' prefix and '/stop' suffix
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith('/pools/') and path.endswith('/acquire'):
+            self.route = '/pools/{template}/acquire'
+            self.handle_pool_acquire(unquote(path[7:-8]), parse_qs(url.query))
+        elif path.startswith('/pools/') and path.endswith('/release'):
+            self.route = '/pools/{template}/release'
+            self.handle_pool_release(unquote(path[7:-8]))
+        elif path == '/provision':
+            self.route = '/provision'
+            self.handle_provision()
+        elif path == '/vms:batchStart':
+            self.route = '/vms:batchStart'
+            self.handle_vm_batch("start")
+        elif path == '/vms:batchStop':
+            self.route = '/vms:batchStop'
+            self.handle_vm_batch("stop")
+        elif path.startswith('/vms/') and path.endswith('/start'):
+            self.route = '/vms/{name}/start'
+            vm_name = unquote(path[5:-6])  # Remove '/vms/' prefix and '/start' suffix
+            self.handle_vm_start(vm_name, parse_qs(url.query))
+        elif path.startswith('/vms/') and path.endswith('/stop'):
+            self.route = '/vms/{name}/stop'
+            vm_name = unquote(path[5:-5])  # Remove '/vms/' prefix and '/stop' suffix
             self.handle_vm_stop(vm_name)
         else:
             self.send_error(404, "Endpoint not found")
     
+    def send_json(self, status_code, data, inventory_age=None, headers=None):
+        """Send a JSON response, optionally reporting the inventory snapshot age
+
+        `data` may also be an already serialized responses.Representation.
+        """
+        if not isinstance(data, responses.Representation):
+            data = responses.Representation.json(data)
+        headers = dict(headers or {}, **{'Access-Control-Allow-Origin': '*'})
+        if inventory_age is not None:
+            headers['X-Inventory-Age'] = f"{inventory_age:.3f}"
+        self.send_representation(status_code, data, headers)
+
     def handle_health(self):
         """Handle /health endpoint"""
+        inventory_age = get_inventory().age()
         response = {
             "status": "healthy",
             "message": "Minimal VM API is running",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "inventory_age_seconds": round(inventory_age, 3) if inventory_age is not None else None,
+            "operations_in_flight": operation_limiter.in_flight,
+            "max_concurrent_operations": operation_limiter.limit
+        }
+
+        self.send_json(200, response)
+
+    def send_operation_limit_reached(self, vm_name):
+        """Reject a VM operation because too many are already in flight"""
+        response = {
+            "status": "error",
+            "message": f"Too many VM operations in flight (limit {operation_limiter.limit}), retry later",
+            "vm_name": vm_name,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
-        
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        
-        self.wfile.write(json.dumps(response, indent=2).encode())
-    
-    def handle_vms(self):
-        """Handle /vms endpoint"""
+        self.send_json(429, response, headers={'Retry-After': '1'})
+
+    def handle_vms(self, query):
+        """Handle /vms endpoint
+
+        ?state= and ?source= filter server-side. ?limit= and ?offset= page
+        through the name-sorted list; X-Total-Count and a Link rel="next"
+        header describe the remaining pages.
+        """
+        state = query.get('state', [None])[0]
+        source = query.get('source', [None])[0]
         try:
-            # Get tart binary path (container vs local)
-            if os.path.exists("/app/bin/tart-binary"):
-                tart_bin = "/app/bin/tart-binary"
-            else:
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                project_root = os.path.dirname(script_dir)
-                tart_bin = os.path.join(project_root, "tart-binary")
-            
-            # Run tart list command
-            result = subprocess.run(
-                [tart_bin, "list"],
-                capture_output=True,
-                text=True,
-                timeout=10
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query['limit'][0]) if 'limit' in query else None
+        except ValueError:
+            self.send_error(400, "'limit' and 'offset' must be integers")
+            return
+        if offset < 0 or (limit is not None and limit < 1):
+            self.send_error(400, "'offset' must be >= 0 and 'limit' >= 1")
+            return
+
+        try:
+            index, age = get_inventory().snapshot()
+            vms = index.query(state, source)
+            total = len(vms)
+            end = total if limit is None else offset + min(limit, MAX_PAGE_SIZE)
+            headers = {'X-Total-Count': str(total)}
+            if end < total:
+                params = {k: v for k, v in (('state', state), ('source', source)) if v is not None}
+                params.update(offset=end, limit=end - offset)
+                headers['Link'] = f'</vms?{urlencode(params)}>; rel="next"'
+            # Serialized once per inventory version; unchanged polls reuse it
+            body = vm_list_cache.get(
+                (index.version, state, source, offset, end),
+                lambda: responses.Representation.json([vm.to_dict() for vm in vms[offset:end]])
             )
-            
-            vms = []
-            if result.returncode == 0 and result.stdout.strip():
-                # Parse tart list output
-                lines = result.stdout.strip().split('\n')
-                for line in lines:
-                    # Skip header line
-                    if line.startswith('Source'):
-                        continue
-                    
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        vm_source = parts[0]
-                        vm_name = parts[1] 
-                        vm_status = parts[-1]  # Last column is status
-                        
-                        vms.append({
-                            "name": vm_name,
-                            "status": vm_status,
-                            "source": vm_source
-                        })
-            
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            
-            self.wfile.write(json.dumps(vms, indent=2).encode())
-            
+            self.send_json(200, body, inventory_age=age, headers=headers)
+
         except subprocess.TimeoutExpired:
             self.send_error(504, "Tart command timed out")
         except subprocess.CalledProcessError as e:
             self.send_error(500, f"Tart command failed: {e}")
         except Exception as e:
             self.send_error(500, f"Internal server error: {e}")
-    
+
     def handle_vm_detail(self, vm_name):
         """Handle /vms/{name} endpoint"""
         try:
-            # Get tart binary path (container vs local)
-            if os.path.exists("/app/bin/tart-binary"):
-                tart_bin = "/app/bin/tart-binary"
-            else:
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                project_root = os.path.dirname(script_dir)
-                tart_bin = os.path.join(project_root, "tart-binary")
-            
-            # Run tart list command
-            result = subprocess.run(
-                [tart_bin, "list"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            vm_found = None
-            if result.returncode == 0 and result.stdout.strip():
-                # Parse tart list output to find the specific VM
-                lines = result.stdout.strip().split('\n')
-                for line in lines:
-                    # Skip header line
-                    if line.startswith('Source'):
-                        continue
-                    
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        vm_source = parts[0]
-                        current_vm_name = parts[1] 
-                        vm_status = parts[-1]  # Last column is status
-                        
-                        if current_vm_name == vm_name:
-                            vm_found = {
-                                "name": current_vm_name,
-                                "status": vm_status,
-                                "source": vm_source
-                            }
-                            break
-            
+            vm_found, age = get_inventory().get(vm_name)
+
             if vm_found:
-                # Send success response
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                
-                self.wfile.write(json.dumps(vm_found, indent=2).encode())
+                self.send_json(200, vm_found.to_dict(), inventory_age=age)
             else:
                 # VM not found
                 self.send_error(404, f"VM '{vm_name}' not found")
-            
+
         except subprocess.TimeoutExpired:
             self.send_error(504, "Tart command timed out")
         except subprocess.CalledProcessError as e:
             self.send_error(500, f"Tart command failed: {e}")
         except Exception as e:
             self.send_error(500, f"Internal server error: {e}")
-    
-    def handle_vm_start(self, vm_name):
-        """Handle POST /vms/{name}/start endpoint"""
+
+    def handle_vm_logs(self, vm_name, query):
+        """Handle GET /vms/{name}/logs[?since=SEQ&tail=N&follow=1&timeout=S] endpoint
+
+        Returns the VM's buffered console and post_setup lines and its step
+        timings. With follow=1 the lines are streamed as newline-delimited
+        JSON until nothing writes to the log any more (the VM stopped and
+        its steps finished), the client goes away or `timeout` seconds pass.
+        """
         try:
-            # Get tart binary path (container vs local)
-            if os.path.exists("/app/bin/tart-binary"):
-                tart_bin = "/app/bin/tart-binary"
-            else:
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                project_root = os.path.dirname(script_dir)
-                tart_bin = os.path.join(project_root, "tart-binary")
-            
-            # First check if VM exists
-            list_result = subprocess.run(
-                [tart_bin, "list"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            vm_exists = False
-            if list_result.returncode == 0 and list_result.stdout.strip():
-                lines = list_result.stdout.strip().split('\n')
-                for line in lines:
-                    if line.startswith('Source'):
-                        continue
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[1] == vm_name:
-                        vm_exists = True
-                        break
-            
-            if not vm_exists:
+            since = int(query.get('since', ['0'])[0])
+            tail = int(query['tail'][0]) if 'tail' in query else None
+            timeout = min(float(query.get('timeout', [LOG_FOLLOW_TIMEOUT])[0]), MAX_LOG_FOLLOW_TIMEOUT)
+        except ValueError:
+            self.send_error(400, "'since', 'tail' and 'timeout' must be numbers")
+            return
+        follow = query.get('follow', ['0'])[0] not in ('0', 'false')
+
+        logs = get_vm_logs()
+        inventory = get_inventory()
+        vm, _ = inventory.get(vm_name)
+        if vm is not None and vm.state == "running":
+            # Booted by an earlier API process: pick its console file up again
+            logs.attach(vm_name, lambda: getattr(inventory.get(vm_name)[0], "state", None) == "running")
+        data = logs.read(vm_name, since, tail)
+        if data is None:
+            if vm is None:
                 self.send_error(404, f"VM '{vm_name}' not found")
                 return
-            
-            # Start the VM in background (async) with nohup for session independence
-            try:
-                subprocess.Popen(
-                    ["nohup", tart_bin, "run", vm_name],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                response = {
-                    "status": "success",
-                    "message": f"VM '{vm_name}' start command issued",
-                    "vm_name": vm_name,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                self.send_response(202)  # Accepted
-            except Exception as e:
-                response = {
-                    "status": "error", 
-                    "message": f"Failed to start VM '{vm_name}': {str(e)}",
-                    "vm_name": vm_name,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                self.send_response(500)
-            
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response, indent=2).encode())
-            
-        except subprocess.TimeoutExpired:
-            self.send_error(504, "VM start command timed out")
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {e}")
-    
+            data = {"vm_name": vm_name, "lines": [], "next_seq": 0, "dropped": 0, "streaming": False, "steps": []}
+        if not follow:
+            self.send_json(200, data)
+            return
+
+        self.send_chunked(200, "application/x-ndjson", {'Access-Control-Allow-Origin': '*'})
+        deadline = time.monotonic() + timeout
+        lines, since, streaming = data["lines"], data["next_seq"], data["streaming"]
+        try:
+            while True:
+                self.write_chunk(b"".join(responses.encode_json(line) + b"\n" for line in lines))
+                remaining = deadline - time.monotonic()
+                if (not lines and not streaming) or remaining <= 0:
+                    break
+                lines, since, streaming = logs.wait(vm_name, since, timeout=remaining)
+            self.end_chunks()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def handle_vm_start(self, vm_name, query):
+        """Handle POST /vms/{name}/start[?priority=N&queue=0] endpoint
+
+        The capacity scheduler admits the start, queues it by priority
+        (higher first) until the host has room, or rejects it. Priority may
+        also be given in the body as {"priority": N}; queue=0 rejects
+        instead of queueing.
+        """
+        body = self.read_json_body()
+        try:
+            priority = int(query.get('priority', [body.get("priority", 0) if isinstance(body, dict) else 0])[0])
+        except (TypeError, ValueError):
+            self.send_error(400, "'priority' must be an integer")
+            return
+        queue = query.get('queue', ['1'])[0] not in ('0', 'false')
+        self.handle_vm_operation("start", vm_name, priority=priority, queue=queue)
+
     def handle_vm_stop(self, vm_name):
         """Handle POST /vms/{name}/stop endpoint"""
+        self.handle_vm_operation("stop", vm_name)
+
+    def send_capacity_error(self, vm_name, error):
+        """Reject a start the scheduler can't place: 422 if it never fits, else 503"""
+        response = {
+            "status": "error",
+            "message": str(error),
+            "vm_name": vm_name,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        if error.retryable:
+            self.send_json(503, response, headers={'Retry-After': '30'})
+        else:
+            self.send_json(422, response)
+
+    def handle_vm_operation(self, kind, vm_name, priority=0, queue=True):
+        """Submit a start/stop operation and return its ID immediately; 409 if it would duplicate one"""
+        if not operation_limiter.try_acquire():
+            self.send_operation_limit_reached(vm_name)
+            return
+
+        slot_held = True
+        submitted = False
+        reservation = None
         try:
-            # Get tart binary path (container vs local)
-            if os.path.exists("/app/bin/tart-binary"):
-                tart_bin = "/app/bin/tart-binary"
-            else:
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                project_root = os.path.dirname(script_dir)
-                tart_bin = os.path.join(project_root, "tart-binary")
-            
+            inventory = get_inventory()
+
             # First check if VM exists
-            list_result = subprocess.run(
-                [tart_bin, "list"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            vm_exists = False
-            if list_result.returncode == 0 and list_result.stdout.strip():
-                lines = list_result.stdout.strip().split('\n')
-                for line in lines:
-                    if line.startswith('Source'):
-                        continue
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[1] == vm_name:
-                        vm_exists = True
-                        break
-            
-            if not vm_exists:
+            vm, _ = inventory.get(vm_name, refresh_on_miss=True)
+            if vm is None:
                 self.send_error(404, f"VM '{vm_name}' not found")
                 return
-            
-            # Stop the VM
-            stop_result = subprocess.run(
-                [tart_bin, "stop", vm_name],
-                capture_output=True,
-                text=True,
-                timeout=30
+
+            conflict = duplicate_operation(kind, vm_name, vm)
+            if conflict is not None:
+                self.send_json(409, conflict)
+                return
+
+            scheduler = get_scheduler()
+            if kind == "start" and scheduler is not None:
+                try:
+                    reservation = scheduler.request(vm_name, priority=priority, queue=queue)
+                except CapacityError as e:
+                    self.send_capacity_error(vm_name, e)
+                    return
+                if reservation is None:
+                    # The scheduler counts the VM as running already
+                    self.send_json(409, operation_conflict(vm_name, f"VM '{vm_name}' is already running"))
+                    return
+                if reservation.state == QUEUED:
+                    # Don't hold an operation slot while waiting for capacity
+                    operation_limiter.release()
+                    slot_held = False
+
+            # The supervisor releases the slot once tart has been invoked
+            op = operations.submit(kind, vm_name, inventory.tart_bin, slot_held=slot_held, reservation=reservation)
+            submitted = True
+            self.send_json(202, operation_accepted(op), headers={'Location': f"/operations/{op.id}"})
+
+        except OperationConflict as e:
+            # Another request for the VM got in first
+            self.send_json(409, operation_conflict(vm_name, str(e), e.operation))
+        except subprocess.TimeoutExpired:
+            self.send_error(504, f"VM {kind} command timed out")
+        except Exception as e:
+            self.send_error(500, f"Internal server error: {e}")
+        finally:
+            if not submitted and slot_held:
+                operation_limiter.release()
+            if not submitted and reservation is not None:
+                get_scheduler().cancel(reservation)
+
+    def handle_scheduler(self):
+        """Handle GET /scheduler endpoint: capacity, commitments, queue and reservations"""
+        scheduler = get_scheduler()
+        if scheduler is None:
+            self.send_json(200, {"enabled": False})
+            return
+        scheduler.reconcile()
+        self.send_json(200, dict(scheduler.status(), enabled=True))
+
+    def handle_provision(self):
+        """Handle POST /provision endpoint
+
+        Body: {"vms": ["macos-dev", "ci-worker-1=macos-ci-farm"], "boot": true,
+        "post_setup": true}. Plans the pull -> clone -> set -> boot ->
+        post_setup graph, runs it in the background and returns its ID.
+        """
+        body = self.read_json_body()
+        vms = body.get("vms") if isinstance(body, dict) else None
+        if not isinstance(vms, list) or not vms or not all(isinstance(v, str) for v in vms):
+            self.send_error(400, "Body must be a JSON object with a non-empty 'vms' list")
+            return
+        try:
+            provisioner = get_provisioner()
+            run = provisioner.plan(
+                parse_vm_specs(vms),
+                boot=body.get("boot", True) is not False,
+                post_setup=body.get("post_setup", True) is not False
             )
-            
-            if stop_result.returncode == 0:
-                response = {
-                    "status": "success",
-                    "message": f"VM '{vm_name}' stop command issued",
-                    "vm_name": vm_name,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                self.send_response(200)
-            else:
-                response = {
-                    "status": "error",
-                    "message": f"Failed to stop VM '{vm_name}': {stop_result.stderr.strip()}",
-                    "vm_name": vm_name,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                self.send_response(500)
-            
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response, indent=2).encode())
-            
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except subprocess.TimeoutExpired:
+            self.send_error(504, "Tart command timed out")
+            return
+        provisioner.start(run)
+        self.send_json(202, run.to_dict(), headers={'Location': f"/provision/{run.id}"})
+
+    def handle_provision_detail(self, run_id):
+        """Handle GET /provision/{id} endpoint"""
+        run = get_provisioner().get(run_id)
+        if run is None:
+            self.send_error(404, f"Provisioning run '{run_id}' not found")
+        else:
+            self.send_json(200, run)
+
+    def handle_operations(self):
+        """Handle GET /operations endpoint"""
+        self.send_json(200, operations.list())
+
+    def handle_operation_detail(self, op_id, query):
+        """Handle GET /operations/{id}[?wait=seconds&until=state] endpoint
+
+        With `wait`, the request is held open until the operation finishes
+        (or reaches the `until` state) or the wait expires, so clients don't
+        need tight polling loops.
+        """
+        try:
+            wait = min(float(query.get('wait', ['0'])[0]), MAX_OPERATION_WAIT)
+        except ValueError:
+            self.send_error(400, "'wait' must be a number of seconds")
+            return
+        until = query.get('until', [None])[0]
+
+        op = operations.wait(op_id, until=until, timeout=max(wait, 0))
+        if op is None:
+            self.send_error(404, f"Operation '{op_id}' not found")
+        else:
+            self.send_json(200, op)
+
+    def handle_pools(self):
+        """Handle GET /pools endpoint"""
+        self.send_json(200, get_pool_manager().status())
+
+    def handle_pool_detail(self, template):
+        """Handle GET /pools/{template} endpoint"""
+        for pool in get_pool_manager().status():
+            if pool["template"] == template:
+                self.send_json(200, pool)
+                return
+        self.send_error(404, f"No warm pool for template '{template}'")
+
+    def handle_pool_acquire(self, template, query):
+        """Handle POST /pools/{template}/acquire[?wait=seconds] endpoint
+
+        Leases a booted, SSH-ready VM from the pool. With `wait`, the
+        request is held until a VM becomes ready; otherwise an empty pool
+        answers 503 right away. The optional body {"holder": "..."} is
+        recorded on the lease.
+        """
+        manager = get_pool_manager()
+        if template not in manager.pools:
+            self.send_error(404, f"No warm pool for template '{template}'")
+            return
+        try:
+            wait = min(float(query.get('wait', ['0'])[0]), MAX_OPERATION_WAIT)
+        except ValueError:
+            self.send_error(400, "'wait' must be a number of seconds")
+            return
+        body = self.read_json_body() or {}
+        holder = body.get("holder") if isinstance(body, dict) else None
+
+        lease = manager.acquire(template, holder=holder, wait=max(wait, 0))
+        if lease is None:
+            response = {
+                "status": "error",
+                "message": f"No ready VM in the '{template}' pool, retry later",
+                "template": template,
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+            self.send_json(503, response, headers={'Retry-After': '5'})
+        else:
+            self.send_json(200, dict(lease, status="success", timestamp=datetime.now(timezone.utc).isoformat()))
+
+    def handle_pool_release(self, template):
+        """Handle POST /pools/{template}/release endpoint with body {"lease_id": "..."}"""
+        manager = get_pool_manager()
+        if template not in manager.pools:
+            self.send_error(404, f"No warm pool for template '{template}'")
+            return
+        body = self.read_json_body()
+        lease_id = body.get("lease_id") if isinstance(body, dict) else None
+        if not isinstance(lease_id, str) or not lease_id:
+            self.send_error(400, "Body must be a JSON object with a 'lease_id'")
+            return
+
+        if manager.release(template, lease_id):
+            self.send_json(202, {
+                "status": "success",
+                "message": f"Lease '{lease_id}' released",
+                "template": template,
+                "on_release": manager.pools[template].on_release,
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            })
+        else:
+            self.send_error(404, f"Lease '{lease_id}' not found in pool '{template}'")
+
+    def read_json_body(self):
+        """Parse the request body as JSON; None if missing or invalid"""
+        try:
+            body = self.read_body()
+            return json.loads(body) if body else None
+        except (ValueError, json.JSONDecodeError):
+            return None
+
+    def handle_vm_batch(self, operation):
+        """Handle POST /vms:batchStart and /vms:batchStop endpoints
+
+        The body selects VMs by explicit names, a name prefix, or both:
+        {"names": ["macos-ci-farm-1", ...], "prefix": "macos-ci-farm-"}
+        All names are checked against a single inventory snapshot, then one
+        operation per VM is submitted; they run in parallel, sharing the
+        global operation limit. Starts go through the capacity scheduler
+        at the body's "priority" (default 0). A VM that is already running or
+        busy gets a per-VM 409 and is left alone.
+        """
+        body = self.read_json_body()
+        if not isinstance(body, dict):
+            self.send_error(400, "Request body must be a JSON object")
+            return
+
+        names = body.get("names", [])
+        prefix = body.get("prefix")
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            self.send_error(400, "'names' must be a list of VM names")
+            return
+        if prefix is not None and (not isinstance(prefix, str) or not prefix):
+            self.send_error(400, "'prefix' must be a non-empty string")
+            return
+        if not names and prefix is None:
+            self.send_error(400, "Specify 'names' and/or 'prefix'")
+            return
+        priority = body.get("priority", 0)
+        if not isinstance(priority, int):
+            self.send_error(400, "'priority' must be an integer")
+            return
+
+        try:
+            inventory = get_inventory()
+            index, _ = inventory.snapshot()
+
+            # Explicit names first, then prefix matches, without duplicates
+            selected = list(dict.fromkeys(names))
+            if prefix is not None:
+                explicit = set(selected)
+                selected += [name for name in index.with_prefix(prefix) if name not in explicit]
+
+            scheduler = get_scheduler() if operation == "start" else None
+            results = []
+            for vm_name in selected:
+                vm = index.get(vm_name)
+                if vm is None:
+                    results.append({
+                        "status_code": 404,
+                        "status": "error",
+                        "message": f"VM '{vm_name}' not found",
+                        "vm_name": vm_name,
+                        "timestamp": datetime.now(timezone.utc).isoformat()
+                    })
+                    continue
+                conflict = duplicate_operation(operation, vm_name, vm)
+                if conflict is not None:
+                    results.append(dict(conflict, status_code=409))
+                    continue
+                try:
+                    reservation = scheduler.request(vm_name, priority=priority) if scheduler else None
+                except CapacityError as e:
+                    results.append({
+                        "status_code": 503 if e.retryable else 422,
+                        "status": "error",
+                        "message": str(e),
+                        "vm_name": vm_name,
+                        "timestamp": datetime.now(timezone.utc).isoformat()
+                    })
+                    continue
+                if scheduler is not None and reservation is None:
+                    # The scheduler counts the VM as running already
+                    results.append(dict(operation_conflict(vm_name, f"VM '{vm_name}' is already running"),
+                                        status_code=409))
+                    continue
+                try:
+                    op = operations.submit(operation, vm_name, inventory.tart_bin, reservation=reservation)
+                except OperationConflict as e:
+                    # Another request for the VM got in first
+                    if reservation is not None:
+                        scheduler.cancel(reservation)
+                    results.append(dict(operation_conflict(vm_name, str(e), e.operation), status_code=409))
+                    continue
+                results.append(dict(operation_accepted(op), status_code=202))
+
+            failed = sum(1 for r in results if r["status_code"] >= 400)
+            response = {
+                "operation": operation,
+                "requested": len(results),
+                "accepted": len(results) - failed,
+                "failed": failed,
+                "results": results,
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+            # 207 Multi-Status: check the per-VM status codes
+            self.send_json(207 if failed else 202, response)
+
         except subprocess.TimeoutExpired:
-            self.send_error(504, "VM stop command timed out")
+            self.send_error(504, "Tart command timed out")
         except Exception as e:
             self.send_error(500, f"Internal server error: {e}")
-    
+
     def log_message(self, format, *args):
         """Custom log format"""
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {format % args}")
 
+class BoundedThreadingHTTPServer(responses.KeepAliveHTTPServer):
+    """Thread-per-connection server that answers 503 once max_workers are busy
+
+    Slow tart operations no longer block /health or other clients, and
+    overload is rejected immediately instead of queueing without limit.
+    A keep-alive connection holds its worker until it has been idle for
+    responses.KEEPALIVE_TIMEOUT seconds.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.max_workers = max_workers
+        self._workers = threading.BoundedSemaphore(max_workers)
+
+    def process_request(self, request, client_address):
+        if not self._workers.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._workers.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._workers.release()
+
+    def reject_request(self, request):
+        """Answer 503 directly on the socket without spawning a worker"""
+        SERVER_BUSY_REJECTIONS.inc()
+        body = json.dumps({
+            "status": "error",
+            "message": f"Server busy ({self.max_workers} connections open), retry later",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }).encode()
+        try:
+            request.sendall(
+                b"HTTP/1.0 503 Service Unavailable\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Retry-After: 1\r\n"
+                b"Connection: close\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+
 def main():
     """Start the minimal VM API server"""
-    port = 8082
+    port = PORT
     
     print(f"Starting Minimal VM API Server on port {port}")
     print(f"Health endpoint: http://localhost:{port}/health")
+    print(f"Metrics endpoint: http://localhost:{port}/metrics")
+    print(f"Inventory refresh interval: {INVENTORY_REFRESH_INTERVAL}s")
+    print(f"Max concurrent VM operations: {MAX_CONCURRENT_OPERATIONS}, max workers: {MAX_WORKERS}")
     print("Press Ctrl+C to stop")
+
+    # Warm the inventory (from the state store if there is one) and resume
+    # journaled operations before accepting requests, then start
+    # pre-pulling base images (if enabled) and filling warm pools
+    started = time.monotonic()
+    inventory = get_inventory()
+    restored = operations.restore()
+    store = get_state_store()
+    if store is not None:
+        age = inventory.age()
+        print(f"State store: {store.path} ({'no saved inventory' if age is None else f'inventory from {age:.0f}s ago'}, "
+              f"{restored} operations, restored in {(time.monotonic() - started) * 1000:.0f}ms)")
+    else:
+        print("State store disabled")
+    get_image_cache()
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        print(f"VM capacity: {scheduler.memory_mb}MB, {scheduler.cpus:g} CPUs, {scheduler.max_vms} VMs")
+    else:
+        print("Capacity scheduler disabled")
+    pools = get_pool_manager().pools
+    if pools:
+        print("Warm pools: " + ", ".join(f"{name}={pool.size}" for name, pool in pools.items()))
     
-    server = HTTPServer(('localhost', port), MinimalVMAPIHandler)
+    server = BoundedThreadingHTTPServer((BIND_ADDRESS, port), MinimalVMAPIHandler)
     
     try:
         server.serve_forever()
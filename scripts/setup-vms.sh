@@ -279,6 +279,16 @@ delete_vm() {
 setup_default_vms() {
     log_info "Setting up default VMs..."
     
+    # Pull, clone, configure and boot all VMs in parallel, skipping steps
+    # that are already done. post_setup needs key-based SSH into the VMs,
+    # so it is left to `make provision`
+    if command -v python3 >/dev/null 2>&1; then
+        (cd "$PROJECT_DIR" && TART_BINARY="$TART_BIN" VM_STARTUP_TIMEOUT="$VM_STARTUP_TIMEOUT" \
+            python3 -m megalopolis.provision --no-post-setup "${DEFAULT_VMS[@]}")
+        return
+    fi
+    
+    log_warn "python3 not found, setting up VMs one at a time"
     for vm_config in "${DEFAULT_VMS[@]}"; do
         local config_file="$TART_CONFIG_DIR/vm-configs/${vm_config}.yaml"
         
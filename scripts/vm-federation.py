@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+VM API Federation Server
+
+One front end for the minimal VM APIs running on several Mac hosts.
+Serves their merged inventory and routes starts and warm pool acquires to
+the least-loaded host that can take them. Operation and lease IDs come
+back prefixed with the host ("mac2:3f9c..."), so follow-up requests need
+no host parameter.
+"""
+
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote, urlencode
+
+# Shared modules: next to this script in the container image, project root locally
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from megalopolis import metrics, responses
+from megalopolis.federation import Federation, NodeError, decode_json, parse_nodes
+
+PORT = int(os.environ.get("VM_FEDERATION_PORT", "8083"))
+
+# Nodes registered at startup: "mac1=http://mac1.local:8082,mac2=http://10.0.0.5:8082"
+NODES = os.environ.get("VM_FEDERATION_NODES", "")
+
+# Upper bound for ?limit= on GET /vms, as on the nodes
+MAX_PAGE_SIZE = 1000
+
+# Upper bound for ?wait= on proxied operation and acquire requests
+MAX_WAIT = 60
+
+# Node answers that mean "try another node"
+RETRY_ELSEWHERE = (429, 503)
+
+_federation = None
+_federation_lock = threading.Lock()
+
+
+def get_federation():
+    """Return the shared federation, checking nodes once before first use"""
+    global _federation
+    with _federation_lock:
+        if _federation is None:
+            _federation = Federation(parse_nodes(NODES))
+            _federation.check_all()
+            _federation.start()
+        return _federation
+
+
+def split_id(value):
+    """('mac2', '3f9c') from 'mac2:3f9c'; (None, value) without a host prefix"""
+    host, sep, rest = value.partition(":")
+    return (host, rest) if sep else (None, value)
+
+
+def with_host(data, host):
+    """Tag a node's response with its host and prefix operation and lease IDs"""
+    if not isinstance(data, dict):
+        return data
+    data = dict(data, host=host)
+    if data.get("operation_id"):
+        data["operation_id"] = f"{host}:{data['operation_id']}"
+        data["operation_url"] = f"/operations/{data['operation_id']}"
+    if data.get("lease_id"):
+        data["lease_id"] = f"{host}:{data['lease_id']}"
+    return data
+
+
+class VMFederationHandler(responses.ResponseMixin, metrics.InstrumentedHandlerMixin, BaseHTTPRequestHandler):
+    """Merged reads and least-loaded routing across VM API nodes"""
+
+    def do_GET(self):
+        """Handle GET requests"""
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        if path == '/health':
+            self.route = '/health'
+            self.handle_health()
+        elif path == '/metrics':
+            self.route = '/metrics'
+            self.send_metrics()
+        elif path == '/nodes':
+            self.route = '/nodes'
+            self.send_json(200, [node.to_dict() for node in get_federation().nodes()])
+        elif path == '/vms':
+            self.route = '/vms'
+            self.handle_vms(query)
+        elif path.startswith('/vms/'):
+            self.route = '/vms/{name}'
+            self.handle_vm_detail(unquote(path[5:]), query)
+        elif path == '/pools':
+            self.route = '/pools'
+            self.handle_pools()
+        elif path.startswith('/operations/'):
+            self.route = '/operations/{id}'
+            self.handle_operation_detail(unquote(path[12:]), url.query)
+        else:
+            self.send_error(404, "Endpoint not found")
+
+    def do_POST(self):
+        """Handle POST requests"""
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        if path == '/nodes':
+            self.route = '/nodes'
+            self.handle_node_register()
+        elif path.startswith('/pools/') and path.endswith('/acquire'):
+            self.route = '/pools/{template}/acquire'
+            self.handle_pool_acquire(unquote(path[7:-8]), query)
+        elif path.startswith('/pools/') and path.endswith('/release'):
+            self.route = '/pools/{template}/release'
+            self.handle_pool_release(unquote(path[7:-8]))
+        elif path.startswith('/vms/') and path.endswith('/start'):
+            self.route = '/vms/{name}/start'
+            self.handle_vm_start(unquote(path[5:-6]), query)
+        elif path.startswith('/vms/') and path.endswith('/stop'):
+            self.route = '/vms/{name}/stop'
+            self.handle_vm_stop(unquote(path[5:-5]), query)
+        else:
+            self.send_error(404, "Endpoint not found")
+
+    def do_DELETE(self):
+        """Handle DELETE requests"""
+        path = urlsplit(self.path).path
+        if path.startswith('/nodes/'):
+            self.route = '/nodes/{name}'
+            name = unquote(path[7:])
+            if get_federation().remove(name):
+                self.send_json(200, {"status": "success", "message": f"Node '{name}' removed",
+                                     "timestamp": datetime.now(timezone.utc).isoformat()})
+            else:
+                self.send_error(404, f"Node '{name}' not found")
+        else:
+            self.send_error(404, "Endpoint not found")
+
+    def send_json(self, status_code, data, inventory_age=None, headers=None):
+        """Send a JSON response, optionally reporting the inventory snapshot age"""
+        headers = dict(headers or {}, **{'Access-Control-Allow-Origin': '*'})
+        if inventory_age is not None:
+            headers['X-Inventory-Age'] = f"{inventory_age:.3f}"
+        self.send_json_body(status_code, data, headers)
+
+    def read_body(self):
+        """Raw request body, forwarded to nodes as is; None if there is none"""
+        return super().read_body() or None
+
+    def send_no_node(self, message):
+        """No up node can serve the request"""
+        self.send_json(503, {
+            "status": "error",
+            "message": message,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }, headers={'Retry-After': '5'})
+
+    def forward(self, nodes, method, path, body=None, timeout=None, placement=False):
+        """Send the request to each node in turn until one doesn't answer 429/503
+
+        Relays that node's answer, tagged with its host. Returns True if
+        some node answered. A successful `placement` (start or acquire)
+        counts toward the node's load until its next health check.
+        """
+        federation = get_federation()
+        last = None
+        for node in nodes:
+            try:
+                response = node.client.request(method, path, body=body, timeout=timeout)
+            except NodeError as e:
+                federation.mark_failed(node, e)
+                continue
+            last = (node, response)
+            if response.status not in RETRY_ELSEWHERE:
+                break
+        if last is None:
+            return False
+
+        node, response = last
+        if placement and response.status < 300:
+            federation.routed(node)
+        data = decode_json(response.body)
+        headers = {'X-VM-Host': node.name}
+        if response.headers.get('Retry-After'):
+            headers['Retry-After'] = response.headers['Retry-After']
+        if data is None:
+            # Plain send_error() pages from the node
+            self.send_error(response.status, f"{node.name}: {response.body.decode(errors='replace').strip()[:200]}")
+            return True
+        data = with_host(data, node.name)
+        if isinstance(data, dict) and data.get("operation_url"):
+            headers['Location'] = data["operation_url"]
+        self.send_json(response.status, data, headers=headers)
+        return True
+
+    def handle_health(self):
+        """Handle /health endpoint"""
+        status = get_federation().status()
+        self.send_json(200, dict(
+            status,
+            status="healthy" if status["up"] else "degraded",
+            message="VM API federation is running",
+            timestamp=datetime.now(timezone.utc).isoformat()
+        ))
+
+    def handle_node_register(self):
+        """Handle POST /nodes with body {"name": "mac3", "url": "http://mac3.local:8082"}"""
+        body = decode_json(self.read_body())
+        if not isinstance(body, dict) or not isinstance(body.get("url"), str):
+            self.send_error(400, "Body must be a JSON object with 'name' and 'url'")
+            return
+        name = body.get("name") or urlsplit(body["url"]).netloc
+        try:
+            node = get_federation().add(name, body["url"].rstrip("/"))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        self.send_json(201, node.to_dict(), headers={'Location': f"/nodes/{name}"})
+
+    def handle_vms(self, query):
+        """Handle /vms endpoint: every up node's VMs with a `host` column
+
+        Takes the same ?state=, ?source=, ?limit= and ?offset= as a node,
+        plus ?host=. Pages run over the list sorted by (name, host).
+        """
+        state = query.get('state', [None])[0]
+        source = query.get('source', [None])[0]
+        host = query.get('host', [None])[0]
+        try:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query['limit'][0]) if 'limit' in query else None
+        except ValueError:
+            self.send_error(400, "'limit' and 'offset' must be integers")
+            return
+        if offset < 0 or (limit is not None and limit < 1):
+            self.send_error(400, "'offset' must be >= 0 and 'limit' >= 1")
+            return
+
+        vms, age = get_federation().inventory(state=state, source=source, host=host)
+        total = len(vms)
+        end = total if limit is None else offset + min(limit, MAX_PAGE_SIZE)
+        headers = {'X-Total-Count': str(total)}
+        if end < total:
+            params = {k: v for k, v in (('state', state), ('source', source), ('host', host)) if v is not None}
+            params.update(offset=end, limit=end - offset)
+            headers['Link'] = f'</vms?{urlencode(params)}>; rel="next"'
+        self.send_json(200, vms[offset:end], inventory_age=age, headers=headers)
+
+    def handle_vm_detail(self, vm_name, query):
+        """Handle /vms/{name}[?host=] endpoint; a VM on several hosts is returned from each"""
+        vms, age = get_federation().inventory(host=query.get('host', [None])[0])
+        found = [vm for vm in vms if vm.get("name") == vm_name]
+        if not found:
+            self.send_error(404, f"VM '{vm_name}' not found")
+        elif len(found) == 1:
+            self.send_json(200, found[0], inventory_age=age)
+        else:
+            self.send_json(200, {"name": vm_name, "hosts": found}, inventory_age=age)
+
+    def handle_pools(self):
+        """Handle /pools endpoint: every up node's pools with a `host` column"""
+        pools = [dict(pool, host=node.name) for node in get_federation().nodes(up=True) for pool in node.pools]
+        self.send_json(200, pools)
+
+    def handle_vm_start(self, vm_name, query):
+        """Handle POST /vms/{name}/start[?host=] endpoint
+
+        Goes to the least-loaded up node that has the VM; a node that
+        answers 429 or 503 (no operation slot or no capacity) is skipped
+        for the next one. Priority and queue options pass through. A VM
+        already running on a node is never placed on another one: the
+        start goes to that node, which answers 409.
+        """
+        federation = get_federation()
+        host = query.pop('host', [None])[0]
+        path = f"/vms/{vm_name}/start" + (f"?{urlencode(query, doseq=True)}" if query else "")
+        running = federation.locate(vm_name, host=host, state="running")
+        if running:
+            if not self.forward(running[:1], "POST", path, body=self.read_body()):
+                self.send_no_node(f"Node '{running[0].name}' could not be reached")
+            return
+        nodes = federation.locate(vm_name, host=host)
+        if not nodes:
+            self.send_error(404, f"VM '{vm_name}' not found on any up node")
+            return
+        if not self.forward(nodes, "POST", path, body=self.read_body(), placement=True):
+            self.send_no_node(f"No node holding '{vm_name}' could be reached")
+
+    def handle_vm_stop(self, vm_name, query):
+        """Handle POST /vms/{name}/stop[?host=] endpoint: the node running the VM"""
+        federation = get_federation()
+        host = query.get('host', [None])[0]
+        nodes = federation.locate(vm_name, host=host, state="running") or federation.locate(vm_name, host=host)
+        if not nodes:
+            self.send_error(404, f"VM '{vm_name}' not found on any up node")
+            return
+        if not self.forward(nodes[:1], "POST", f"/vms/{vm_name}/stop"):
+            self.send_no_node(f"Node '{nodes[0].name}' could not be reached")
+
+    def handle_pool_acquire(self, template, query):
+        """Handle POST /pools/{template}/acquire[?wait=&host=] endpoint
+
+        Tries nodes with ready VMs in the pool first, least loaded first,
+        then the rest; an empty pool's 503 moves on to the next node.
+        """
+        host = query.pop('host', [None])[0]
+        nodes = get_federation().pool_candidates(template, host=host)
+        if not nodes:
+            self.send_error(404, f"No warm pool for template '{template}' on any up node")
+            return
+        try:
+            wait = min(float(query.get('wait', ['0'])[0]), MAX_WAIT)
+        except ValueError:
+            self.send_error(400, "'wait' must be a number of seconds")
+            return
+        path = f"/pools/{template}/acquire" + (f"?{urlencode(query, doseq=True)}" if query else "")
+        timeout = get_federation().timeout + max(wait, 0)
+        if not self.forward(nodes, "POST", path, body=self.read_body(), timeout=timeout, placement=True):
+            self.send_no_node(f"No node with a '{template}' pool could be reached")
+
+    def handle_pool_release(self, template):
+        """Handle POST /pools/{template}/release with the host-prefixed lease_id from acquire"""
+        body = decode_json(self.read_body())
+        lease_id = body.get("lease_id") if isinstance(body, dict) else None
+        if not isinstance(lease_id, str) or not lease_id:
+            self.send_error(400, "Body must be a JSON object with a 'lease_id'")
+            return
+        host, node_lease_id = split_id(lease_id)
+        node = get_federation().get(host) if host else None
+        if node is None:
+            self.send_error(404, f"Lease '{lease_id}' does not name a known node")
+            return
+        body = json.dumps(dict(body, lease_id=node_lease_id)).encode()
+        if not self.forward([node], "POST", f"/pools/{template}/release", body=body):
+            self.send_no_node(f"Node '{host}' could not be reached")
+
+    def handle_operation_detail(self, op_id, raw_query):
+        """Handle GET /operations/{host}:{id}[?wait=&until=] by asking that host"""
+        host, node_op_id = split_id(op_id)
+        node = get_federation().get(host) if host else None
+        if node is None:
+            self.send_error(404, f"Operation '{op_id}' not found")
+            return
+        try:
+            wait = min(float(parse_qs(raw_query).get('wait', ['0'])[0]), MAX_WAIT)
+        except ValueError:
+            self.send_error(400, "'wait' must be a number of seconds")
+            return
+        path = f"/operations/{node_op_id}" + (f"?{raw_query}" if raw_query else "")
+        if not self.forward([node], "GET", path, timeout=get_federation().timeout + max(wait, 0)):
+            self.send_no_node(f"Node '{host}' could not be reached")
+
+    def log_message(self, format, *args):
+        """Custom log format"""
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {format % args}")
+
+
+def main():
+    """Start the federation server"""
+    print(f"Starting VM API Federation Server on port {PORT}")
+    federation = get_federation()
+    for node in federation.nodes():
+        print(f"Node {node.name}: {node.client.url} ({'up' if node.up else 'down'})")
+    if not federation.nodes():
+        print("No nodes yet: set VM_FEDERATION_NODES or POST /nodes")
+    print("Press Ctrl+C to stop")
+
+    server = responses.KeepAliveHTTPServer((os.environ.get("VM_FEDERATION_BIND", "localhost"), PORT), VMFederationHandler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Load/benchmark harness for the VM API and the status dashboard.
+
+Runs MinimalVMAPIHandler and MegalopolisStatusHandler in-process against
+fake tart/kubectl/kind/docker binaries (see fake_tools.py), drives them
+with concurrent HTTP clients and reports p50/p95/p99 latency, requests
+per second and subprocesses spawned per request. Works on any Linux or
+macOS box; no tart, Docker or cluster needed.
+
+Each VM count gets its own server process so module-level state
+(inventory, collector, metrics) starts clean; subprocess counts are
+scraped from the API's /metrics endpoint.
+
+Usage:
+    python3 tests/benchmark/bench.py                       # 2, 50 and 500 VMs
+    python3 tests/benchmark/bench.py --vms 50 --latency 0.05 --failure-rate 0.1
+    python3 tests/benchmark/bench.py --save linux-ci       # write baselines/linux-ci.json
+    python3 tests/benchmark/bench.py --compare linux-ci    # replay it, exit 1 on regression
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+from fake_tools import fake_environment, vm_names, write_fake_tools
+
+BENCH_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCH_DIR.parent.parent
+BASELINE_DIR = BENCH_DIR / "baselines"
+
+# name -> (server, method, path); {vm} is replaced by a random generated VM
+SCENARIOS = {
+    "api-health": ("api", "GET", "/health"),
+    "api-list": ("api", "GET", "/vms"),
+    "api-detail": ("api", "GET", "/vms/{vm}"),
+    "api-stop": ("api", "POST", "/vms/{vm}/stop"),
+    "dashboard-status": ("dashboard", "GET", "/api/status"),
+    "dashboard-index": ("dashboard", "GET", "/"),
+}
+
+DEFAULT_CONFIG = {
+    "vms": [2, 50, 500],
+    "scenarios": list(SCENARIOS),
+    "requests": 400,
+    "clients": 8,
+    "latency": 0.01,
+    "failure_rate": 0.0,
+    "refresh_interval": 5.0,
+    "status_interval": 10.0,
+    "kube_watch": False,
+    "seed": 1,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def scrape(port):
+    """Return ({command: subprocesses spawned}, VM operations still active) from /metrics"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", "/metrics")
+        text = conn.getresponse().read().decode()
+    finally:
+        conn.close()
+    spawned, active = {}, 0
+    for line in text.splitlines():
+        if line.startswith("megalopolis_subprocess_spawned_total{"):
+            labels, value = line.rsplit(" ", 1)
+            spawned[labels.split('command="', 1)[1].rstrip('"}')] = float(value)
+        elif line.startswith("megalopolis_vm_operations_active{"):
+            active += float(line.rsplit(" ", 1)[1])
+    return spawned, active
+
+
+def wait_for_operations(port, timeout=30):
+    """Scrape until no VM operation is in progress; returns the final spawn counts"""
+    deadline = time.monotonic() + timeout
+    spawned, active = scrape(port)
+    while active and time.monotonic() < deadline:
+        time.sleep(0.05)
+        spawned, active = scrape(port)
+    return spawned
+
+
+def request(port, method, path):
+    """One request on a fresh connection; returns the status code, 0 on error"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        headers = {"Content-Length": "0"} if method == "POST" else {}
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException):
+        return 0
+    finally:
+        conn.close()
+
+
+def drive(port, method, path_template, total, clients, names, seed):
+    """Send `total` requests from `clients` threads; returns (latencies, statuses, seconds)"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        local_latencies = []
+        local_statuses = {}
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            path = path_template.replace("{vm}", rng.choice(names))
+            started = time.perf_counter()
+            status = request(port, method, path)
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def load_servers(tools_dir, config):
+    """Import both servers against the fake tools and start them on free ports"""
+    os.environ.update(fake_environment(tools_dir))
+    os.environ["VM_API_REFRESH_INTERVAL"] = str(config["refresh_interval"])
+    os.environ["DASHBOARD_STATUS_INTERVAL"] = str(config["status_interval"])
+
+    spec = importlib.util.spec_from_file_location("minimal_vm_api", PROJECT_ROOT / "scripts" / "minimal-vm-api.py")
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+
+    sys.path.insert(0, str(PROJECT_ROOT / "dashboard"))
+    import server as dashboard
+    from status_collector import StatusCollector
+
+    class QuietAPIHandler(api.MinimalVMAPIHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class QuietDashboardHandler(dashboard.MegalopolisStatusHandler):
+        def log_message(self, format, *args):
+            pass
+
+    kube = None
+    if config.get("kube_watch"):
+        # Namespaces and pods from a watch on the fake API server instead of the fake kubectl
+        from fake_kube_api import FakeKubeAPI
+        from megalopolis.kubewatch import KubeWatcher
+        kube = KubeWatcher({"server": FakeKubeAPI().start()})
+    dashboard._collector = StatusCollector(tools_dir, interval=config["status_interval"], kube=kube)
+    dashboard._collector.start()
+    api.get_inventory()
+    dashboard._collector.snapshot(timeout=30)
+
+    servers = {
+        "api": api.BoundedThreadingHTTPServer(("127.0.0.1", 0), QuietAPIHandler),
+        "dashboard": ThreadingHTTPServer(("127.0.0.1", 0), QuietDashboardHandler),
+    }
+    for httpd in servers.values():
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return servers
+
+
+def serve_worker(config):
+    """Serve both servers for one VM count until stdin closes (runs in a child process)"""
+    vm_count = config["vm_count"]
+    tools_dir = write_fake_tools(
+        Path(config["work_dir"]) / f"vms-{vm_count}",
+        vm_count=vm_count,
+        latency=config["latency"],
+        failure_rate=config["failure_rate"]
+    )
+    servers = load_servers(tools_dir, config)
+    ports = {name: httpd.server_address[1] for name, httpd in servers.items()}
+    Path(config["ready_path"]).write_text(json.dumps(ports))
+    sys.stdin.read()
+    for httpd in servers.values():
+        httpd.shutdown()
+
+
+def run_scenarios(ports, config):
+    """Drive every scenario against a running worker; returns {scenario: result}"""
+    names = vm_names(config["vm_count"])
+    results = {}
+    for scenario in config["scenarios"]:
+        server_name, method, path = SCENARIOS[scenario]
+        port = ports[server_name]
+
+        # Warm caches before measuring
+        drive(port, method, path, min(20, config["requests"]), config["clients"], names, config["seed"] + 1)
+        spawned_before = wait_for_operations(ports["api"])
+
+        latencies, statuses, elapsed = drive(
+            port, method, path, config["requests"], config["clients"], names, config["seed"]
+        )
+        # Operations finish in the background; count their subprocesses too
+        spawned_after = wait_for_operations(ports["api"])
+
+        spawned = {
+            command: int(count - spawned_before.get(command, 0))
+            for command, count in spawned_after.items()
+            if count - spawned_before.get(command, 0)
+        }
+        latencies.sort()
+        errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+        results[scenario] = {
+            "requests": len(latencies),
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "error_rate": round(errors / len(latencies), 4),
+            "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+            "subprocesses_per_request": round(sum(spawned.values()) / len(latencies), 4),
+            "subprocesses": spawned,
+        }
+    return results
+
+
+def run_benchmark(config):
+    """Benchmark each configured VM count against its own server process
+
+    Returns {"<vms>/<scenario>": result}. Clients run in this process so
+    they don't compete with the servers for the GIL.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="megalopolis-bench-") as work_dir:
+        for vm_count in config["vms"]:
+            ready_path = Path(work_dir) / f"ready-{vm_count}.json"
+            worker_config = dict(config, vm_count=vm_count, work_dir=work_dir, ready_path=str(ready_path))
+            print(f"Benchmarking {vm_count} VMs...", file=sys.stderr)
+            worker = subprocess.Popen(
+                [sys.executable, __file__, "--worker", json.dumps(worker_config)],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL
+            )
+            try:
+                deadline = time.monotonic() + 60
+                while not ready_path.exists():
+                    if worker.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f"benchmark server for {vm_count} VMs did not start")
+                    time.sleep(0.05)
+                ports = json.loads(ready_path.read_text())
+                for scenario, result in run_scenarios(ports, worker_config).items():
+                    results[f"{vm_count}/{scenario}"] = result
+            finally:
+                worker.stdin.close()
+                try:
+                    worker.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+                    worker.wait()
+    return results
+
+
+def print_results(results):
+    print(f"{'VMs/scenario':<26} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'subproc/req':>12}")
+    for key, r in results.items():
+        print(f"{key:<26} {r['requests_per_second']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['error_rate']:>7.1%} {r['subprocesses_per_request']:>12}")
+
+
+def compare(baseline, results, tolerance):
+    """Print regressions against a baseline; returns the number found"""
+    regressions = 0
+    for key, base in baseline["results"].items():
+        current = results.get(key)
+        if current is None:
+            continue
+        problems = []
+        # Ignore sub-millisecond jitter on very fast endpoints
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance) and current["p95_ms"] - base["p95_ms"] > 1.0:
+            problems.append(f"p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if current["requests_per_second"] < base["requests_per_second"] * (1 - tolerance):
+            problems.append(f"req/s {base['requests_per_second']} -> {current['requests_per_second']}")
+        if current["subprocesses_per_request"] > base["subprocesses_per_request"] * (1 + tolerance) + 0.05:
+            problems.append(
+                f"subproc/req {base['subprocesses_per_request']} -> {current['subprocesses_per_request']}"
+            )
+        if current["error_rate"] > base["error_rate"] + tolerance * max(base["error_rate"], 0.01):
+            problems.append(f"errors {base['error_rate']:.1%} -> {current['error_rate']:.1%}")
+        if problems:
+            regressions += 1
+            print(f"REGRESSION {key}: " + "; ".join(problems))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the VM API and dashboard against fake tools")
+    parser.add_argument("--vms", default=",".join(map(str, DEFAULT_CONFIG["vms"])),
+                        help="comma-separated VM counts (default: %(default)s)")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_CONFIG["scenarios"]),
+                        help="comma-separated scenarios (default: all)")
+    parser.add_argument("--requests", type=int, default=DEFAULT_CONFIG["requests"],
+                        help="requests per scenario (default: %(default)s)")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CONFIG["clients"],
+                        help="concurrent clients (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG["latency"],
+                        help="seconds each fake tool call takes (default: %(default)s)")
+    parser.add_argument("--failure-rate", type=float, default=DEFAULT_CONFIG["failure_rate"],
+                        help="fraction of fake tool calls that fail (default: %(default)s)")
+    parser.add_argument("--refresh-interval", type=float, default=DEFAULT_CONFIG["refresh_interval"],
+                        help="VM_API_REFRESH_INTERVAL for the API (default: %(default)s)")
+    parser.add_argument("--status-interval", type=float, default=DEFAULT_CONFIG["status_interval"],
+                        help="DASHBOARD_STATUS_INTERVAL for the dashboard (default: %(default)s)")
+    parser.add_argument("--kube-watch", action="store_true",
+                        help="dashboard watches a fake Kubernetes API instead of running kubectl")
+    parser.add_argument("--seed", type=int, default=DEFAULT_CONFIG["seed"],
+                        help="seed for VM selection (default: %(default)s)")
+    parser.add_argument("--save", metavar="NAME", help="save results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME",
+                        help="replay baselines/NAME.json's configuration and report regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before a regression is reported (default: %(default)s)")
+    parser.add_argument("--json", metavar="PATH", help="also write results to PATH")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.worker:
+        serve_worker(json.loads(args.worker))
+        return 0
+
+    baseline = None
+    if args.compare:
+        baseline_path = BASELINE_DIR / f"{args.compare}.json"
+        if not baseline_path.exists():
+            print(f"No baseline at {baseline_path}", file=sys.stderr)
+            return 2
+        baseline = json.loads(baseline_path.read_text())
+        config = baseline["config"]
+    else:
+        scenarios = [s for s in args.scenarios.split(",") if s]
+        unknown = [s for s in scenarios if s not in SCENARIOS]
+        if unknown:
+            print(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})", file=sys.stderr)
+            return 2
+        config = {
+            "vms": [int(v) for v in args.vms.split(",") if v],
+            "scenarios": scenarios,
+            "requests": args.requests,
+            "clients": args.clients,
+            "latency": args.latency,
+            "failure_rate": args.failure_rate,
+            "refresh_interval": args.refresh_interval,
+            "status_interval": args.status_interval,
+            "kube_watch": args.kube_watch,
+            "seed": args.seed,
+        }
+
+    results = run_benchmark(config)
+    print_results(results)
+
+    document = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": config,
+        "results": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(document, indent=2) + "\n")
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save}.json"
+        path.write_text(json.dumps(document, indent=2) + "\n")
+        print(f"Saved baseline to {path}")
+
+    if baseline is not None:
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"{regressions} regression(s) against baseline '{args.compare}'")
+            return 1
+        print(f"No regressions against baseline '{args.compare}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
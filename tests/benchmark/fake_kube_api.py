@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Fake Kubernetes API server for the dashboard's watch-based status source.
+
+Serves list and watch for /api/v1/namespaces and /api/v1/pods the way the
+real API server does: lists carry a resourceVersion, watches stream one
+JSON event per line (chunked) from that version, and a watch from a
+version older than the retained history gets a 410 ERROR event. Pods and
+namespaces can be added, changed and deleted while clients are watching.
+
+Usage:
+    python3 tests/benchmark/fake_kube_api.py --port 8001 --churn 2
+    DASHBOARD_KUBE_API=http://127.0.0.1:8001 python3 dashboard/server.py
+"""
+
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fake_tools import NAMESPACES
+
+# Namespaces that get pods, matching the ones the fake kubectl reports pods for
+POD_NAMESPACES = ["kube-system", "argocd", "orchard-system"]
+
+
+def namespace_object(name, version, phase="Active"):
+    return {
+        "kind": "Namespace",
+        "metadata": {"name": name, "resourceVersion": str(version)},
+        "status": {"phase": phase},
+    }
+
+
+def pod_object(namespace, name, version, phase="Running", ready=True):
+    return {
+        "kind": "Pod",
+        "metadata": {"namespace": namespace, "name": name, "resourceVersion": str(version)},
+        "status": {
+            "phase": phase,
+            "conditions": [{"type": "Ready", "status": "True" if ready else "False"}],
+        },
+    }
+
+
+class FakeKubeAPI:
+    """In-memory namespaces and pods with a bounded event history per resource"""
+
+    def __init__(self, namespaces=NAMESPACES, pods_per_namespace=2, history=1000):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._objects = {"namespaces": {}, "pods": {}}
+        self._events = {"namespaces": [], "pods": []}
+        self._oldest = {"namespaces": 0, "pods": 0}
+        self.history = history
+        self.requests = 0
+        self.connections = 0
+        self._sockets = set()
+        self._httpd = None
+        for namespace in namespaces:
+            self.add_namespace(namespace)
+            if namespace in POD_NAMESPACES:
+                for i in range(pods_per_namespace):
+                    self.set_pod(namespace, f"pod-{i}")
+
+    # Changes
+
+    def _record(self, resource, key, event_type, obj):
+        with self._cond:
+            if event_type == "DELETED":
+                self._objects[resource].pop(key, None)
+            else:
+                self._objects[resource][key] = obj
+            events = self._events[resource]
+            events.append((self._version, event_type, obj))
+            if len(events) > self.history:
+                dropped = events.pop(0)
+                self._oldest[resource] = dropped[0]
+            self._cond.notify_all()
+
+    def add_namespace(self, name, phase="Active"):
+        with self._cond:
+            self._version += 1
+            self._record("namespaces", name, "ADDED", namespace_object(name, self._version, phase))
+
+    def delete_namespace(self, name):
+        with self._cond:
+            for key in [k for k in self._objects["pods"] if k[0] == name]:
+                self.delete_pod(*key)
+            self._version += 1
+            self._record("namespaces", name, "DELETED", namespace_object(name, self._version, "Terminating"))
+
+    def set_pod(self, namespace, name, phase="Running", ready=True):
+        with self._cond:
+            self._version += 1
+            event_type = "MODIFIED" if (namespace, name) in self._objects["pods"] else "ADDED"
+            self._record("pods", (namespace, name), event_type,
+                         pod_object(namespace, name, self._version, phase, ready))
+
+    def delete_pod(self, namespace, name):
+        with self._cond:
+            self._version += 1
+            obj = self._objects["pods"].get((namespace, name)) or pod_object(namespace, name, self._version)
+            obj = dict(obj, metadata=dict(obj["metadata"], resourceVersion=str(self._version)))
+            self._record("pods", (namespace, name), "DELETED", obj)
+
+    def expire(self):
+        """Forget all event history so every open or new watch gets 410 Gone"""
+        with self._cond:
+            self._version += 1
+            for resource in self._events:
+                self._events[resource] = []
+                self._oldest[resource] = self._version
+            self._cond.notify_all()
+
+    def churn(self):
+        """Flip a random pod between Running/ready and Pending/not ready"""
+        with self._cond:
+            namespace, name = random.choice(list(self._objects["pods"]))
+            running = self._objects["pods"][(namespace, name)]["status"]["phase"] == "Running"
+        self.set_pod(namespace, name, "Pending" if running else "Running", ready=not running)
+
+    # Reads
+
+    def list(self, resource):
+        with self._cond:
+            return {
+                "kind": "List",
+                "metadata": {"resourceVersion": str(self._version)},
+                "items": list(self._objects[resource].values()),
+            }
+
+    def events_after(self, resource, version, timeout):
+        """Events newer than `version`, waiting up to `timeout`; None if `version` has expired"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if version < self._oldest[resource]:
+                    return None
+                events = [e for e in self._events[resource] if e[0] > version]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    # Server
+
+    def start(self, port=0):
+        """Serve on 127.0.0.1:`port` in a background thread; returns the base URL"""
+        api = self
+
+        class Handler(FakeKubeAPIHandler):
+            fake = api
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            # Like a crashed API server: drop open watches too
+            for sock in list(self._sockets):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class FakeKubeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def setup(self):
+        super().setup()
+        self.fake.connections += 1
+        self.fake._sockets.add(self.connection)
+
+    def finish(self):
+        self.fake._sockets.discard(self.connection)
+        super().finish()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        resource = url.path.rsplit("/", 1)[-1]
+        self.fake.requests += 1
+        if url.path not in ("/api/v1/namespaces", "/api/v1/pods"):
+            self.send_json(404, {"kind": "Status", "code": 404, "message": f"{url.path} not found"})
+            return
+        if query.get("watch", ["0"])[0] in ("1", "true"):
+            self.watch(resource, int(query.get("resourceVersion", ["0"])[0] or 0),
+                       float(query.get("timeoutSeconds", ["300"])[0]))
+        else:
+            self.send_json(200, self.fake.list(resource))
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        line = json.dumps(data).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def watch(self, resource, version, timeout):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                events = self.fake.events_after(resource, version, min(1.0, deadline - time.monotonic()))
+                if events is None:
+                    self.send_chunk({"type": "ERROR", "object": {
+                        "kind": "Status", "code": 410, "reason": "Expired",
+                        "message": f"too old resource version: {version}",
+                    }})
+                    break
+                for event_version, event_type, obj in events:
+                    self.send_chunk({"type": event_type, "object": obj})
+                    version = event_version
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Kubernetes API server (namespaces and pods)")
+    parser.add_argument("--port", type=int, default=8001, help="port on 127.0.0.1 (default: %(default)s)")
+    parser.add_argument("--pods", type=int, default=2, help="pods per namespace that has pods (default: %(default)s)")
+    parser.add_argument("--churn", type=float, default=0,
+                        help="seconds between random pod status flips; 0 for none (default: %(default)s)")
+    args = parser.parse_args()
+
+    fake = FakeKubeAPI(pods_per_namespace=args.pods)
+    print(f"Fake Kubernetes API on {fake.start(args.port)}")
+    try:
+        while True:
+            time.sleep(args.churn or 3600)
+            if args.churn:
+                fake.churn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Fake tart-binary, kubectl, kind-binary and docker for benchmarks.
+
+Each tool is a small bash script with the scenario baked in: every call
+sleeps for the configured latency and fails with the configured
+probability, then prints output shaped like the real tool. `tart list`
+reports `vm_count` VMs (vm-0000, vm-0001, ...), alternating running and
+stopped, followed by the VMs the dashboard tracks.
+"""
+
+import json
+import os
+import stat
+from pathlib import Path
+
+TRACKED_VMS = ["macos-dev", "macos-ci"]
+
+NAMESPACES = [
+    "default", "kube-system", "argocd", "orchard-system", "cert-manager",
+    "ingress-nginx", "external-secrets", "monitoring", "keycloak",
+]
+
+PREAMBLE = """#!/usr/bin/env bash
+sleep {latency}
+if (( RANDOM % 10000 < {failure_permyriad} )); then
+    echo "fake failure" >&2
+    exit 1
+fi
+"""
+
+TART = """
+case "$1" in
+    list) if [ "$2 $3" = "--format json" ]; then cat "{data_dir}/tart-list.json"; else cat "{data_dir}/tart-list.txt"; fi ;;
+    ip) echo 127.0.0.1 ;;
+    run) exec -a "fake-tart-run-${{@: -1}}" sleep 3600 ;;
+    stop) pkill -f "^fake-tart-run-$2 " >/dev/null 2>&1; exit 0 ;;
+    clone|set|delete|pull) exit 0 ;;
+    *) echo "fake tart: unsupported command $1" >&2; exit 2 ;;
+esac
+"""
+
+KUBECTL = """
+case "$1 $2" in
+    "get namespaces") cat "{data_dir}/namespaces.txt" ;;
+    "get pods") printf 'server-0   1/1   Running   0   1h\\nrepo-0   1/1   Running   0   1h\\n' ;;
+    version*) echo "Client Version: v1.30.0-fake" ;;
+    *) exit 0 ;;
+esac
+"""
+
+KIND = """
+echo homelab
+"""
+
+DOCKER = """
+case "$1" in
+    network) printf 'NETWORK ID     NAME      DRIVER    SCOPE\\nabc123   kind      bridge    local\\n' ;;
+    *) echo "Server Version: fake" ;;
+esac
+"""
+
+
+def vm_names(vm_count):
+    """Names of the generated (untracked) VMs"""
+    return [f"vm-{i:04d}" for i in range(vm_count)]
+
+
+def fake_vms(vm_count):
+    """(name, disk, size, state) for vm_count generated VMs plus the tracked ones"""
+    vms = [(name, 50, 20, "running" if i % 2 == 0 else "stopped") for i, name in enumerate(vm_names(vm_count))]
+    return vms + [(name, 80, 30, "running") for name in TRACKED_VMS]
+
+
+def tart_list_output(vm_count):
+    """`tart list` text table"""
+    lines = ["Source Name                Disk Size State"]
+    for name, disk, size, state in fake_vms(vm_count):
+        lines.append(f"local  {name:<19} {disk:<4} {size:<4} {state}")
+    return "\n".join(lines) + "\n"
+
+
+def tart_list_json(vm_count):
+    """`tart list --format json` output"""
+    return json.dumps([
+        {"Source": "local", "Name": name, "Disk": disk, "Size": size, "State": state, "Running": state == "running"}
+        for name, disk, size, state in fake_vms(vm_count)
+    ])
+
+
+def _write_script(path, body):
+    path.write_text(body)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def write_fake_tools(directory, vm_count=10, latency=0.0, failure_rate=0.0):
+    """Create the fake tools in `directory` and return its Path
+
+    The directory doubles as the dashboard's project root (kubectl,
+    tart-binary and kind-binary are looked up there) and as a PATH entry
+    for docker.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "tart-list.txt").write_text(tart_list_output(vm_count))
+    (directory / "tart-list.json").write_text(tart_list_json(vm_count))
+    (directory / "namespaces.txt").write_text("".join(f"namespace/{ns}\n" for ns in NAMESPACES))
+
+    preamble = PREAMBLE.format(latency=f"{latency:.4f}", failure_permyriad=int(failure_rate * 10000))
+    for name, body in (("tart-binary", TART), ("kubectl", KUBECTL), ("kind-binary", KIND), ("docker", DOCKER)):
+        _write_script(directory / name, preamble + body.format(data_dir=directory))
+    return directory
+
+
+def fake_environment(directory):
+    """Environment variables that point the servers at the fake tools"""
+    env = dict(os.environ)
+    env["TART_BINARY"] = str(Path(directory) / "tart-binary")
+    # Keep the fake VMs out of the real VM API state store and console logs
+    env["VM_API_STATE_DB"] = str(Path(directory) / "vm-api-state.db")
+    env["VM_API_LOG_DIR"] = str(Path(directory) / "vm-logs")
+    env["PATH"] = f"{directory}{os.pathsep}{env.get('PATH', '')}"
+    return env
@@ -279,16 +279,22 @@ for vm in data:
         ((FAILED_TESTS++))
     fi
     
-    # Test 2: Start endpoint returns JSON response
+    # Test 2: Starting the VM again while its start is in flight returns 409
+    # with the operation in progress, as JSON
     local start_response
-    start_response=$(curl -s -X POST "${API_URL}/vms/$stopped_vm/start" || echo "")
+    start_response=$(curl -s -w "\n%{http_code}" -X POST "${API_URL}/vms/$stopped_vm/start" || echo "")
+    local repeat_status="${start_response##*$'\n'}"
+    start_response="${start_response%$'\n'*}"
     
-    if echo "$start_response" | python3 -m json.tool >/dev/null 2>&1; then
-        log_info "✅ Start endpoint returns valid JSON"
+    if [ "$repeat_status" = "409" ] && echo "$start_response" | python3 -c "
+import sys, json
+assert json.load(sys.stdin)['operation_id']
+" 2>/dev/null; then
+        log_info "✅ Repeated start returns 409 with the operation in progress"
         log_info "   Response: $start_response"
         ((PASSED_TESTS++))
     else
-        log_error "❌ Start endpoint returns invalid JSON"
+        log_error "❌ Repeated start should return 409 with an operation_id, got: $repeat_status"
         log_error "   Response: $start_response"
         ((FAILED_TESTS++))
     fi
@@ -370,12 +376,180 @@ for vm in data:
     fi
 }
 
+# Test POST /vms:batchStart and /vms:batchStop endpoints
+test_vm_batch_endpoints() {
+    log_info "=== Testing POST /vms:batchStart|batchStop Endpoints ==="
+    
+    # Test 1: Missing selector is rejected
+    local bad_status
+    bad_status=$(curl -s -o /dev/null -w "%{http_code}" -X POST -d '{}' "${API_URL}/vms:batchStop" || echo "000")
+    
+    if [ "$bad_status" = "400" ]; then
+        log_info "✅ Batch request without names or prefix returns 400"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Batch request without selector should return 400, got: $bad_status"
+        ((FAILED_TESTS++))
+    fi
+    
+    # Test 2: Unknown VMs are reported per VM without failing the whole request
+    local batch_response
+    batch_response=$(curl -s -X POST -d '{"names": ["non-existent-vm"]}' "${API_URL}/vms:batchStop" || echo "")
+    
+    if echo "$batch_response" | python3 -c "
+import sys, json
+data = json.load(sys.stdin)
+results = data['results']
+exit(0 if len(results) == 1 and results[0]['status_code'] == 404 else 1)
+" 2>/dev/null; then
+        log_info "✅ Batch result reports 404 for non-existent VM"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Batch result missing per-VM 404"
+        log_error "   Response: $batch_response"
+        ((FAILED_TESTS++))
+    fi
+}
+
+# Test GET /operations/{id} endpoint
+test_operations_endpoint() {
+    log_info "=== Testing GET /operations Endpoints ==="
+    
+    # Test 1: Operations list returns 200
+    test_endpoint "/operations" "200" "Operations endpoint responds with 200"
+    
+    # Test 2: Unknown operation returns 404
+    test_endpoint "/operations/non-existent-op" "404" "Non-existent operation returns 404"
+}
+
+# Test /vms filtering and pagination
+test_vms_query() {
+    log_info "=== Testing /vms Filtering and Pagination ==="
+    
+    # Test 1: Filtered, paginated listing returns 200
+    test_endpoint "/vms?state=running&limit=1" "200" "Filtered VMs endpoint responds with 200"
+    
+    # Test 2: A page holds at most `limit` VMs
+    local count
+    count=$(curl -s "${API_URL}/vms?limit=1" | python3 -c "import sys, json; print(len(json.load(sys.stdin)))" 2>/dev/null)
+    if [ "${count:-2}" -le 1 ]; then
+        log_info "✅ ?limit=1 returns at most one VM"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ ?limit=1 returned ${count:-invalid JSON}"
+        ((FAILED_TESTS++))
+    fi
+    
+    # Test 3: Invalid pagination parameters are rejected
+    test_endpoint "/vms?limit=abc" "400" "Non-numeric limit returns 400"
+}
+
+# Test warm pool endpoints
+test_pools_endpoint() {
+    log_info "=== Testing /pools Endpoints ==="
+    
+    # Test 1: Pool list returns 200
+    test_endpoint "/pools" "200" "Pools endpoint responds with 200"
+    
+    # Test 2: Unknown template returns 404
+    test_endpoint "/pools/non-existent-template" "404" "Non-existent pool returns 404"
+    
+    # Test 3: Acquiring from an unknown pool returns 404
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "${API_URL}/pools/non-existent-template/acquire")
+    if [ "$status_code" = "404" ]; then
+        log_info "✅ Acquire from non-existent pool returns 404"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Acquire from non-existent pool returned $status_code"
+        ((FAILED_TESTS++))
+    fi
+}
+
+test_scheduler_endpoint() {
+    log_info "=== Testing /scheduler Endpoint ==="
+    
+    # Test 1: Scheduler state returns 200
+    test_endpoint "/scheduler" "200" "Scheduler endpoint responds with 200"
+    
+    # Test 2: A non-integer start priority is rejected before any VM lookup
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "${API_URL}/vms/non-existent-vm/start?priority=high")
+    if [ "$status_code" = "400" ]; then
+        log_info "✅ Invalid start priority returns 400"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Invalid start priority returned $status_code"
+        ((FAILED_TESTS++))
+    fi
+}
+
+test_provision_endpoint() {
+    log_info "=== Testing /provision Endpoints ==="
+    
+    # Test 1: Run list returns 200
+    test_endpoint "/provision" "200" "Provision endpoint responds with 200"
+    
+    # Test 2: Unknown run returns 404
+    test_endpoint "/provision/non-existent-run" "404" "Non-existent provisioning run returns 404"
+    
+    # Test 3: Image cache status returns 200
+    test_endpoint "/images" "200" "Image cache endpoint responds with 200"
+    
+    # Test 4: Unknown template is rejected with 400
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "${API_URL}/provision" \
+        -H 'Content-Type: application/json' -d '{"vms": ["test-vm=non-existent-template"]}')
+    if [ "$status_code" = "400" ]; then
+        log_info "✅ Provisioning an unknown template returns 400"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Provisioning an unknown template returned $status_code"
+        ((FAILED_TESTS++))
+    fi
+}
+
+# Test GET /vms/{name}/logs endpoint
+test_vm_logs_endpoint() {
+    log_info "=== Testing GET /vms/{name}/logs Endpoint ==="
+    
+    # Test 1: Unknown VM returns 404
+    test_endpoint "/vms/non-existent-vm/logs" "404" "Logs of a non-existent VM return 404"
+    
+    # Test 2: A known VM has a log, even if nothing was captured yet
+    local vm_name
+    vm_name=$(curl -s "${API_URL}/vms?limit=1" | python3 -c "import sys, json; print(json.load(sys.stdin)[0]['name'])" 2>/dev/null)
+    if [ -z "$vm_name" ]; then
+        log_warn "⚠️  No VMs found, skipping log tests"
+        return
+    fi
+    test_json_response "/vms/${vm_name}/logs" "VM logs are valid JSON"
+    
+    # Test 3: A follow ends by its timeout at the latest
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" --max-time 10 "${API_URL}/vms/${vm_name}/logs?follow=1&timeout=2")
+    if [ "$status_code" = "200" ]; then
+        log_info "✅ Following VM logs ends within its timeout"
+        ((PASSED_TESTS++))
+    else
+        log_error "❌ Following VM logs returned $status_code"
+        ((FAILED_TESTS++))
+    fi
+}
+
 check_api_running
 test_health_endpoint
 test_vms_endpoint
+test_vms_query
 test_vm_detail_endpoint
 test_vm_start_endpoint
 test_vm_stop_endpoint
+test_vm_batch_endpoints
+test_operations_endpoint
+test_vm_logs_endpoint
+test_pools_endpoint
+test_scheduler_endpoint
+test_provision_endpoint
 
 echo ""
 echo "=== Test Summary ==="
@@ -0,0 +1,266 @@
+#!/bin/bash
+
+set -euo pipefail
+
+# Test suite for the VM API federation front end
+# Starts two VM API nodes against fake tart binaries plus a federation
+# server in front of them, then exercises merged reads and routing
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+PROJECT_ROOT="$(cd "${SCRIPT_DIR}/.." && pwd)"
+
+# Colors for output
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+YELLOW='\033[1;33m'
+NC='\033[0m'
+
+FAILED_TESTS=0
+PASSED_TESTS=0
+NODE_A_PORT=18182
+NODE_B_PORT=18183
+FEDERATION_PORT=18184
+FEDERATION_URL="http://localhost:${FEDERATION_PORT}"
+WORK_DIR="$(mktemp -d)"
+PIDS=()
+
+log_info() {
+    echo -e "${GREEN}[INFO]${NC} $1"
+}
+
+log_error() {
+    echo -e "${RED}[ERROR]${NC} $1"
+}
+
+log_warn() {
+    echo -e "${YELLOW}[WARN]${NC} $1"
+}
+
+cleanup() {
+    for pid in "${PIDS[@]}"; do
+        kill "$pid" 2>/dev/null || true
+    done
+    pkill -f "^fake-tart-run" 2>/dev/null || true
+    rm -rf "$WORK_DIR"
+}
+trap cleanup EXIT
+
+pass() {
+    log_info "✅ $1"
+    PASSED_TESTS=$((PASSED_TESTS + 1))
+}
+
+fail() {
+    log_error "❌ $1"
+    FAILED_TESTS=$((FAILED_TESTS + 1))
+}
+
+# Evaluate a Python expression against the JSON on stdin (bound to `d`)
+json_eval() {
+    python3 -c "import sys, json; d = json.load(sys.stdin); print($1)" 2>/dev/null || echo ""
+}
+
+wait_for() {
+    local url="$1"
+    for _ in $(seq 1 50); do
+        if curl -s --connect-timeout 1 "$url" >/dev/null 2>&1; then
+            return 0
+        fi
+        sleep 0.2
+    done
+    return 1
+}
+
+start_node() {
+    local name="$1"
+    local port="$2"
+    local vm_count="$3"
+    local tools="${WORK_DIR}/${name}"
+
+    python3 -c "import sys; sys.path.insert(0, '${SCRIPT_DIR}/benchmark'); \
+from fake_tools import write_fake_tools; write_fake_tools('${tools}', vm_count=${vm_count})"
+    TART_BINARY="${tools}/tart-binary" \
+    VM_API_PORT="$port" \
+    VM_API_IMAGE_INDEX="${tools}/images.json" \
+    VM_API_STATE_DB="${tools}/state.db" \
+    VM_API_LOG_DIR="${tools}/vm-logs" \
+    VM_API_IMAGE_PREPULL=0 \
+    VM_API_HOST_MEMORY_MB=131072 \
+    VM_API_HOST_CPUS=16 \
+    VM_API_BOOT_TIMEOUT=3 \
+        python3 "${PROJECT_ROOT}/scripts/minimal-vm-api.py" > "${WORK_DIR}/${name}.log" 2>&1 &
+    PIDS+=("$!")
+    NODE_PIDS["$name"]="$!"
+}
+
+declare -A NODE_PIDS
+
+log_info "Starting two fake VM API nodes and the federation server"
+start_node node-a "$NODE_A_PORT" 4
+start_node node-b "$NODE_B_PORT" 6
+wait_for "http://localhost:${NODE_A_PORT}/health" || { log_error "node-a did not start"; exit 1; }
+wait_for "http://localhost:${NODE_B_PORT}/health" || { log_error "node-b did not start"; exit 1; }
+
+VM_FEDERATION_PORT="$FEDERATION_PORT" \
+VM_FEDERATION_INTERVAL=1 \
+VM_FEDERATION_NODES="node-a=http://localhost:${NODE_A_PORT},node-b=http://localhost:${NODE_B_PORT}" \
+    python3 "${PROJECT_ROOT}/scripts/vm-federation.py" > "${WORK_DIR}/federation.log" 2>&1 &
+PIDS+=("$!")
+wait_for "${FEDERATION_URL}/health" || { log_error "federation server did not start"; exit 1; }
+
+test_health_endpoint() {
+    log_info "=== Testing /health and /nodes ==="
+
+    local up
+    up=$(curl -s "${FEDERATION_URL}/health" | json_eval 'd["up"]')
+    if [ "$up" = "2" ]; then
+        pass "Both nodes are up"
+    else
+        fail "Expected 2 nodes up, got '$up'"
+    fi
+
+    local loads
+    loads=$(curl -s "${FEDERATION_URL}/nodes" | json_eval 'all(n["load"] is not None for n in d)')
+    if [ "$loads" = "True" ]; then
+        pass "Every node reports a load"
+    else
+        fail "Node list is missing loads"
+    fi
+}
+
+test_merged_inventory() {
+    log_info "=== Testing merged /vms ==="
+
+    local a b merged
+    a=$(curl -s "http://localhost:${NODE_A_PORT}/vms" | json_eval 'len(d)')
+    b=$(curl -s "http://localhost:${NODE_B_PORT}/vms" | json_eval 'len(d)')
+    merged=$(curl -s "${FEDERATION_URL}/vms" | json_eval 'len(d)')
+    if [ -n "$a" ] && [ -n "$b" ] && [ "$merged" = "$((a + b))" ]; then
+        pass "Merged inventory has every node's VMs ($merged)"
+    else
+        fail "Merged inventory has '$merged' VMs, nodes have '$a' + '$b'"
+    fi
+
+    local hosts
+    hosts=$(curl -s "${FEDERATION_URL}/vms" | json_eval '",".join(sorted({vm["host"] for vm in d}))')
+    if [ "$hosts" = "node-a,node-b" ]; then
+        pass "Every VM carries its host"
+    else
+        fail "Unexpected hosts '$hosts'"
+    fi
+
+    local only_a
+    only_a=$(curl -s "${FEDERATION_URL}/vms?host=node-a" | json_eval 'len(d)')
+    if [ "$only_a" = "$a" ]; then
+        pass "?host= narrows the inventory to one node"
+    else
+        fail "?host=node-a returned '$only_a' VMs, expected '$a'"
+    fi
+
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" "${FEDERATION_URL}/vms/non-existent-vm")
+    if [ "$status_code" = "404" ]; then
+        pass "Non-existent VM returns 404"
+    else
+        fail "Non-existent VM returned $status_code"
+    fi
+}
+
+test_start_routing() {
+    log_info "=== Testing start routing ==="
+
+    # vm-0001 is stopped on both nodes, so it should go to the least loaded one
+    local expected response host op_id
+    expected=$(curl -s "${FEDERATION_URL}/nodes" | \
+        json_eval 'min((n for n in d if n["up"]), key=lambda n: (round(n["load"], 3), n["running_vms"], n["name"]))["name"]')
+    response=$(curl -s -X POST "${FEDERATION_URL}/vms/vm-0001/start")
+    host=$(echo "$response" | json_eval 'd["host"]')
+    op_id=$(echo "$response" | json_eval 'd["operation_id"]')
+    if [ -n "$expected" ] && [ "$host" = "$expected" ] && [[ "$op_id" == "$host:"* ]]; then
+        pass "Start routed to the least loaded node ($host) with a host-prefixed operation ID"
+    else
+        fail "Expected a start on '$expected', got: $response"
+    fi
+
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" "${FEDERATION_URL}/operations/${op_id}")
+    if [ "$status_code" = "200" ]; then
+        pass "Operation is followed through the federation"
+    else
+        fail "Operation lookup returned $status_code"
+    fi
+
+    # vm-0000 is running, so the start goes to the node running it, which refuses it
+    local running_hosts
+    running_hosts=$(curl -s "${FEDERATION_URL}/vms?state=running" | \
+        json_eval '",".join(sorted(vm["host"] for vm in d if vm["name"] == "vm-0000"))')
+    response=$(curl -s -w "\n%{http_code}" -X POST "${FEDERATION_URL}/vms/vm-0000/start")
+    status_code="${response##*$'\n'}"
+    host=$(echo "${response%$'\n'*}" | json_eval 'd["host"]')
+    if [ "$status_code" = "409" ] && [ -n "$host" ] && [[ ",$running_hosts," == *",$host,"* ]]; then
+        pass "Starting a running VM returns 409 from the node running it ($host)"
+    else
+        fail "Starting running vm-0000 (on '$running_hosts') returned $status_code from '$host'"
+    fi
+
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "${FEDERATION_URL}/vms/non-existent-vm/start")
+    if [ "$status_code" = "404" ]; then
+        pass "Starting a non-existent VM returns 404"
+    else
+        fail "Starting a non-existent VM returned $status_code"
+    fi
+}
+
+test_node_registry() {
+    log_info "=== Testing node registration ==="
+
+    local status_code
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "${FEDERATION_URL}/nodes" -d '{"name": "bad"}')
+    if [ "$status_code" = "400" ]; then
+        pass "Registering a node without a URL returns 400"
+    else
+        fail "Registering a node without a URL returned $status_code"
+    fi
+
+    # Take node-b down: once its health checks fail it leaves the merged view
+    kill "${NODE_PIDS[node-b]}"
+    local up=""
+    for _ in $(seq 1 20); do
+        up=$(curl -s "${FEDERATION_URL}/health" | json_eval 'd["up"]')
+        [ "$up" = "1" ] && break
+        sleep 0.5
+    done
+    local hosts
+    hosts=$(curl -s "${FEDERATION_URL}/vms" | json_eval '",".join(sorted({vm["host"] for vm in d}))')
+    if [ "$up" = "1" ] && [ "$hosts" = "node-a" ]; then
+        pass "A failed node is taken out of the merged inventory"
+    else
+        fail "After stopping node-b: up='$up', hosts='$hosts'"
+    fi
+
+    status_code=$(curl -s -o /dev/null -w "%{http_code}" -X DELETE "${FEDERATION_URL}/nodes/node-b")
+    if [ "$status_code" = "200" ]; then
+        pass "A node can be deregistered"
+    else
+        fail "Deregistering node-b returned $status_code"
+    fi
+}
+
+test_health_endpoint
+test_merged_inventory
+test_start_routing
+test_node_registry
+
+echo ""
+echo "=== Test Summary ==="
+echo "Passed: ${PASSED_TESTS}"
+echo "Failed: ${FAILED_TESTS}"
+echo ""
+
+if [ ${FAILED_TESTS} -eq 0 ]; then
+    echo "✅ All tests passed!"
+    exit 0
+else
+    echo "❌ Some tests failed"
+    exit 1
+fi